@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Corpus writing throughput: ``write_corpus`` vs ``np.savetxt``.
+
+``np.savetxt`` formats every cell of the walks of label strings with ``%``;
+``write_corpus`` gathers pre-encoded label bytes by node index, with
+``--workers`` threads and shards, plain or gzipped.
+
+Usage:
+  python benchmarks/bench_corpus.py --blocks 20 --block-size 500
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+from argparse import ArgumentParser
+
+import numpy as np
+
+from jwalk import build_adjacency_matrix, walk_graph_indices, write_corpus
+
+from common import planted_partition_edges, timer
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--blocks', default=20, type=int)
+    parser.add_argument('--block-size', default=500, type=int)
+    parser.add_argument('--num-walks', default=20, type=int)
+    parser.add_argument('--walk-length', default=40, type=int)
+    parser.add_argument('--workers', default=4, type=int)
+    args = parser.parse_args()
+
+    edges, _ = planted_partition_edges(args.blocks, args.block_size)
+    graph, labels = build_adjacency_matrix(edges, undirected=True)
+    walk_indices, _ = walk_graph_indices(graph, args.walk_length,
+                                         args.num_walks, args.workers, seed=0)
+    folder = tempfile.mkdtemp()
+    cases = [('write_corpus', 'corpus.txt', 1, 1),
+             ('threads', 'corpus.txt', 1, args.workers),
+             ('shards', 'corpus.txt', args.workers, args.workers),
+             ('gzip', 'corpus.txt.gz', 1, 1),
+             ('gzip threads', 'corpus.txt.gz', 1, args.workers),
+             ('gzip shards', 'corpus.txt.gz', args.workers, args.workers)]
+    try:
+        timings = {}
+        with timer(timings, 'savetxt'):
+            path = os.path.join(folder, 'savetxt.txt')
+            np.savetxt(path, np.asarray(labels)[walk_indices], fmt='%s')
+        text_bytes = os.path.getsize(path)
+
+        print('{:<14} {:>10} {:>10} {:>12}'.format('writer', 'seconds',
+                                                    'MB/s', 'file MB'))
+        print('{:<14} {:>10.2f} {:>10.1f} {:>12.1f}'.format(
+            'np.savetxt', timings['savetxt'],
+            text_bytes / 1e6 / timings['savetxt'], text_bytes / 1e6))
+        for name, filename, num_shards, n_jobs in cases:
+            with timer(timings, name):
+                paths = write_corpus(walk_indices,
+                                     os.path.join(folder, name + filename),
+                                     labels, num_shards, n_jobs)
+            size = sum(os.path.getsize(path) for path in paths)
+            print('{:<14} {:>10.2f} {:>10.1f} {:>12.1f}'.format(
+                name, timings[name], text_bytes / 1e6 / timings[name],
+                size / 1e6))
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    main()
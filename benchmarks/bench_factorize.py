@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""NetMF factorization vs walks + Word2Vec: wall time and quality.
+
+Both engines embed the same planted partition graph with the same window;
+quality is block separation AUC. NetMF is timed for each ``--prune`` level.
+
+Usage:
+  python benchmarks/bench_factorize.py --blocks 20 --block-size 500
+"""
+from __future__ import print_function
+
+from argparse import ArgumentParser
+
+import numpy as np
+
+from jwalk import build_adjacency_matrix, factorize_graph, walk_and_train
+
+from common import block_separation_auc, planted_partition_edges, timer
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--blocks', default=20, type=int)
+    parser.add_argument('--block-size', default=500, type=int)
+    parser.add_argument('--embedding-size', default=64, type=int)
+    parser.add_argument('--num-walks', default=5, type=int)
+    parser.add_argument('--walk-length', default=20, type=int)
+    parser.add_argument('--window-size', default=5, type=int)
+    parser.add_argument('--prune', default=[1.0, 2.0], type=float,
+                        nargs='+')
+    parser.add_argument('--workers', default=4, type=int)
+    args = parser.parse_args()
+
+    edges, blocks = planted_partition_edges(args.blocks, args.block_size)
+    graph, labels = build_adjacency_matrix(edges, undirected=True)
+    blocks = blocks[np.asarray(labels).astype(int)]
+    timings = {}
+
+    with timer(timings, 'walks'):
+        model, _ = walk_and_train(graph, labels, args.walk_length,
+                                  args.num_walks, args.embedding_size,
+                                  args.window_size, args.workers, seed=0)
+    walked = np.array([model.wv[label] for label in labels])
+
+    print('{:<16} {:>10} {:>8}'.format('engine', 'seconds', 'AUC'))
+    print('{:<16} {:>10.2f} {:>8.3f}'.format(
+        'walks+word2vec', timings['walks'],
+        block_separation_auc(walked, blocks)))
+    for prune in args.prune:
+        name = 'netmf prune=%g' % prune
+        with timer(timings, name):
+            vectors = factorize_graph(graph, args.embedding_size,
+                                      args.window_size, prune=prune, seed=0)
+        print('{:<16} {:>10.2f} {:>8.3f}'.format(
+            name, timings[name], block_separation_auc(vectors, blocks)))
+
+
+if __name__ == '__main__':
+    main()
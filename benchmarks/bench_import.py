@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Import-time benchmark.
+
+Every statement runs in a fresh interpreter so module caches don't hide the
+cost. Reports the best wall time out of ``--repeat`` runs and which heavy
+dependencies ended up loaded.
+
+Usage:
+  python benchmarks/bench_import.py --repeat 5
+"""
+from __future__ import print_function
+
+import sys
+import subprocess
+from argparse import ArgumentParser
+
+HEAVY_MODULES = ('gensim', 'joblib', 'pandas', 'scipy.sparse')
+
+STATEMENTS = [
+    'import jwalk',
+    'import jwalk.__main__; jwalk.__main__.create_parser()',
+    'from jwalk import load_edges',
+    'from jwalk import build_adjacency_matrix',
+    'from jwalk import walk_graph',
+    'from jwalk import train_model',
+]
+
+PROFILE = """
+import sys, time
+t = time.time()
+{statement}
+elapsed = time.time() - t
+print(elapsed)
+print(' '.join(m for m in {heavy!r} if m in sys.modules))
+"""
+
+
+def profile_import(statement, python=sys.executable):
+    """Time ``statement`` in a fresh interpreter.
+
+    Returns:
+        (float, list): seconds elapsed, heavy modules that were imported
+    """
+    code = PROFILE.format(statement=statement, heavy=HEAVY_MODULES)
+    out = subprocess.check_output([python, '-c', code]).decode()
+    elapsed, _, loaded = out.partition('\n')
+    return float(elapsed), loaded.split()
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', default=5, type=int)
+    args = parser.parse_args()
+
+    for statement in STATEMENTS:
+        runs = [profile_import(statement) for _ in range(args.repeat)]
+        best = min(elapsed for elapsed, _ in runs)
+        loaded = runs[0][1]
+        print('{:>8.1f} ms  {:<55} {}'.format(best * 1000, statement,
+                                             ', '.join(loaded) or '-'))
+
+
+if __name__ == '__main__':
+    main()
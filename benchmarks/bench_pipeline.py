@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Pipelined walking + Word2Vec vs the sequential stages.
+
+Times walking and training separately, then the pipeline that overlaps
+them. Its wall time should approach the slower stage instead of the sum;
+both models are scored by block separation on a planted partition graph.
+
+Usage:
+  python benchmarks/bench_pipeline.py --blocks 20 --block-size 500
+"""
+from __future__ import print_function
+
+import tempfile
+from argparse import ArgumentParser
+
+import numpy as np
+
+from jwalk import (build_adjacency_matrix, build_corpus, train_model,
+                   walk_and_train, walk_graph_indices)
+
+from common import block_separation_auc, planted_partition_edges, timer
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--blocks', default=20, type=int)
+    parser.add_argument('--block-size', default=500, type=int)
+    parser.add_argument('--embedding-size', default=64, type=int)
+    parser.add_argument('--num-walks', default=5, type=int)
+    parser.add_argument('--walk-length', default=20, type=int)
+    parser.add_argument('--window-size', default=5, type=int)
+    parser.add_argument('--workers', default=4, type=int)
+    args = parser.parse_args()
+
+    edges, blocks = planted_partition_edges(args.blocks, args.block_size)
+    graph, labels = build_adjacency_matrix(edges, undirected=True)
+    order = np.asarray(labels).astype(int)  # labels are sorted as strings
+    timings = {}
+
+    with timer(timings, 'walk'):
+        walk_indices, counts = walk_graph_indices(
+            graph, args.walk_length, args.num_walks, args.workers, seed=0)
+    with timer(timings, 'train'):
+        with tempfile.NamedTemporaryFile() as f:
+            build_corpus(walk_indices.copy(), f.name, labels)
+            model = train_model(f.name, args.embedding_size,
+                                args.window_size, workers=args.workers,
+                                word_freq=dict(zip(labels, counts)),
+                                corpus_count=walk_indices.shape[0])
+    sequential = np.array([model.wv[label] for label in labels])
+
+    with timer(timings, 'pipeline'):
+        model, _ = walk_and_train(graph, labels, args.walk_length,
+                                  args.num_walks, args.embedding_size,
+                                  args.window_size, args.workers, seed=0)
+    pipelined = np.array([model.wv[label] for label in labels])
+
+    print('{:<12} {:>10} {:>8}'.format('stage', 'seconds', 'AUC'))
+    print('{:<12} {:>10.2f}'.format('walk', timings['walk']))
+    print('{:<12} {:>10.2f}'.format('train', timings['train']))
+    print('{:<12} {:>10.2f} {:>8.3f}'.format(
+        'sequential', timings['walk'] + timings['train'],
+        block_separation_auc(sequential, blocks[order])))
+    print('{:<12} {:>10.2f} {:>8.3f}'.format(
+        'pipeline', timings['pipeline'],
+        block_separation_auc(pipelined, blocks[order])))
+
+
+if __name__ == '__main__':
+    main()
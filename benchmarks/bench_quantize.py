@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Quantized embeddings vs float32: memory, query latency and recall.
+
+Recall@k is the overlap of each encoding's top ``k`` with the exact float32
+top ``k``. Vectors come from a saved model (``--model``) or are drawn around
+random cluster centers.
+
+Usage:
+  python benchmarks/bench_quantize.py --num-vectors 100000 --size 200
+  python benchmarks/bench_quantize.py --model output/model.w2v
+"""
+from __future__ import print_function
+
+from argparse import ArgumentParser
+
+import numpy as np
+
+from jwalk.quantize import QUANTIZERS, quantize_model
+
+from common import timer
+
+METHODS = ['float32', 'float16', 'int8', 'pq']
+
+
+def clustered_vectors(num_vectors, size, num_clusters=100, noise=0.5,
+                      seed=0):
+    """Vectors drawn around random cluster centers, with string labels."""
+    random_state = np.random.RandomState(seed)
+    centers = random_state.randn(num_clusters, size)
+    vectors = (centers[random_state.randint(num_clusters, size=num_vectors)] +
+               noise * random_state.randn(num_vectors, size))
+    labels = np.arange(num_vectors).astype(str)
+    return vectors.astype(np.float32), labels
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--model')
+    parser.add_argument('--num-vectors', default=100000, type=int)
+    parser.add_argument('--size', default=200, type=int)
+    parser.add_argument('--num-queries', default=1000, type=int)
+    parser.add_argument('--num-subspaces', type=int)
+    parser.add_argument('--k', default=10, type=int)
+    args = parser.parse_args()
+
+    if args.model:
+        from gensim.models import Word2Vec
+        model = Word2Vec.load(args.model)
+        encoded = {method: quantize_model(model, method)
+                   for method in METHODS}
+    else:
+        vectors, labels = clustered_vectors(args.num_vectors, args.size)
+        encoded, timings = {}, {}
+        for method in METHODS:
+            kwargs = {'num_subspaces': args.num_subspaces} \
+                if method == 'pq' else {}
+            with timer(timings, method):
+                encoded[method] = QUANTIZERS[method].fit(vectors, labels,
+                                                         **kwargs)
+            print('{:<8} encoded in {:.2f} s'.format(method,
+                                                     timings[method]))
+
+    baseline = encoded['float32']
+    random_state = np.random.RandomState(1)
+    queries = baseline.reconstruct(random_state.choice(
+        len(baseline), min(args.num_queries, len(baseline)), replace=False))
+    exact, _ = baseline.search(queries, args.k)
+
+    print('{:<8} {:>12} {:>8} {:>14} {:>10}'.format(
+        'method', 'bytes', 'ratio', 'ms/query', 'recall@%d' % args.k))
+    for method in METHODS:
+        timings = {}
+        with timer(timings, 'search'):
+            rows, _ = encoded[method].search(queries, args.k)
+        recall = np.mean([len(set(found) & set(truth)) / float(args.k)
+                          for found, truth in zip(rows, exact)])
+        print('{:<8} {:>12} {:>8.1f} {:>14.3f} {:>10.3f}'.format(
+            method, encoded[method].nbytes,
+            baseline.nbytes / float(encoded[method].nbytes),
+            timings['search'] * 1000 / queries.shape[0], recall))
+
+
+if __name__ == '__main__':
+    main()
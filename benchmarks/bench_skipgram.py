@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Native skip-gram trainer vs the gensim text pipeline.
+
+Both train on the same walks of a planted partition graph and are scored by
+how well cosine similarity separates same-block from cross-block node pairs.
+
+Usage:
+  python benchmarks/bench_skipgram.py --blocks 20 --block-size 500
+"""
+from __future__ import print_function
+
+import tempfile
+from argparse import ArgumentParser
+
+import numpy as np
+
+from jwalk import (build_adjacency_matrix, build_corpus, train_model,
+                   train_native, walk_graph_indices)
+
+from common import block_separation_auc, planted_partition_edges, timer
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--blocks', default=20, type=int)
+    parser.add_argument('--block-size', default=500, type=int)
+    parser.add_argument('--embedding-size', default=64, type=int)
+    parser.add_argument('--num-walks', default=5, type=int)
+    parser.add_argument('--walk-length', default=20, type=int)
+    parser.add_argument('--window-size', default=5, type=int)
+    parser.add_argument('--workers', default=4, type=int)
+    args = parser.parse_args()
+
+    edges, blocks = planted_partition_edges(args.blocks, args.block_size)
+    graph, labels = build_adjacency_matrix(edges, undirected=True)
+    order = np.asarray(labels).astype(int)  # labels are sorted as strings
+    walk_indices, counts = walk_graph_indices(graph, args.walk_length,
+                                              args.num_walks, args.workers)
+    num_words = int(counts.sum())
+    timings = {}
+
+    with timer(timings, 'gensim'):
+        with tempfile.NamedTemporaryFile() as f:
+            build_corpus(walk_indices.copy(), f.name, labels)
+            model = train_model(f.name, args.embedding_size,
+                                args.window_size, workers=args.workers,
+                                word_freq=dict(zip(labels, counts)),
+                                corpus_count=walk_indices.shape[0])
+    gensim_vectors = np.array([model.wv[label] for label in labels])
+
+    with timer(timings, 'native'):
+        native_vectors = train_native(walk_indices.copy(), counts,
+                                      args.embedding_size, args.window_size,
+                                      workers=args.workers)
+
+    print('{:<8} {:>10} {:>12} {:>8}'.format('trainer', 'seconds',
+                                            'words/s', 'AUC'))
+    for name, vectors in [('gensim', gensim_vectors),
+                          ('native', native_vectors)]:
+        epochs = 5  # both trainers default to 5 passes
+        print('{:<8} {:>10.2f} {:>12.0f} {:>8.3f}'.format(
+            name, timings[name], num_words * epochs / timings[name],
+            block_separation_auc(vectors, blocks[order])))
+
+
+if __name__ == '__main__':
+    main()
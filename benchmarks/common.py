@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Synthetic graphs and quality metrics shared by the benchmarks."""
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from jwalk.evaluate import rank_auc
+
+
+def planted_partition_edges(num_blocks=20, block_size=500, degree=20,
+                            mixing=0.1, seed=0):
+    """Edges of a planted partition graph with string node labels.
+
+    Each node draws ``degree`` edges, a fraction ``mixing`` of them to nodes
+    outside its block.
+
+    Returns:
+        np.ndarray edges of the form [src, tgt], np.ndarray block of each node
+    """
+    random_state = np.random.RandomState(seed)
+    num_nodes = num_blocks * block_size
+    blocks = np.arange(num_nodes) // block_size
+
+    src = np.repeat(np.arange(num_nodes), degree)
+    outside = random_state.rand(src.shape[0]) < mixing
+    tgt = (blocks[src] * block_size +
+           random_state.randint(block_size, size=src.shape[0]))
+    tgt[outside] = random_state.randint(num_nodes, size=outside.sum())
+
+    edges = np.column_stack([src, tgt]).astype(str)
+    return edges, blocks
+
+
+def block_separation_auc(vectors, blocks, num_pairs=200000, seed=0):
+    """AUC of cosine similarity separating same-block from cross-block pairs.
+
+    Args:
+        vectors (np.ndarray): one row per node, aligned with ``blocks``
+        blocks (np.ndarray): block of each node
+
+    Returns:
+        float
+    """
+    random_state = np.random.RandomState(seed)
+    norms = np.linalg.norm(vectors, axis=1)
+    unit = vectors / np.maximum(norms, 1e-12)[:, None]
+
+    a = random_state.randint(len(blocks), size=num_pairs)
+    b = random_state.randint(len(blocks), size=num_pairs)
+    scores = np.einsum('ij,ij->i', unit[a], unit[b])
+    same = blocks[a] == blocks[b]
+    return rank_auc(scores[same], scores[~same])
+
+
+@contextmanager
+def timer(timings, name):
+    """Record the wall time of a block in ``timings[name]``."""
+    start = time.time()
+    yield
+    timings[name] = time.time() - start
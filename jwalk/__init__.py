@@ -2,10 +2,16 @@
 # flake8: noqa
 """jwalk library.
 
+Public functions are imported lazily so that ``import jwalk`` (and the CLI's
+``--help``) does not pay for gensim, scipy, joblib or pandas until a stage
+actually needs them.
+
 :copyright: (c) 2017 by JW Player.
 :license: Apache 2.0, see LICENSE for more details.
 """
+import sys
 import logging
+import importlib
 
 __title__ = 'jwalk'
 __author__ = 'Kamil Sindi, Nir Yungster'
@@ -23,19 +29,70 @@ except ImportError:
 
 logging.getLogger(__name__).addHandler(NullHandler())
 
-__all__ = []
-from .graph import *
+# public name -> submodule defining it; must match each submodule's __all__
+_LAZY_ATTRS = {
+    'build_adjacency_matrix': 'graph',
+    'build_biadjacency_matrix': 'graph',
+    'encode_edges': 'graph',
+    'symmetrize_edges': 'graph',
+    'astype_graph': 'graph',
+    'walk_graph': 'corpus',
+    'walk_graph_indices': 'corpus',
+    'expected_visit_counts': 'corpus',
+    'build_corpus': 'corpus',
+    'write_corpus': 'corpus',
+    'walk_graph_checkpointed': 'checkpoint',
+    'graph_fingerprint': 'checkpoint',
+    'train_model': 'skipgram',
+    'train_native': 'skipgram',
+    'to_keyed_vectors': 'skipgram',
+    'walk_and_train': 'pipeline',
+    'factorize_graph': 'factorize',
+    'netmf_matrix': 'factorize',
+    'randomized_svd': 'factorize',
+    'quantize_model': 'quantize',
+    'load_quantized': 'quantize',
+    'ColdStart': 'coldstart',
+    'add_vectors': 'coldstart',
+    'split_edges': 'evaluate',
+    'sample_non_edges': 'evaluate',
+    'link_prediction_scores': 'evaluate',
+    'rank_auc': 'evaluate',
+    'hits_at_k': 'evaluate',
+    'WalkStats': 'stats',
+    'LabelStore': 'labels',
+    'load_edges': 'io',
+    'load_graph': 'io',
+    'save_graph': 'io',
+    'load_graph_cached': 'cache',
+    'file_fingerprint': 'cache',
+    'graph_cache_key': 'cache',
+}
 
-__all__ += graph.__all__
+_SUBMODULES = frozenset(_LAZY_ATTRS.values())
 
-from .corpus import *
+__all__ = sorted(_LAZY_ATTRS)
 
-__all__ += corpus.__all__
 
-from .skipgram import *
+def _load(name):
+    """Import the submodule owning ``name`` and cache ``name`` globally."""
+    if name in _SUBMODULES:
+        return importlib.import_module('.' + name, __name__)
+    module = importlib.import_module('.' + _LAZY_ATTRS[name], __name__)
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
 
-__all__ += skipgram.__all__
 
-from .io import *
+if sys.version_info >= (3, 7):  # PEP 562 module __getattr__
+    def __getattr__(name):
+        if name not in _LAZY_ATTRS and name not in _SUBMODULES:
+            raise AttributeError("module %r has no attribute %r"
+                                 % (__name__, name))
+        return _load(name)
 
-__all__ += io.__all__
+    def __dir__():
+        return sorted(set(globals()) | set(__all__))
+else:
+    for _name in __all__:
+        _load(_name)
@@ -3,42 +3,83 @@
 """jwalk CLI.
 
 Prompt parameters:
+  bipartite:        input is user,item[,weight] interactions; walk items
+                    through users without building the item-item graph
+  cache-dir:        reuse graphs built from unchanged edge files (same
+                    options) cached in this directory
+                    (default=$JWALK_CACHE_DIR, no cache if unset)
+  checkpoint-dir:   walk in segments committed to this directory, resuming
+                    a previous run found there; the segments are the
+                    corpus of the gensim trainer
+  combine:          how reciprocal/repeated undirected edges combine:
+                    max, min, sum or mean (default=max)
+  corpus-path:      keep the text corpus of the gensim trainer at this path
+                    (gzipped if it ends in .gz)
+  corpus-shards:    number of files the corpus is split into, written in
+                    parallel as <corpus-path>-0000k-of-0000n (default=1)
   debug:            drop a debugger if an exception is raised
   delimiter:        delimiter for input file
   embedding-size:   dimension of word2vec embedding (default=200)
+  eval-path:        append the --evaluate report (parameters, scores and
+                    stage timings) to this file as a JSON line
+  evaluate:         hold out this fraction of the input edges, train on the
+                    rest and score link prediction of the held-out pairs
+                    against as many unlinked pairs (AUC, hits@10/50/100)
+  graph-path:       save the graph built from the input edges as npz here;
+                    with --infer walk, the graph the model was trained on
   has-header:       boolean if csv has header row
   help (-h):        argparse help
+  index-dtype:      int32 or int64 graph indices (default=smallest that fits)
+  infer:            add vectors of the new nodes of the input edges to the
+                    --model (gensim or quantized npz) without retraining:
+                    neighbors (mean of neighbor vectors) or walk (walks
+                    of window-size steps through the trained graph, the
+                    smoothed vectors cached in <model>.coldstart); new
+                    edges are used in both directions; gensim models are
+                    saved as KeyedVectors (not trainable further)
   input (-i):       file input (edgelist of 2/3 cols or adjacency matrix)
   log-level (-l)    logging level (default=INFO)
   model (-m):       use a pre-existing model
   num-walks (-n):   number of of random walks per graph (default=1)
   output (-o):      file output
-  stats:            boolean to calculate walk statistics [requires pandas]
+  pipeline:         train Word2Vec on batches of walks while walking
+                    (vocab from a counting pass, no corpus file)
+  quantize:         also export vectors as float16, int8 or pq codes to
+                    <output>.<method>.npz (see jwalk.quantize)
+  seed:             random seed of the walks (default=unpredictable)
+  stats:            boolean to log walk statistics
+  stats-path:       save walk statistics (with visit counts) as JSON
+  trainer:          gensim (Word2Vec on a text corpus), native (built-in
+                    skip-gram on node-index walks, saves KeyedVectors)
+                    or netmf (no walks: SVD of the matrix skip-gram
+                    factorizes, see jwalk.factorize) (default=gensim)
+  triangular:       store undirected graph as its upper triangle only
+                    (implies undirected; also pass it for such npz inputs)
   undirected:       make graph undirected
   walk-length:      length of random walks (default=10)
+  weight-dtype:     float32 or float64 edge weights (default=smallest that
+                    fits)
   window-size:      word2vec window size (default=5)
   workers:          number of workers (default=multiprocessing.cpu_count)
 
 Notes:
   To load graph as input, file must be of type npz and with keys:
-  'data', 'indices', 'indptr', 'shape', 'labels'
+  'data', 'indices', 'indptr', 'shape' and either a 'labels' key or the
+  <name>.labels directory written next to it by jwalk.save_graph.
   Labels must be labels of the indices.
 
 Usage:
   jwalk -i tests/data/karate.edgelist -o karate.embeddings --delimiter=' '
 """
 import sys
+import time
 import os.path
 import logging
 import tempfile
 import multiprocessing
+from contextlib import contextmanager
 from argparse import RawDescriptionHelpFormatter, ArgumentParser
 
-from jwalk import (build_adjacency_matrix, build_corpus, train_model,
-                   walk_graph, load_edges, load_graph, save_graph)
-
-DIR_PATH = os.path.dirname(os.path.realpath(__file__))
-
 logger = logging.getLogger(__name__)
 LOGFORMAT = '%(asctime)s %(name)-12s %(levelname)-8s %(message)s'
 
@@ -57,19 +98,39 @@ def debug_hook(type_, value, tb):
 def create_parser():
     parser = ArgumentParser(description=__doc__,
                             formatter_class=RawDescriptionHelpFormatter)
+    parser.add_argument('--bipartite', action='store_true')
+    parser.add_argument('--cache-dir',
+                        default=os.environ.get('JWALK_CACHE_DIR'))
+    parser.add_argument('--checkpoint-dir')
+    parser.add_argument('--combine', default='max',
+                        choices=['max', 'min', 'sum', 'mean'])
+    parser.add_argument('--corpus-path')
+    parser.add_argument('--corpus-shards', default=1, type=int)
     parser.add_argument('--debug', action='store_true')
     parser.add_argument('--delimiter')
     parser.add_argument('--embedding-size', default=200, type=int)
+    parser.add_argument('--eval-path')
+    parser.add_argument('--evaluate', type=float)
     parser.add_argument('--graph-path')
     parser.add_argument('--has-header', action='store_true')
+    parser.add_argument('--index-dtype', choices=['int32', 'int64'])
+    parser.add_argument('--infer', choices=['neighbors', 'walk'])
     parser.add_argument('--input', '-i', dest='infile', required=True)
     parser.add_argument('--log-level', '-l', type=str.upper, default='INFO')
     parser.add_argument('--num-walks', default=1, type=int)
     parser.add_argument('--model', '-m', dest='model_path')
     parser.add_argument('--output', '-o', dest='outfile', required=True)
+    parser.add_argument('--pipeline', action='store_true')
+    parser.add_argument('--quantize', choices=['float16', 'int8', 'pq'])
+    parser.add_argument('--seed', type=int)
     parser.add_argument('--stats', action='store_true')
+    parser.add_argument('--stats-path')
+    parser.add_argument('--trainer', default='gensim',
+                        choices=['gensim', 'native', 'netmf'])
+    parser.add_argument('--triangular', action='store_true')
     parser.add_argument('--undirected', action='store_true')
     parser.add_argument('--walk-length', default=10, type=int)
+    parser.add_argument('--weight-dtype', choices=['float32', 'float64'])
     parser.add_argument('--window-size', default=5, type=int)
     parser.add_argument('--workers', default=multiprocessing.cpu_count(),
                         type=int)
@@ -88,56 +149,338 @@ def main():
     logging.basicConfig(format=LOGFORMAT)
     logger.setLevel(numeric_level)
 
+    if args.evaluate is not None:
+        return evaluate_embedding(**vars(args))
     return jwalk(**vars(args))
 
 
+@contextmanager
+def _stage(timings, name):
+    """Add the wall time of a stage of a run to ``timings[name]``."""
+    start = time.time()
+    yield
+    elapsed = time.time() - start
+    logger.debug("Stage %s took %.2fs", name, elapsed)
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def _report_stats(walk_stats, stats=False, stats_path=None):
+    if stats:
+        logger.info("Walk statistics: \n%s", walk_stats.to_json(indent=2))
+    if stats_path is not None:
+        with open(stats_path, 'w') as f:
+            f.write(walk_stats.to_json(include_counts=True))
+        logger.info("Walk statistics saved: %s", stats_path)
+
+
+def _export_quantized(model, outfile, quantize=None):
+    if quantize is None:
+        return
+    from jwalk import quantize_model
+
+    path = quantize_model(model, quantize).save(
+        '%s.%s.npz' % (outfile, quantize))
+    logger.info("Quantized %s vectors saved: %s", quantize, path)
+
+
+def _load_vectors(model_path):
+    if model_path.lower().endswith('.npz'):
+        from jwalk import load_quantized
+        return load_quantized(model_path)
+    from gensim.utils import SaveLoad
+    return SaveLoad.load(model_path)
+
+
+def _walk_cold_start(store, model_path, graph_path, window_size=5,
+                     triangular=False):
+    """ColdStart of ``--infer walk``, its smoothed vectors cached in
+    ``<model>.coldstart`` for this model, graph and window."""
+    import json
+    from jwalk import ColdStart, load_graph
+    from jwalk.cache import file_fingerprint
+
+    dirname = model_path + '.coldstart'
+    key_path = os.path.join(dirname, 'key.json')
+    key = {'model': file_fingerprint(model_path),
+           'graph': file_fingerprint(graph_path),
+           'window': window_size, 'triangular': triangular}
+    if os.path.exists(key_path):
+        with open(key_path) as f:
+            if json.load(f) == key:
+                logger.info("Loading smoothed vectors from %s", dirname)
+                return ColdStart.load(dirname, store)
+        os.remove(key_path)  # stale until rewritten below
+
+    logger.info("Loading trained graph from %s", graph_path)
+    graph, labels = load_graph(graph_path)
+    cold_start = ColdStart(store, graph, labels, window_size, triangular)
+    cold_start.save(dirname)
+    with open(key_path, 'w') as f:
+        json.dump(key, f)
+    logger.info("Smoothed vectors cached in %s", dirname)
+    return cold_start
+
+
+def infer_vectors(infile, outfile, model_path, method='neighbors',
+                  graph_path=None, window_size=5, delimiter=None,
+                  has_header=False, undirected=True, triangular=False):
+    """Add vectors of the new nodes of an edgelist to a saved model."""
+    from jwalk import ColdStart, add_vectors, load_edges
+
+    assert model_path is not None, "Inferring vectors needs --model"
+    assert method != 'walk' or graph_path is not None, \
+        "Walking from new nodes needs the trained graph (--graph-path)"
+    store = _load_vectors(model_path)
+    if method == 'walk':
+        cold_start = _walk_cold_start(store, model_path, graph_path,
+                                      window_size, triangular)
+    else:
+        cold_start = ColdStart(store, window=1)
+
+    logger.info("Loading new edges from %s", infile)
+    edges = load_edges(infile, delimiter, has_header)
+    labels, vectors = cold_start.infer(edges, undirected or triangular)
+    store = add_vectors(store, labels, vectors)
+    store.save(outfile)
+    logger.info("Added %d vectors, saved: %s", len(labels), outfile)
+    return outfile
+
+
 def jwalk(infile, outfile, num_walks=2, embedding_size=100, window_size=5,
           walk_length=10, delimiter=None, model_path=None, stats=False,
-          has_header=False, workers=3, undirected=False, **kw):
+          has_header=False, workers=3, undirected=False, combine='max',
+          triangular=False, index_dtype=None, weight_dtype=None,
+          bipartite=False, trainer='gensim', stats_path=None, seed=None,
+          pipeline=False, quantize=None, infer=None, graph_path=None,
+          corpus_path=None, corpus_shards=1, checkpoint_dir=None,
+          cache_dir=None, timings=None, **kw):
+    # imported here so that `jwalk --help` does not load gensim, scipy, etc.
+    from jwalk import load_graph, load_graph_cached, save_graph
 
-    outpath = os.path.join(DIR_PATH, '../output')
-    if not os.path.exists(outpath):
-        os.makedirs(outpath)
+    if infer is not None:  # new edges count both ways, see --infer help
+        return infer_vectors(infile, outfile, model_path, infer, graph_path,
+                             window_size, delimiter, has_header, True,
+                             triangular)
 
-    if infile.lower().endswith('.npz'):  # load graph file instead of edges
-        logger.debug("Detected npz extension. Assuming input is CSR matrix.")
-        logger.info("Loading graph from %s", infile)
-        graph, labels = load_graph(infile)
-    else:
-        logger.info("Loading edges from %s", infile)
-        edges = load_edges(infile, delimiter, has_header)
-        logger.debug("Loaded edges of shape %s", edges.shape)
+    assert not (bipartite and (undirected or triangular)), \
+        "Bipartite walks go user -> item -> user, the graph stays directed"
+    with _stage(timings, 'graph'):
+        if infile.lower().endswith('.npz'):  # load graph file, not edges
+            logger.debug("Detected npz extension. "
+                         "Assuming input is CSR matrix.")
+            logger.info("Loading graph from %s", infile)
+            graph, labels = load_graph(infile, index_dtype, weight_dtype)
+        else:
+            graph, labels = load_graph_cached(
+                infile, cache_dir, delimiter=delimiter,
+                has_header=has_header, undirected=undirected,
+                combine=combine, triangular=triangular, bipartite=bipartite,
+                index_dtype=index_dtype, weight_dtype=weight_dtype)
+            if graph_path is not None:
+                logger.info("Saving graph to %s", graph_path)
+                save_graph(graph_path, graph, labels)
+
+    return train_embedding(graph, labels, outfile, num_walks, embedding_size,
+                           window_size, walk_length, model_path, stats,
+                           workers, triangular, bipartite, trainer,
+                           stats_path, seed, pipeline, quantize, corpus_path,
+                           corpus_shards, checkpoint_dir, timings)
+
+
+def train_embedding(graph, labels, outfile, num_walks=2, embedding_size=100,
+                    window_size=5, walk_length=10, model_path=None,
+                    stats=False, workers=3, triangular=False, bipartite=False,
+                    trainer='gensim', stats_path=None, seed=None,
+                    pipeline=False, quantize=None, corpus_path=None,
+                    corpus_shards=1, checkpoint_dir=None, timings=None,
+                    **kw):
+    """Walk a built graph and train vectors on it, as :func:`jwalk` does
+    after loading the graph; the arguments are those of :func:`jwalk`, other
+    keyword arguments are ignored.
 
-        logger.info("Building adjacency matrix")
-        graph, labels = build_adjacency_matrix(edges, undirected)
-        logger.debug("Number of unique nodes: %d", len(labels))
+    Returns:
+        str: ``outfile``
+    """
+    from jwalk import walk_graph_indices
 
-        graph_path = os.path.join(outpath, 'graph.npz')
-        logger.info("Saving graph to %s", graph_path)
-        save_graph(graph_path, graph, labels)
+    if trainer == 'netmf':
+        from jwalk import factorize_graph, to_keyed_vectors
+
+        assert model_path is None and not pipeline, \
+            "Factorization trains a new model without walks"
+        logger.info("Factorizing the NetMF matrix of window %d", window_size)
+        with _stage(timings, 'train'):
+            vectors = factorize_graph(graph, embedding_size, window_size,
+                                      triangular=triangular,
+                                      bipartite=bipartite, seed=seed)
+            model = to_keyed_vectors(vectors, labels)
+        model.save(outfile)
+        logger.info("Vectors saved: %s", outfile)
+        _export_quantized(model, outfile, quantize)
+        return outfile
+
+    if checkpoint_dir is not None:
+        from jwalk import train_model, walk_graph_checkpointed
+
+        assert trainer == 'gensim' and not pipeline and corpus_path is None, \
+            "Checkpointed walks are the corpus of the gensim trainer"
+        logger.info("Doing %d random walks of length %d, committed to %s",
+                    num_walks, walk_length, checkpoint_dir)
+        with _stage(timings, 'walks'):
+            corpus, walk_stats = walk_graph_checkpointed(
+                graph, labels, checkpoint_dir, walk_length, num_walks,
+                workers, triangular, bipartite, seed)
+        _report_stats(walk_stats, stats, stats_path)
+
+        logger.info("Running Word2Vec on %d corpus segments", len(corpus))
+        with _stage(timings, 'train'):
+            model = train_model(corpus, embedding_size, window_size,
+                                workers=workers, model_path=model_path,
+                                word_freq=dict(zip(
+                                    labels, walk_stats.counts.tolist())),
+                                corpus_count=walk_stats.num_walks)
+        model.save(outfile)
+        logger.info("Model saved: %s", outfile)
+        _export_quantized(model, outfile, quantize)
+        return outfile
+
+    if pipeline:
+        from jwalk import walk_and_train
+
+        assert trainer == 'gensim' and model_path is None, \
+            "Pipelined training needs the gensim trainer and a new model"
+        logger.info("Training Word2Vec on %d random walks of length %d as "
+                    "they are generated", num_walks, walk_length)
+        with _stage(timings, 'train'):  # walks included
+            model, walk_stats = walk_and_train(
+                graph, labels, walk_length, num_walks, embedding_size,
+                window_size, workers, triangular=triangular,
+                bipartite=bipartite, seed=seed)
+        _report_stats(walk_stats, stats, stats_path)
+        model.save(outfile)
+        logger.info("Model saved: %s", outfile)
+        _export_quantized(model, outfile, quantize)
+        return outfile
 
     logger.info("Doing %d random walks of length %d", num_walks, walk_length)
-    random_walks, word_freq = walk_graph(graph, labels, walk_length, num_walks,
-                                         workers)
-    logger.debug("Walks shape: %s", random_walks.shape)
+    with _stage(timings, 'walks'):
+        walk_indices, counts, walk_stats = walk_graph_indices(
+            graph, walk_length, num_walks, workers, triangular, bipartite,
+            return_stats=True, seed=seed)
+    logger.debug("Walks shape: %s", walk_indices.shape)
 
-    if stats:
-        import pandas as pd
-        df = pd.DataFrame(random_walks)
-        unique_nodes_in_path = df.apply(lambda x: x.nunique(), axis=1)
-        logger.info("Unique nodes per walk description: \n" +
-                    unique_nodes_in_path.describe().__repr__())
+    _report_stats(walk_stats, stats, stats_path)
+
+    if trainer == 'native':
+        from jwalk import train_native, to_keyed_vectors
+
+        assert model_path is None, "Online training needs the gensim trainer"
+        logger.info("Running native skip-gram on walks")
+        with _stage(timings, 'train'):
+            vectors = train_native(walk_indices, counts, embedding_size,
+                                   window_size, workers=workers)
+            model = to_keyed_vectors(vectors, labels, counts)
+        model.save(outfile)
+        logger.info("Vectors saved: %s", outfile)
+        _export_quantized(model, outfile, quantize)
+        return outfile
+
+    import numpy as np
+    from jwalk import train_model, write_corpus
+
+    assert corpus_shards == 1 or corpus_path is not None, \
+        "Sharding the corpus needs --corpus-path"
+    word_freq = dict(zip(labels, counts.tolist()))
 
     logger.info("Building corpus from walks")
     with tempfile.NamedTemporaryFile(delete=False) as f_corpus:
-        build_corpus(random_walks, outpath=f_corpus.name)
+        with _stage(timings, 'corpus'):
+            np.random.shuffle(walk_indices)
+            corpus = write_corpus(walk_indices, corpus_path or f_corpus.name,
+                                  labels, corpus_shards, workers)
+        del walk_indices
+        logger.info("Corpus written: %s", ', '.join(corpus))
 
         logger.info("Running Word2Vec on corpus")
         corpus_count = len(labels) * num_walks
-        model = train_model(f_corpus.name, embedding_size, window_size,
-                            workers=workers, model_path=model_path,
-                            word_freq=word_freq, corpus_count=corpus_count)
+        with _stage(timings, 'train'):
+            model = train_model(corpus, embedding_size, window_size,
+                                workers=workers, model_path=model_path,
+                                word_freq=word_freq,
+                                corpus_count=corpus_count)
         model.save(outfile)
         logger.info("Model saved: %s", outfile)
 
+    _export_quantized(model, outfile, quantize)
     return outfile
+
+
+def evaluate_embedding(infile, outfile, evaluate=0.1, eval_path=None,
+                       seed=None, delimiter=None, has_header=False,
+                       undirected=False, combine='max', triangular=False,
+                       bipartite=False, index_dtype=None, weight_dtype=None,
+                       graph_path=None, **kw):
+    """Train on the input edges but a held-out fraction and score link
+    prediction of the held-out node pairs (see :mod:`jwalk.evaluate`).
+
+    The graph is built from the training edges as they were loaded, not
+    written out and parsed again. The other keyword arguments are passed on
+    to :func:`train_embedding`.
+
+    Returns:
+        dict: ``params`` of the run, link prediction ``scores`` and
+        ``timings`` of its stages in seconds
+    """
+    import json
+    from jwalk import (build_adjacency_matrix, link_prediction_scores,
+                       load_edges, sample_non_edges, save_graph, split_edges)
+
+    assert not infile.lower().endswith('.npz') and not bipartite and \
+        kw.get('infer') is None, \
+        "Link prediction holds out edges between nodes of an edge list"
+    undirected = undirected or triangular
+    params = dict(kw, infile=infile, outfile=outfile, evaluate=evaluate,
+                  seed=seed, undirected=undirected, combine=combine,
+                  triangular=triangular, index_dtype=index_dtype,
+                  weight_dtype=weight_dtype)
+    for name in ('cache_dir', 'debug', 'log_level'):
+        params.pop(name, None)
+    timings = {}
+
+    with _stage(timings, 'split'):
+        logger.info("Loading edges from %s", infile)
+        edges = load_edges(infile, delimiter, has_header)
+        train_edges, test_pairs = split_edges(edges, evaluate, seed=seed)
+        non_edges = sample_non_edges(edges, len(test_pairs), seed=seed)
+    logger.info("Holding out %d node pairs", len(test_pairs))
+
+    # the training split changes with the seed: it is not worth caching
+    with _stage(timings, 'graph'):
+        logger.info("Building adjacency matrix of the training edges")
+        graph, labels = build_adjacency_matrix(
+            train_edges, undirected, combine, triangular, index_dtype,
+            weight_dtype)
+        del train_edges
+        if graph_path is not None:
+            logger.info("Saving graph to %s", graph_path)
+            save_graph(graph_path, graph, labels)
+    train_embedding(graph, labels, outfile, seed=seed, triangular=triangular,
+                    timings=timings, **kw)
+
+    with _stage(timings, 'score'):
+        scores = link_prediction_scores(_load_vectors(outfile), test_pairs,
+                                        non_edges)
+    logger.info("Link prediction: %s", ', '.join(
+        '%s=%.4f' % (name, scores[name])  # auc, hits@10, ..., hits@100
+        for name in sorted(scores, key=lambda name: (len(name), name))
+        if isinstance(scores[name], float)))
+    logger.info("Stage timings: %s", ', '.join(
+        '%s=%.2fs' % (name, timings[name]) for name in sorted(timings)))
+
+    report = {'params': params, 'scores': scores, 'timings': timings}
+    if eval_path is not None:
+        with open(eval_path, 'a') as f:
+            f.write(json.dumps(report, sort_keys=True) + '\n')
+        logger.info("Evaluation report appended to %s", eval_path)
+    return report
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""Cache of graphs built from edge files.
+
+Building a graph parses the whole edge file. The cache keeps the result in
+``cache_dir/<key>/`` as ``.npy`` files that load memory-mapped, ``key``
+hashing the fingerprint of the file (size, modification time and SHA-1 of
+the content) together with every option that changes the graph and the
+``CACHE_FORMAT`` of entries. Entries are
+written to a temporary directory and renamed into place, so concurrent jobs
+never read a partial entry; the first job to finish wins.
+"""
+import os
+import json
+import errno
+import shutil
+import hashlib
+import logging
+import tempfile
+
+import numpy as np
+
+__all__ = ['file_fingerprint', 'graph_cache_key', 'load_graph_cached']
+
+logger = logging.getLogger(__name__)
+
+HASH_BLOCK_BYTES = 1 << 20
+# part of every key: bump when the layout or the dtypes of entries change
+CACHE_FORMAT = 1
+GRAPH_ARRAYS = ('data', 'indices', 'indptr', 'shape')
+
+
+def file_fingerprint(fpath):
+    """Size, modification time and SHA-1 of a file.
+
+    Returns:
+        dict
+    """
+    stat = os.stat(fpath)
+    sha1 = hashlib.sha1()
+    with open(fpath, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b''):
+            sha1.update(block)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime,
+            'sha1': sha1.hexdigest()}
+
+
+def graph_cache_key(fpath, **options):
+    """Cache key of the graph built from ``fpath`` with ``options``.
+
+    Returns:
+        str: hex digest
+    """
+    description = json.dumps({'format': CACHE_FORMAT,
+                              'file': file_fingerprint(fpath),
+                              'options': options}, sort_keys=True)
+    return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+
+def _build_graph(fpath, delimiter=None, has_header=False, undirected=False,
+                 combine='max', triangular=False, bipartite=False,
+                 index_dtype=None, weight_dtype=None):
+    """Load an edge file and build its (bi)adjacency matrix."""
+    from jwalk.graph import build_adjacency_matrix, build_biadjacency_matrix
+    from jwalk.io import load_edges
+
+    logger.info("Loading edges from %s", fpath)
+    edges = load_edges(fpath, delimiter, has_header)
+    logger.debug("Loaded edges of shape %s", edges.shape)
+
+    if bipartite:
+        logger.info("Building user->item biadjacency matrix")
+        csr_matrix, labels = build_biadjacency_matrix(edges, index_dtype,
+                                                      weight_dtype)
+        logger.debug("Number of unique users: %d", csr_matrix.shape[0])
+    else:
+        logger.info("Building adjacency matrix")
+        csr_matrix, labels = build_adjacency_matrix(
+            edges, undirected or triangular, combine, triangular,
+            index_dtype, weight_dtype)
+    logger.debug("Number of unique nodes: %d", len(labels))
+    return csr_matrix, labels
+
+
+def _makedirs(dirname):
+    """``os.makedirs`` that tolerates a concurrent job creating
+    ``dirname``."""
+    try:
+        os.makedirs(dirname)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(dirname):
+            raise
+
+
+def _umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def _save_entry(dirname, csr_matrix, labels):
+    for name in GRAPH_ARRAYS:
+        np.save(os.path.join(dirname, name + '.npy'),
+                np.asarray(getattr(csr_matrix, name)))
+    labels.save(os.path.join(dirname, 'labels'))
+
+
+def _load_entry(dirname, bipartite=False, index_dtype=None,
+                weight_dtype=None):
+    """Graph of a cache entry, its arrays memory-mapped copy-on-write (the
+    walk kernels take writable buffers).
+
+    The arrays are cast to the dtypes a build would pick, so a cache hit
+    returns the same graph as a miss (scipy may also downcast the indices).
+    """
+    import scipy.sparse as sps
+    from jwalk.graph import astype_graph
+    from jwalk.labels import LabelStore
+
+    arrays = {name: np.load(os.path.join(dirname, name + '.npy'),
+                            mmap_mode='c')
+              for name in GRAPH_ARRAYS}
+    csr_matrix = sps.csr_matrix(
+        (arrays['data'], arrays['indices'], arrays['indptr']),
+        shape=tuple(arrays['shape']), copy=False)
+    labels = LabelStore.load(os.path.join(dirname, 'labels'))
+    num_nodes = csr_matrix.shape[1] if bipartite else csr_matrix.shape[0]
+    assert len(labels) == num_nodes and \
+        (bipartite or csr_matrix.shape[0] == csr_matrix.shape[1]), \
+        "Cache entry %s does not match its labels" % dirname
+    return astype_graph(csr_matrix, index_dtype, weight_dtype), labels
+
+
+def load_graph_cached(fpath, cache_dir=None, **options):
+    """Graph of an edge file, from the cache if the file has not changed.
+
+    Args:
+        fpath (str): edges file
+        cache_dir (str): cache directory, created if missing (default=None,
+            always build)
+        **options: ``delimiter``, ``has_header``, ``undirected``,
+            ``combine``, ``triangular``, ``bipartite``, ``index_dtype`` and
+            ``weight_dtype``, as for the graph builders
+
+    Returns:
+        scipy.sparse.csr_matrix: adjacency matrix, LabelStore: labels
+    """
+    if cache_dir is None:
+        return _build_graph(fpath, **options)
+
+    entry = os.path.join(cache_dir, graph_cache_key(fpath, **options))
+    if os.path.isdir(entry):
+        logger.info("Loading cached graph of %s from %s", fpath, entry)
+        return _load_entry(entry, options.get('bipartite', False),
+                           options.get('index_dtype'),
+                           options.get('weight_dtype'))
+
+    csr_matrix, labels = _build_graph(fpath, **options)
+    _makedirs(cache_dir)
+    tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=cache_dir)
+    try:
+        _save_entry(tmp_dir, csr_matrix, labels)
+        # mkdtemp makes the directory private, entries are shared
+        os.chmod(tmp_dir, 0o777 & ~_umask())
+        os.rename(tmp_dir, entry)
+        logger.info("Cached graph of %s in %s", fpath, entry)
+    except OSError:  # written by a concurrent job in the meantime
+        if not os.path.isdir(entry):
+            raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return csr_matrix, labels
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""Random walks committed to disk segment by segment, resumable.
+
+The walks of each repetition are split into node ranges of about equal cost
+(see :func:`~jwalk.corpus.balanced_chunks`). Every range is walked, shuffled
+and written as a text corpus file next to its own walk statistics (length
+histograms and visits of the nodes it reached), then committed by atomically
+replacing ``manifest.json``, which lists the planned segments, the completed
+ones and the seed of each repetition. A commit thus writes in proportion to
+its segment, not to the graph; the :class:`~jwalk.stats.WalkStats` of a run
+(visit counts for the vocabulary) sum those of its committed segments. Walks
+are seeded per start node, so a run resumed from the manifest writes exactly
+the walks an uninterrupted one would have.
+"""
+import os
+import json
+import hashlib
+import logging
+import collections
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from jwalk import corpus
+from jwalk.stats import WalkStats
+
+__all__ = ['walk_graph_checkpointed', 'graph_fingerprint']
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+# start nodes per segment (at least ``segments_per_job`` segments per job)
+CHECKPOINT_SEGMENT_NODES = 100000
+
+_replace = getattr(os, 'replace', os.rename)  # Python 2 has no os.replace
+
+
+def _write_json(path, obj):
+    """Write JSON next to ``path`` and move it in place atomically."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(obj, f, indent=1)
+    _replace(tmp_path, path)
+
+
+def graph_fingerprint(csr_matrix, labels):
+    """SHA-1 of the structure, weights and labels of a graph.
+
+    Args:
+        csr_matrix (scipy.sparse.csr_matrix): adjacency matrix
+        labels (LabelStore): node labels
+
+    Returns:
+        str: hex digest
+    """
+    sha1 = hashlib.sha1()
+    for array in (csr_matrix.indptr, csr_matrix.indices, csr_matrix.data,
+                  labels.data, labels.offsets):
+        sha1.update(str(array.dtype).encode('ascii'))
+        sha1.update(np.ascontiguousarray(array).view(np.uint8))
+    return sha1.hexdigest()
+
+
+def _plan(csr_matrix, degrees, walk_length, num_walks, n_jobs, seed,
+          segments_per_job):
+    """Seeds of the repetitions and their segments of start nodes, in
+    random order."""
+    if seed is None:  # drawn once, then kept by the manifest
+        seed = int(np.random.randint(2 ** 31 - 1))
+    random_state = np.random.RandomState(seed)
+    seeds = random_state.randint(0, 2 ** 63 - 1, size=num_walks,
+                                 dtype=np.int64)
+    num_nodes = degrees.shape[0]
+    num_segments = max(n_jobs * segments_per_job,
+                       -(-num_nodes // CHECKPOINT_SEGMENT_NODES))
+    costs = corpus.estimate_walk_cost(degrees, walk_length)
+    ranges = corpus.balanced_chunks(costs, num_segments)
+    segments = [[repeat, int(first), int(last)]
+                for repeat in range(num_walks) for first, last in ranges]
+    # the corpus is read in segment order: mix node ranges and repetitions
+    order = random_state.permutation(len(segments))
+    return seed, [int(s) for s in seeds], [segments[k] for k in order]
+
+
+def walk_graph_checkpointed(csr_matrix, labels, checkpoint_dir,
+                            walk_length=40, num_walks=1, n_jobs=1,
+                            triangular=False, bipartite=False, seed=None,
+                            compress=False, segments_per_job=4):
+    """Random walks written as corpus segments under ``checkpoint_dir``.
+
+    Resumes from ``checkpoint_dir/manifest.json`` if it exists: completed
+    segments are kept and the rest is walked with the same seeds. The
+    manifest records a :func:`graph_fingerprint`, so a checkpoint is only
+    resumed on the very graph it was made from. Segments are walked by
+    ``n_jobs`` threads (the walk kernels release the GIL), at most
+    ``2 * n_jobs`` ahead of the oldest uncommitted one, and committed in
+    order as soon as they are done.
+
+    Args:
+        csr_matrix: adjacency matrix, as for
+            :func:`~jwalk.corpus.walk_graph_indices`
+        labels: node labels of ``csr_matrix``
+        checkpoint_dir (str): directory of the segments and manifest
+        walk_length: maximum length of random walk (default=40)
+        num_walks: number of walks to do for each node
+        n_jobs: number of cores to use (default=1)
+        triangular: if True, ``csr_matrix`` is the upper triangle of an
+            undirected graph
+        bipartite: if True, ``csr_matrix`` is a user->item biadjacency matrix
+        seed: random seed (default=None, drawn and kept in the manifest)
+        compress: gzip the segments (default=False)
+        segments_per_job: segments per job and repetition (default=4)
+
+    Returns:
+        list of segment paths (a sharded corpus), WalkStats of all walks
+    """
+    from jwalk.labels import LabelStore
+
+    if n_jobs < 0:
+        n_jobs = max(multiprocessing.cpu_count() + 1 + n_jobs, 1)
+    if not os.path.isdir(checkpoint_dir):
+        os.makedirs(checkpoint_dir)
+    manifest_path = os.path.join(checkpoint_dir, MANIFEST)
+
+    kernel, args, degrees = corpus._walker(csr_matrix, walk_length,
+                                           triangular, bipartite)
+    num_nodes = degrees.shape[0]
+    labels = LabelStore.from_labels(labels)
+    params = {'walk_length': walk_length, 'num_walks': num_walks,
+              'triangular': triangular, 'bipartite': bipartite,
+              'compress': compress, 'shape': list(csr_matrix.shape),
+              'nnz': int(csr_matrix.nnz),
+              'graph': graph_fingerprint(csr_matrix, labels)}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        assert manifest['params'] == params and \
+            seed in (None, manifest['seed']), \
+            "Checkpoint in %s was made with other parameters" % checkpoint_dir
+        logger.info("Resuming from %d/%d committed segments",
+                    len(manifest['completed']), len(manifest['segments']))
+    else:
+        seed, seeds, segments = _plan(csr_matrix, degrees, walk_length,
+                                      num_walks, n_jobs, seed,
+                                      segments_per_job)
+        manifest = {'params': params, 'seed': seed, 'seeds': seeds,
+                    'segments': segments, 'completed': []}
+    totals = {'lengths': np.zeros(walk_length + 1, dtype=np.int64),
+              'distinct': np.zeros(walk_length + 1, dtype=np.int64),
+              'counts': np.zeros(num_nodes, dtype=np.int64),
+              'starts': np.zeros(num_nodes, dtype=np.int64)}
+    for k in manifest['completed']:
+        with np.load(_stats_path(checkpoint_dir, k)) as f:
+            _add_stats(totals, manifest['segments'][k], f['lengths'],
+                       f['distinct'], f['nodes'], f['visits'])
+
+    suffix = '.txt.gz' if compress else '.txt'
+    pending = [k for k in range(len(manifest['segments']))
+               if k not in set(manifest['completed'])]
+
+    def walk(k):
+        repeat, first, last = manifest['segments'][k]
+        return corpus._walk_chunk(kernel, args, first, last,
+                                  manifest['seeds'][repeat])
+
+    def commit(k, result):
+        repeat, first, _ = manifest['segments'][k]
+        stats = _commit(checkpoint_dir, manifest, k, result, labels, suffix,
+                        n_jobs, (manifest['seeds'][repeat] + first) % 2 ** 32)
+        _add_stats(totals, manifest['segments'][k], *stats)
+
+    pool = ThreadPool(n_jobs)
+    running = collections.deque()
+    try:
+        for k in pending:
+            running.append((k, pool.apply_async(walk, (k,))))
+            if len(running) >= 2 * n_jobs:
+                k, result = running.popleft()
+                commit(k, result.get())
+        while running:
+            k, result = running.popleft()
+            commit(k, result.get())
+    finally:
+        pool.terminate()  # drops the walks of uncommitted segments
+
+    paths = [os.path.join(checkpoint_dir, 'segment-%05d%s' % (k, suffix))
+             for k in range(len(manifest['segments']))]
+    return paths, WalkStats(**totals)
+
+
+def _stats_path(checkpoint_dir, k):
+    return os.path.join(checkpoint_dir, 'segment-%05d.stats.npz' % k)
+
+
+def _add_stats(totals, segment, lengths, distinct, nodes, visits):
+    """Add the stats of a segment to ``totals``; every node of its range
+    starts one walk."""
+    _, first, last = segment
+    totals['lengths'] += lengths
+    totals['distinct'] += distinct
+    totals['counts'][nodes] += visits
+    totals['starts'][first:last] += 1
+
+
+def _commit(checkpoint_dir, manifest, k, result, labels, suffix, n_jobs,
+            shuffle_seed):
+    """Write segment ``k`` and its stats, then the manifest listing it.
+
+    Returns:
+        tuple: histograms of lengths and distinct nodes, the nodes the
+        segment visited and their visits
+    """
+    walk_indices, lengths, distinct = result
+    np.random.RandomState(shuffle_seed).shuffle(walk_indices)
+    name = 'segment-%05d%s' % (k, suffix)
+    tmp_path = os.path.join(checkpoint_dir, '.tmp-' + name)
+    corpus.write_corpus(walk_indices, tmp_path, labels, n_jobs=n_jobs)
+    _replace(tmp_path, os.path.join(checkpoint_dir, name))
+
+    # only the nodes the segment reached, however large the graph
+    nodes, visits = np.unique(walk_indices[walk_indices >= 0],
+                              return_counts=True)
+    stats_path = _stats_path(checkpoint_dir, k)
+    with open(stats_path + '.tmp', 'wb') as f:
+        np.savez(f, lengths=lengths, distinct=distinct, nodes=nodes,
+                 visits=visits)
+    _replace(stats_path + '.tmp', stats_path)
+    manifest['completed'].append(k)
+    _write_json(os.path.join(checkpoint_dir, MANIFEST), manifest)
+    logger.debug("Committed segment %d/%d", len(manifest['completed']),
+                 len(manifest['segments']))
+    return lengths, distinct, nodes, visits
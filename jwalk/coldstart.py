@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""Vectors for new nodes from a trained model, without retraining.
+
+A new node's vector is the expected average of the context vectors a walk
+from it would see, weighted like word2vec's shrinking window: the neighbor
+at distance ``t`` counts ``(window - t + 1) / window``. The walk part that
+runs on the trained graph is folded into one smoothed vector per known node
+upfront (saved with :meth:`ColdStart.save` and memory-mapped by
+:meth:`ColdStart.load`), so a batch of new nodes only gathers the rows of
+the known nodes it links to. ``window=1`` is the weighted mean of the
+neighbor vectors, gathered from the model itself.
+
+Edges between new nodes are resolved by a few rounds of propagation; new
+nodes with no path to a known node within those rounds get zero vectors.
+"""
+import os
+import json
+import time
+import logging
+
+import numpy as np
+import scipy.sparse as sps
+
+from jwalk.labels import LabelStore
+
+__all__ = ['ColdStart', 'add_vectors']
+
+logger = logging.getLogger(__name__)
+
+
+def _model_labels(store):
+    """Labels of the rows of a model or of quantized vectors."""
+    from jwalk.quantize import QuantizedVectors
+
+    if isinstance(store, QuantizedVectors):
+        return store.labels
+    # Word2Vec keeps its KeyedVectors in ``wv``
+    return LabelStore.from_labels(vars(store).get('wv', store).index2word)
+
+
+def _model_rows(store, rows=None):
+    """Float32 vectors of ``rows`` (default=all) of a model or of quantized
+    vectors, decoding only those rows."""
+    from jwalk.quantize import QuantizedVectors
+
+    if isinstance(store, QuantizedVectors):
+        vectors = store.reconstruct(rows)
+    else:
+        keyed_vectors = vars(store).get('wv', store)
+        if hasattr(keyed_vectors, 'vectors'):
+            vectors = keyed_vectors.vectors
+        else:  # gensim < 3.4
+            vectors = keyed_vectors.syn0
+        vectors = vectors if rows is None else vectors[rows]
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def _vector_table(store):
+    """Float32 vectors and labels of a model or of quantized vectors."""
+    return _model_rows(store), _model_labels(store)
+
+
+def _row_normalize(matrix):
+    """Scale the rows of a sparse matrix to sum to 1 (empty rows stay)."""
+    row_sums = np.asarray(matrix.sum(axis=1)).ravel()
+    inverse = np.zeros_like(row_sums)
+    np.divide(1.0, row_sums, out=inverse, where=row_sums > 0)
+    return sps.diags(inverse).dot(matrix).tocsr()
+
+
+class ColdStart(object):
+    """Infer vectors of unseen nodes from their edges to known nodes.
+
+    With ``window > 1`` the smoothed vectors of the whole model are
+    computed once here; :meth:`save` them and :meth:`load` them memory-mapped
+    rather than building a ColdStart for every batch.
+
+    Args:
+        model: trained ``Word2Vec``, ``KeyedVectors`` or
+            :class:`~jwalk.quantize.QuantizedVectors`
+        csr_matrix (scipy.sparse.csr_matrix): trained graph, e.g. from
+            ``load_graph`` (only needed with ``window > 1``)
+        labels (LabelStore): labels of ``csr_matrix``
+        window (int): walk steps averaged, like the Word2Vec window
+            (default=5)
+        triangular (bool): ``csr_matrix`` is an upper triangle
+    """
+
+    def __init__(self, model, csr_matrix=None, labels=None, window=5,
+                 triangular=False):
+        assert window >= 1, "window must be at least 1"
+        assert window == 1 or csr_matrix is not None, \
+            "Walking beyond the new edges needs the trained graph"
+
+        self.model, self.window = model, window
+        self.labels = _model_labels(model)
+        # with window=1 the smoothed vectors are the model's (mass 1)
+        self.smoothed = self.mass = None
+        if window > 1:
+            self._smooth(csr_matrix, labels, triangular)
+
+    def _smooth(self, csr_matrix, labels, triangular=False):
+        """smoothed[i] = sum_t weights[t] * (P^t V)[i]; mass likewise for
+        vectors of ones."""
+        weights = (self.window - np.arange(self.window)) / float(self.window)
+        vectors = _model_rows(self.model)
+        transitions = self._transitions(csr_matrix, labels, triangular)
+        self.smoothed = vectors * float(weights[0])
+        self.mass = np.full(len(self.labels), weights[0])
+        context, reach = vectors, np.ones(len(self.labels))
+        for weight in weights[1:]:
+            context, reach = transitions.dot(context), transitions.dot(reach)
+            self.smoothed += weight * context
+            self.mass += weight * reach
+
+    def save(self, dirname):
+        """Save the smoothed vectors and labels as ``.npy`` files in a
+        directory.
+
+        Args:
+            dirname (str): directory, created if missing
+
+        Returns:
+            str: directory path
+        """
+        assert self.smoothed is not None, \
+            "window=1 uses the model's vectors, there is nothing to save"
+        self.labels.save(os.path.join(dirname, 'labels'))
+        np.save(os.path.join(dirname, 'smoothed.npy'), self.smoothed)
+        np.save(os.path.join(dirname, 'mass.npy'), self.mass)
+        with open(os.path.join(dirname, 'coldstart.json'), 'w') as f:
+            json.dump({'window': self.window}, f)
+        return dirname
+
+    @classmethod
+    def load(cls, dirname, model=None, mmap_mode='r'):
+        """Load smoothed vectors saved by :meth:`save`, memory-mapped by
+        default.
+
+        Args:
+            dirname (str): directory written by :meth:`save`
+            model: the model the vectors were smoothed from (optional)
+            mmap_mode (str): passed to ``np.load`` (default='r')
+
+        Returns:
+            ColdStart
+        """
+        with open(os.path.join(dirname, 'coldstart.json')) as f:
+            window = json.load(f)['window']
+        cold_start = cls.__new__(cls)
+        cold_start.model, cold_start.window = model, window
+        cold_start.labels = LabelStore.load(os.path.join(dirname, 'labels'),
+                                            mmap_mode)
+        cold_start.smoothed = np.load(os.path.join(dirname, 'smoothed.npy'),
+                                      mmap_mode=mmap_mode)
+        cold_start.mass = np.load(os.path.join(dirname, 'mass.npy'),
+                                  mmap_mode=mmap_mode)
+        return cold_start
+
+    def _context(self, rows):
+        """Smoothed vectors and mass of model ``rows``."""
+        if self.smoothed is None:
+            return _model_rows(self.model, rows), np.ones(rows.shape[0])
+        return (np.asarray(self.smoothed[rows], dtype=np.float32),
+                np.asarray(self.mass[rows]))
+
+    def _transitions(self, csr_matrix, labels, triangular=False):
+        """Transition matrix of the trained graph in model row order."""
+        if triangular:
+            diagonal = sps.diags(csr_matrix.diagonal())
+            csr_matrix = csr_matrix + csr_matrix.T - diagonal
+        rows = self.labels.lookup(labels)  # graph node -> model row
+        coo = csr_matrix.tocoo()
+        keep = (rows[coo.row] >= 0) & (rows[coo.col] >= 0)
+        num_rows = len(self.labels)
+        adjacency = sps.csr_matrix(
+            (coo.data[keep].astype(np.float64),
+             (rows[coo.row[keep]], rows[coo.col[keep]])),
+            shape=(num_rows, num_rows))
+        return _row_normalize(adjacency).astype(np.float32)
+
+    def infer(self, edges, undirected=True, iterations=3):
+        """Vectors of the nodes of ``edges`` that the model does not know.
+
+        Args:
+            edges (np.ndarray): a 2 or 3 dim array of the form
+                [src, tgt, [weight]], e.g. from ``load_edges``
+            undirected (bool): also use edges from known to new nodes
+                (default=True)
+            iterations (int): propagation rounds along edges between new
+                nodes (default=3)
+
+        Returns:
+            LabelStore new labels, np.ndarray float32 vectors
+        """
+        assert edges.shape[1] in [2, 3], "Input must contain 2 or 3 columns"
+        start = time.time()
+        if edges.shape[1] == 2:
+            weights = np.ones(edges.shape[0])
+        else:
+            weights = edges[:, 2].astype('float')
+
+        nodes, encoded = np.unique(edges[:, :2], return_inverse=True)
+        encoded = encoded.reshape(-1, 2)
+        known = self.labels.lookup(nodes)
+        new = np.flatnonzero(known < 0)
+        num_known, num_new = len(self.labels), new.shape[0]
+
+        # known nodes keep their model row, new ones follow them
+        columns = known.copy()
+        columns[new] = num_known + np.arange(num_new)
+        src, tgt = columns[encoded[:, 0]], columns[encoded[:, 1]]
+        if undirected:
+            src, tgt = np.r_[src, tgt], np.r_[tgt, src]
+            weights = np.r_[weights, weights]
+        from_new = src >= num_known
+        adjacency = _row_normalize(sps.csr_matrix(
+            (weights[from_new], (src[from_new] - num_known, tgt[from_new])),
+            shape=(num_new, num_known + num_new))).astype(np.float32)
+        to_known, to_new = adjacency[:, :num_known], adjacency[:, num_known:]
+        # only the known neighbors' rows are read from the (mapped) table
+        neighbors = np.unique(to_known.indices)
+        smoothed, mass = self._context(neighbors)
+        to_known = to_known[:, neighbors]
+
+        # the first step lands on a neighbor; new neighbors pass on their
+        # current estimate
+        context = to_known.dot(smoothed)
+        reach = to_known.dot(mass)
+        vectors = np.zeros((num_new, smoothed.shape[1]), dtype=np.float32)
+        for _ in range(iterations if to_new.nnz else 1):
+            estimate = (context + to_new.dot(vectors)) / np.maximum(
+                reach + to_new.dot((np.abs(vectors).sum(axis=1) > 0)
+                                   .astype(np.float64)),
+                1e-12)[:, None]
+            vectors = estimate.astype(np.float32)
+
+        missing = int((np.abs(vectors).sum(axis=1) == 0).sum())
+        if missing:
+            logger.warning("%d new nodes are not connected to known nodes",
+                           missing)
+        logger.info("Inferred %d vectors in %.1f ms", num_new,
+                    (time.time() - start) * 1000)
+        return LabelStore.from_labels(nodes[new]), vectors
+
+
+def add_vectors(store, labels, vectors):
+    """Append vectors to a vector store in place.
+
+    Inferred vectors have no trained output weights, so a ``Word2Vec``
+    model is reduced to its ``KeyedVectors``: the result can be searched and
+    saved but not trained further.
+
+    Args:
+        store: ``Word2Vec``, ``KeyedVectors`` or
+            :class:`~jwalk.quantize.QuantizedVectors`
+        labels (LabelStore or np.ndarray): new labels
+        vectors (np.ndarray): one row per label
+
+    Returns:
+        the updated ``KeyedVectors`` or QuantizedVectors
+    """
+    from jwalk.quantize import QuantizedVectors
+
+    if isinstance(store, QuantizedVectors):
+        return store.add(vectors, labels)
+
+    from gensim.models.word2vec import Vocab
+
+    keyed_vectors = vars(store).get('wv', store)
+    labels = [str(label) for label in labels]
+    if hasattr(keyed_vectors, 'vectors'):
+        keyed_vectors.vectors = np.vstack([keyed_vectors.vectors, vectors])
+        keyed_vectors.vectors_norm = None
+    else:  # gensim < 3.4
+        keyed_vectors.syn0 = np.vstack([keyed_vectors.syn0, vectors])
+        keyed_vectors.syn0norm = None
+    for label in labels:
+        keyed_vectors.vocab[label] = Vocab(
+            index=len(keyed_vectors.index2word), count=1)
+        keyed_vectors.index2word.append(label)
+    return keyed_vectors
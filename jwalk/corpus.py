@@ -1,12 +1,28 @@
 # -*- coding: utf-8 -*-
 """Generate text corpus from random walks on graph."""
+import os
+import zlib
+import shutil
+import logging
+import tempfile
+import collections
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
 import numpy as np
-from joblib import Parallel, delayed
-from joblib.pool import has_shareable_memory
 
 from jwalk import walks
 
-__all__ = ['walk_graph', 'build_corpus']
+logger = logging.getLogger(__name__)
+
+# walks formatted at a time when writing a corpus from node indices
+CORPUS_BLOCK_WALKS = 100000
+# gzip level of compressed corpora: 1 is several times faster than the
+# default 6 for a slightly larger file
+CORPUS_GZIP_LEVEL = 1
+
+__all__ = ['walk_graph', 'walk_graph_indices', 'expected_visit_counts',
+           'build_corpus', 'write_corpus']
 
 
 def walk_random(normalized_csr, labels, walk_length):
@@ -24,9 +40,107 @@ def walk_random(normalized_csr, labels, walk_length):
     return walks.walk_random(normalized_csr, labels, walk_length)
 
 
+def walk_random_triangular(upper_csr, labels, walk_length, reverse_index,
+                           strengths):
+    """Generate random walks on an upper-triangular undirected csr matrix.
+
+    Args:
+        upper_csr (scipy.sparse.csr_matrix): upper triangle adjacency matrix
+        labels (np.ndarray): array of node labels
+        walk_length (int): length of walk
+        reverse_index (tuple): output of :func:`reverse_edge_index`
+        strengths (np.ndarray): output of :func:`node_strengths`
+
+    Returns:
+        np.array walks, np.array word frequencies
+    """
+    reverse_indptr, reverse_edges = reverse_index
+    return walks.walk_random_triangular(upper_csr, labels, walk_length,
+                                        reverse_indptr, reverse_edges,
+                                        strengths)
+
+
+def walk_random_bipartite(normalized_item_user, normalized_user_item, labels,
+                          walk_length):
+    """Generate item-only random walks on a bipartite user-item graph.
+
+    Args:
+        normalized_item_user (scipy.sparse.csr_matrix): item->user matrix
+        normalized_user_item (scipy.sparse.csr_matrix): user->item matrix
+        labels (np.ndarray): array of item labels
+        walk_length (int): length of walk
+
+    Returns:
+        np.array walks, np.array word frequencies
+    """
+    return walks.walk_random_bipartite(normalized_item_user,
+                                       normalized_user_item, labels,
+                                       walk_length)
+
+
+def transpose_csr_matrix(csr_matrix):
+    """Transpose a csr matrix into csr format, keeping its dtypes.
+
+    Args:
+        csr_matrix (scipy.sparse.csr_matrix): matrix to transpose
+
+    Returns:
+        scipy.sparse.csr_matrix
+    """
+    from jwalk.graph import astype_graph
+
+    transposed = csr_matrix.T.tocsr()
+    return astype_graph(transposed, csr_matrix.indices.dtype,
+                        csr_matrix.data.dtype)
+
+
+def reverse_edge_index(upper_csr):
+    """Index the strictly upper entries of a csr matrix by column.
+
+    Lets a walker reach the neighbors of a node stored below the diagonal
+    without materializing the lower triangle: only the positions of the
+    entries are kept, weights and row indices stay in ``upper_csr``.
+
+    Args:
+        upper_csr (scipy.sparse.csr_matrix): upper triangle adjacency matrix
+
+    Returns:
+        np.ndarray indptr, np.ndarray edge positions
+    """
+    num_nodes = upper_csr.shape[0]
+    indices = upper_csr.indices
+    rows = np.repeat(np.arange(num_nodes, dtype=indices.dtype),
+                     np.diff(upper_csr.indptr))
+    off_diagonal = np.flatnonzero(rows != indices)
+    del rows
+
+    columns = indices[off_diagonal]
+    edges = off_diagonal[np.argsort(columns, kind='mergesort')]
+    indptr = np.zeros(num_nodes + 1, dtype=indices.dtype)
+    np.cumsum(np.bincount(columns, minlength=num_nodes), out=indptr[1:])
+    return indptr, edges.astype(indices.dtype)
+
+
+def node_strengths(upper_csr):
+    """Total edge weight incident to each node of an upper-triangular matrix.
+
+    Args:
+        upper_csr (scipy.sparse.csr_matrix): upper triangle adjacency matrix
+
+    Returns:
+        np.ndarray
+    """
+    row_sums = np.asarray(upper_csr.sum(axis=1)).ravel()
+    col_sums = np.asarray(upper_csr.sum(axis=0)).ravel()
+    strengths = row_sums + col_sums - upper_csr.diagonal()
+    return strengths.astype(np.float64)
+
+
 def normalize_csr_matrix(csr_matrix):
     """Normalize adjacency matrix weights.
 
+    Keeps the index and weight dtypes of the input.
+
     Args:
         scipy.sparse.csr_matrix: adjacency matrix
 
@@ -34,14 +148,249 @@ def normalize_csr_matrix(csr_matrix):
         scipy.sparse.csr_matrix
     """
     row_sums = np.array(csr_matrix.sum(axis=1))[:, 0]
-    row_indices, col_indices = csr_matrix.nonzero()
 
     normalized = csr_matrix.copy()
-    normalized.data /= row_sums[row_indices]
+    # scipy downcasts int64 indices that fit in int32 when copying
+    normalized.indices = normalized.indices.astype(csr_matrix.indices.dtype,
+                                                   copy=False)
+    normalized.indptr = normalized.indptr.astype(csr_matrix.indptr.dtype,
+                                                 copy=False)
+    normalized.data /= np.repeat(row_sums, np.diff(csr_matrix.indptr))
     return normalized
 
 
-def walk_graph(csr_matrix, labels, walk_length=40, num_walks=1, n_jobs=1):
+def estimate_walk_cost(degrees, walk_length):
+    """Estimate the work of walking from each node.
+
+    A step scans the neighbors of the current node, so the first step costs
+    the degree of the start node and every later one the expected degree of
+    a node reached by a random walk (``sum(d ** 2) / sum(d)``). Walks from
+    nodes without neighbors stop right away.
+
+    Args:
+        degrees (np.ndarray): number of neighbors of each start node
+        walk_length (int): length of walk
+
+    Returns:
+        np.ndarray: float64 cost per start node
+
+    Examples:
+        >>> estimate_walk_cost(np.array([0, 1, 3]), 3).tolist()
+        [1.0, 4.5, 6.5]
+    """
+    degrees = np.asarray(degrees, dtype=np.float64)
+    total = degrees.sum()
+    step = (degrees ** 2).sum() / total if total else 0.0
+    costs = 1.0 + degrees + max(walk_length - 2, 0) * step
+    costs[degrees == 0] = 1.0
+    return costs
+
+
+def balanced_chunks(costs, num_chunks):
+    """Split nodes into contiguous ranges of about equal total cost.
+
+    Args:
+        costs (np.ndarray): cost per node, e.g. from :func:`estimate_walk_cost`
+        num_chunks (int): maximum number of ranges
+
+    Returns:
+        list: ``(first, last)`` node ranges covering all nodes in order
+
+    Examples:
+        >>> balanced_chunks(np.array([4., 1., 1., 1., 1.]), 2)
+        [(0, 1), (1, 5)]
+    """
+    num_nodes = costs.shape[0]
+    cumulative = np.cumsum(costs)
+    targets = cumulative[-1] * np.arange(1, num_chunks) / num_chunks \
+        if num_nodes else []
+    bounds = np.searchsorted(cumulative, targets, side='right')
+    bounds = np.unique(np.concatenate([[0], bounds, [num_nodes]]))
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def _walk_chunk(kernel, args, first, last, seed):
+    # need to wrap walks kernels otherwise joblib complains in Py2; visit
+    # counts are dropped, shipping a full array per chunk costs more than
+    # counting the returned walks
+    walk_indices, _, lengths, distinct = getattr(walks, kernel)(
+        *(args + (first, last, seed)))
+    return walk_indices, lengths, distinct
+
+
+def _share_arrays(args, folder):
+    """Dump array arguments to ``folder`` and reopen them memory-mapped.
+
+    Workers then receive file references instead of pickled copies. The
+    copy-on-write mode keeps the buffers writable for the kernels.
+    """
+    shared = []
+    for position, arg in enumerate(args):
+        if isinstance(arg, np.ndarray):
+            filename = os.path.join(folder, '%d.npy' % position)
+            np.save(filename, arg)
+            arg = np.load(filename, mmap_mode='c')
+        shared.append(arg)
+    return tuple(shared)
+
+
+def _walker(csr_matrix, walk_length, triangular=False, bipartite=False):
+    """Pick the walk kernel for a graph layout and prepare its arguments.
+
+    Returns:
+        str kernel name in :mod:`jwalk.walks`, tuple of kernel arguments,
+        np.ndarray number of neighbors of each start node
+    """
+    assert not (triangular and bipartite), \
+        "A graph cannot be both triangular and bipartite"
+
+    if bipartite:
+        item_user = normalize_csr_matrix(transpose_csr_matrix(csr_matrix))
+        user_item = normalize_csr_matrix(csr_matrix)
+        return 'walk_indices_bipartite', (
+            item_user.indptr, item_user.indices, item_user.data,
+            user_item.indptr, user_item.indices, user_item.data,
+            walk_length), np.diff(item_user.indptr)
+    elif triangular:
+        reverse_indptr, reverse_edges = reverse_edge_index(csr_matrix)
+        degrees = np.diff(csr_matrix.indptr) + np.diff(reverse_indptr)
+        return 'walk_indices_triangular', (
+            csr_matrix.indptr, csr_matrix.indices, csr_matrix.data,
+            reverse_indptr, reverse_edges, node_strengths(csr_matrix),
+            walk_length), degrees
+    normalized = normalize_csr_matrix(csr_matrix)
+    return 'walk_indices', (normalized.indptr, normalized.indices,
+                            normalized.data, walk_length), \
+        np.diff(normalized.indptr)
+
+
+def walk_graph_indices(csr_matrix, walk_length=40, num_walks=1, n_jobs=1,
+                       triangular=False, bipartite=False, return_stats=False,
+                       seed=None, chunks_per_job=4):
+    """Perform random walks on adjacency matrix, keeping node indices.
+
+    With several jobs, start nodes are split into ranges of about equal
+    estimated cost (see :func:`estimate_walk_cost`) which are handed out to
+    the workers one at a time, so all cores stay busy for any ``num_walks``.
+    Walks do not depend on ``n_jobs``: each one is seeded by ``seed``, its
+    repetition and its start node.
+
+    Args:
+        csr_matrix: adjacency matrix.
+        walk_length: maximum length of random walk (default=40)
+        num_walks: number of walks to do for each node
+        n_jobs: number of cores to use (default=1)
+        triangular: if True, ``csr_matrix`` is the upper triangle of an
+            undirected graph and is walked in both directions
+        bipartite: if True, ``csr_matrix`` is a user->item biadjacency matrix;
+            walks alternate between items and users but contain only items
+        return_stats: if True, also return the :class:`~jwalk.stats.WalkStats`
+            accumulated by the walk kernels
+        seed: random seed (default=None, unpredictable)
+        chunks_per_job: node ranges per job and repetition (default=4)
+
+    Returns:
+        np.ndarray walks of node indices (-1 padded), np.ndarray node counts
+        [, WalkStats]
+    """
+    from joblib import Parallel, delayed
+
+    if n_jobs < 0:
+        n_jobs = max(multiprocessing.cpu_count() + 1 + n_jobs, 1)
+
+    kernel, args, degrees = _walker(csr_matrix, walk_length, triangular,
+                                    bipartite)
+    num_nodes = degrees.shape[0]
+    if n_jobs == 1:
+        chunks = [(0, num_nodes)]
+    else:
+        costs = estimate_walk_cost(degrees, walk_length)
+        chunks = balanced_chunks(costs, n_jobs * chunks_per_job)
+    seeds = np.random.RandomState(seed).randint(
+        0, 2 ** 63 - 1, size=num_walks, dtype=np.int64)
+    logger.debug('Walking %d node ranges %d times on %d jobs', len(chunks),
+                 num_walks, n_jobs)
+
+    folder = tempfile.mkdtemp(prefix='jwalk-') if n_jobs != 1 else None
+    try:
+        if folder is not None:
+            args = _share_arrays(args, folder)
+        results = Parallel(n_jobs=n_jobs, max_nbytes=None, batch_size=1)(
+            delayed(_walk_chunk)(kernel, args, first, last, int(repeat_seed))
+            for repeat_seed in seeds for first, last in chunks)
+    finally:
+        if folder is not None:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    walk_indices, lengths, distinct = zip(*results)
+    counts = np.zeros(num_nodes, dtype=np.int64)
+    for chunk in walk_indices:
+        counts += np.bincount(chunk[chunk >= 0], minlength=num_nodes)
+    walk_indices = np.concatenate(walk_indices)
+    if not return_stats:
+        return walk_indices, counts
+
+    from jwalk.stats import WalkStats
+
+    starts = np.bincount(walk_indices[:, 0], minlength=num_nodes)
+    walk_stats = WalkStats(np.sum(lengths, axis=0), np.sum(distinct, axis=0),
+                           counts, starts)
+    return walk_indices, counts, walk_stats
+
+
+def expected_visit_counts(csr_matrix, walk_length=40, num_walks=1,
+                          triangular=False, bipartite=False):
+    """Expected node frequencies of the walks, without walking.
+
+    Propagates one walk per start node through the transition matrix for
+    ``walk_length`` steps (walks stop at nodes without neighbors, as in the
+    kernels). Lets a vocabulary be built before any walk exists.
+
+    Args:
+        csr_matrix: adjacency matrix, as passed to :func:`walk_graph_indices`
+        walk_length: maximum length of random walk (default=40)
+        num_walks: number of walks to do for each node
+        triangular: if True, ``csr_matrix`` is the upper triangle of an
+            undirected graph
+        bipartite: if True, ``csr_matrix`` is a user->item biadjacency matrix
+            and frequencies are of items
+
+    Returns:
+        np.ndarray: float64 expected visits per node
+    """
+    if bipartite:
+        item_user = normalize_csr_matrix(transpose_csr_matrix(csr_matrix))
+        user_item = normalize_csr_matrix(csr_matrix)
+
+        def step(mass):
+            return user_item.T.dot(item_user.T.dot(mass))
+    elif triangular:
+        strengths = node_strengths(csr_matrix)
+        diagonal = csr_matrix.diagonal()
+        inverse = np.zeros_like(strengths)
+        np.divide(1.0, strengths, out=inverse, where=strengths > 0)
+
+        def step(mass):
+            scaled = mass * inverse
+            return (csr_matrix.dot(scaled) + csr_matrix.T.dot(scaled) -
+                    diagonal * scaled)
+    else:
+        normalized = normalize_csr_matrix(csr_matrix)
+
+        def step(mass):
+            return normalized.T.dot(mass)
+
+    num_nodes = csr_matrix.shape[1] if bipartite else csr_matrix.shape[0]
+    mass = np.ones(num_nodes)
+    counts = np.zeros(num_nodes)
+    for _ in range(walk_length):
+        counts += mass
+        mass = step(mass)
+    return counts * num_walks
+
+
+def walk_graph(csr_matrix, labels, walk_length=40, num_walks=1, n_jobs=1,
+               triangular=False, bipartite=False):
     """Perform random walks on adjacency matrix.
 
     Args:
@@ -50,35 +399,144 @@ def walk_graph(csr_matrix, labels, walk_length=40, num_walks=1, n_jobs=1):
         walk_length: maximum length of random walk (default=40)
         num_walks: number of walks to do for each node
         n_jobs: number of cores to use (default=1)
+        triangular: if True, ``csr_matrix`` is the upper triangle of an
+            undirected graph and is walked in both directions
+        bipartite: if True, ``csr_matrix`` is a user->item biadjacency matrix
+            and ``labels`` are the item labels; walks alternate between
+            items and users but contain only items
 
     Returns:
         np.ndarray: list of random walks
     """
-    normalized = normalize_csr_matrix(csr_matrix)
+    walk_indices, counts = walk_graph_indices(csr_matrix, walk_length,
+                                              num_walks, n_jobs, triangular,
+                                              bipartite)
+    random_walks = walks.indices_to_labels(walk_indices, labels)
+    return random_walks, dict(zip(labels, counts))
 
-    results = (Parallel(n_jobs=n_jobs, max_nbytes=None)
-               (delayed(walk_random, has_shareable_memory)
-                (normalized, labels, walk_length)
-                for _ in range(num_walks)))
 
-    walks, freqs = zip(*results)
+def _shard_paths(outpath, num_shards):
+    """File names of the shards of a corpus, keeping a ``.gz`` suffix last.
+
+    Examples:
+        >>> _shard_paths('corpus.txt.gz', 2)
+        ['corpus.txt-00000-of-00002.gz', 'corpus.txt-00001-of-00002.gz']
+    """
+    if num_shards == 1:
+        return [outpath]
+    root, suffix = outpath, ''
+    if outpath.endswith('.gz'):
+        root, suffix = outpath[:-3], '.gz'
+    return ['%s-%05d-of-%05d%s' % (root, shard, num_shards, suffix)
+            for shard in range(num_shards)]
 
-    random_walks = np.concatenate(walks)
-    word_freqs = np.sum(freqs, axis=0)
 
-    return random_walks, dict(zip(labels, word_freqs))
+def _gzip_member(data, level=CORPUS_GZIP_LEVEL):
+    """``data`` as a complete gzip member; members concatenate into a valid
+    gzip file."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
 
 
-def build_corpus(walks, outpath):
+def _index_walks(walks):
+    """Walks of labels ('' padded) as node indices (-1 padded) and labels.
+
+    Labels of any type are written as text, except bytes labels that are not
+    ASCII, which are written as they are. The distinct labels are found on
+    the fixed-width bytes, not on the object array.
+    """
+    from jwalk.graph import unique_labels
+    from jwalk.labels import _encode_utf8
+
+    walks = np.asarray(walks)
+    if walks.dtype.kind == 'O':
+        try:
+            walks = walks.astype(str)
+        except UnicodeError:
+            walks = walks.astype(bytes)
+    nodes, indices = unique_labels(_encode_utf8(walks))
+    indices = indices.astype(np.int64)
+    if nodes.shape[0] and nodes[0] == b'':
+        nodes, indices = nodes[1:], indices - 1
+    return indices, nodes
+
+
+def write_corpus(walks, outpath, labels=None, num_shards=1, n_jobs=1):
+    """Write walks as text, one walk per line, in ``num_shards`` files.
+
+    Text is produced from the packed label bytes in blocks of
+    ``CORPUS_BLOCK_WALKS`` walks by ``n_jobs`` threads (the numpy gathers and
+    zlib release the GIL) and written in order, shard ``k`` holding the
+    ``k``-th contiguous part of the walks. At most ``2 * n_jobs`` blocks are
+    in flight, so memory does not grow when writing is the bottleneck.
+    Paths ending in ``.gz`` are gzipped; each block is compressed on its
+    own, as a gzip member.
+
+    Args:
+        walks: random walks, of labels ('' padded) or of node indices
+            (-1 padded)
+        outpath: file to write to; shards are named by :func:`_shard_paths`
+        labels: node labels for walks of node indices (default=None)
+        num_shards: number of output files (default=1)
+        n_jobs: number of threads (default=1)
+
+    Returns:
+        list: file paths of the shards
+    """
+    from jwalk.labels import LabelStore
+
+    if labels is None:
+        walks, labels = _index_walks(walks)
+    labels = LabelStore.from_labels(labels)
+    compress = outpath.endswith('.gz')
+    if n_jobs < 0:
+        n_jobs = max(multiprocessing.cpu_count() + 1 + n_jobs, 1)
+
+    bounds = np.linspace(0, walks.shape[0], num_shards + 1).astype(int)
+    blocks = [(shard, start, min(start + CORPUS_BLOCK_WALKS, last))
+              for shard, (first, last) in enumerate(zip(bounds[:-1],
+                                                        bounds[1:]))
+              for start in range(first, last, CORPUS_BLOCK_WALKS)]
+
+    def encode(block):
+        _, start, end = block
+        text = labels.format_walks(walks[start:end])
+        return _gzip_member(text) if compress else text
+
+    paths = _shard_paths(outpath, num_shards)
+    files = [open(path, 'wb') for path in paths]  # empty shards exist too
+    pool = ThreadPool(n_jobs)
+    pending = collections.deque()
+    try:
+        for block in blocks:
+            pending.append((block[0], pool.apply_async(encode, (block,))))
+            if len(pending) >= 2 * n_jobs:
+                shard, result = pending.popleft()
+                files[shard].write(result.get())
+        while pending:
+            shard, result = pending.popleft()
+            files[shard].write(result.get())
+    finally:
+        pool.close()
+        for f in files:
+            f.close()
+    return paths
+
+
+def build_corpus(walks, outpath, labels=None, n_jobs=1):
     """Build corpus by shuffling and then saving as text file.
 
+    Given ``labels``, ``walks`` are node indices (-1 padded); see
+    :func:`write_corpus`.
+
     Args:
-        walks: random walks
-        outpath: file to write to
+        walks: random walks, of labels or of node indices
+        outpath: file to write to (gzipped if it ends in ``.gz``)
+        labels: node labels for walks of node indices (default=None)
+        n_jobs: number of threads formatting the text (default=1)
 
     Returns:
         str: file path of corpus
     """
     np.random.shuffle(walks)
-    np.savetxt(outpath, walks, delimiter=' ', fmt='%s')
-    return outpath
+    return write_corpus(walks, outpath, labels, n_jobs=n_jobs)[0]
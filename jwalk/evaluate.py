@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""Link prediction scores of trained vectors.
+
+A fraction of the node pairs of an edge list is held out before the graph is
+built. Vectors trained on the remaining edges then score the held-out pairs
+and as many random unconnected pairs by cosine similarity:
+
+* ``auc``: probability that a held-out pair outscores an unconnected one
+* ``hits@k``: fraction of held-out pairs that outscore the ``k``-th best
+  unconnected pair
+
+Cosine similarity is symmetric, so node pairs are unordered: ``A B`` and
+``B A`` are one pair, even in a directed graph. Held-out pairs take all
+their parallel and reciprocal edges with them, so the model never sees
+them, and are only held out while both nodes keep a training edge, so both
+have vectors.
+"""
+import logging
+
+import numpy as np
+
+__all__ = ['split_edges', 'sample_non_edges', 'rank_auc', 'hits_at_k',
+           'link_prediction_scores']
+
+logger = logging.getLogger(__name__)
+
+HITS = (10, 50, 100)
+
+
+def _encode_pairs(edges):
+    """Unique nodes of edges, their encoded node pairs and a key per pair
+    (the same for both directions)."""
+    nodes, encoded = np.unique(edges[:, :2], return_inverse=True)
+    encoded = encoded.reshape(-1, 2).astype(np.int64)
+    return nodes, encoded, _pair_keys(encoded, len(nodes))
+
+
+def _pair_keys(pairs, num_nodes):
+    pairs = np.sort(pairs, axis=1)
+    return pairs[:, 0] * num_nodes + pairs[:, 1]
+
+
+def split_edges(edges, test_fraction=0.1, seed=None):
+    """Hold out a random fraction of the node pairs of an edge list.
+
+    Self loops are never held out, and neither are pairs whose nodes would
+    be left without a training edge, so slightly fewer pairs than
+    ``test_fraction`` may be held out.
+
+    Args:
+        edges (np.ndarray): edges of the form [src, tgt] or [src, tgt, weight]
+        test_fraction (float): fraction of the node pairs to hold out
+        seed: random seed (default=None)
+
+    Returns:
+        np.ndarray: training edges (rows of ``edges``),
+        np.ndarray: held-out node pairs of the form [src, tgt]
+    """
+    assert 0 < test_fraction < 1, "Hold out a fraction of the edges"
+    nodes, encoded, keys = _encode_pairs(edges)
+    num_nodes = len(nodes)
+    pair_keys, pair_of_edge = np.unique(keys, return_inverse=True)
+    first, second = pair_keys // num_nodes, pair_keys % num_nodes
+
+    random_state = np.random.RandomState(seed)
+    candidates = random_state.permutation(np.flatnonzero(first != second))
+    held = np.zeros(len(pair_keys), dtype=bool)
+    held[candidates[:int(round(test_fraction * len(pair_keys)))]] = True
+
+    # give back the pairs of nodes that would have no training edge left
+    degrees = np.bincount(encoded[~held[pair_of_edge]].ravel(),
+                          minlength=num_nodes)
+    held &= (degrees[first] > 0) & (degrees[second] > 0)
+    logger.debug("Holding out %d of %d node pairs", held.sum(),
+                 len(pair_keys))
+
+    test_pairs = nodes[np.column_stack([first[held], second[held]])]
+    return edges[~held[pair_of_edge]], test_pairs
+
+
+def sample_non_edges(edges, num_pairs, seed=None):
+    """Random pairs of distinct nodes of an edge list that are not linked,
+    in either direction.
+
+    Args:
+        edges (np.ndarray): all edges, held-out ones included
+        num_pairs (int): number of pairs to sample (with replacement)
+        seed: random seed (default=None)
+
+    Returns:
+        np.ndarray: node pairs of the form [src, tgt]
+    """
+    nodes, _, keys = _encode_pairs(edges)
+    num_nodes = len(nodes)
+    linked = np.unique(keys)
+    num_linked = np.count_nonzero(linked // num_nodes != linked % num_nodes)
+    assert num_linked < num_nodes * (num_nodes - 1) // 2, \
+        "Every pair of nodes is linked"
+
+    random_state = np.random.RandomState(seed)
+    pairs = np.empty((0, 2), dtype=np.int64)
+    while len(pairs) < num_pairs:
+        drawn = random_state.randint(num_nodes,
+                                     size=(2 * (num_pairs - len(pairs)), 2))
+        drawn = drawn[drawn[:, 0] != drawn[:, 1]].astype(np.int64)
+        drawn_keys = _pair_keys(drawn, num_nodes)
+        positions = np.minimum(np.searchsorted(linked, drawn_keys),
+                               len(linked) - 1)
+        pairs = np.vstack([pairs, drawn[linked[positions] != drawn_keys]])
+    return nodes[pairs[:num_pairs]]
+
+
+def rank_auc(positive, negative):
+    """Area under the ROC curve from positive and negative scores (ties
+    count half)."""
+    from scipy.stats import rankdata
+
+    ranks = rankdata(np.concatenate([positive, negative]))
+    n_pos, n_neg = len(positive), len(negative)
+    return float((ranks[:n_pos].sum() - n_pos * (n_pos + 1) / 2.0) /
+                 (n_pos * n_neg))
+
+
+def hits_at_k(positive, negative, k):
+    """Fraction of positive scores above the ``k``-th best negative score
+    (1.0 with fewer than ``k`` negatives)."""
+    if len(negative) < k:
+        return 1.0
+    threshold = np.partition(negative, len(negative) - k)[len(negative) - k]
+    return float(np.mean(positive > threshold))
+
+
+def _cosine_scores(vectors, labels, pairs):
+    """Cosine similarity of the pairs whose nodes both have vectors."""
+    positions = labels.lookup(pairs.ravel()).reshape(-1, 2)
+    positions = positions[(positions >= 0).all(axis=1)]
+    first, second = vectors[positions[:, 0]], vectors[positions[:, 1]]
+    norms = (np.linalg.norm(first, axis=1) *
+             np.linalg.norm(second, axis=1))
+    return np.einsum('ij,ij->i', first, second) / np.maximum(norms, 1e-12)
+
+
+def link_prediction_scores(model, test_pairs, non_edges, hits=HITS):
+    """Score held-out pairs against unconnected pairs with trained vectors.
+
+    Pairs with a node missing from the model are left out; their number is
+    the difference between the pairs given and ``num_test_pairs`` /
+    ``num_non_edges``.
+
+    Args:
+        model: ``Word2Vec``, ``KeyedVectors`` or
+            :class:`~jwalk.quantize.QuantizedVectors`
+        test_pairs (np.ndarray): held-out node pairs, from
+            :func:`split_edges`
+        non_edges (np.ndarray): unconnected node pairs, from
+            :func:`sample_non_edges`
+        hits (tuple): ``k`` of the ``hits@k`` scores
+
+    Returns:
+        dict: ``auc``, ``hits@k`` for each ``k``, ``num_test_pairs`` and
+        ``num_non_edges``
+    """
+    from jwalk.coldstart import _vector_table
+
+    vectors, labels = _vector_table(model)
+    positive = _cosine_scores(vectors, labels, test_pairs)
+    negative = _cosine_scores(vectors, labels, non_edges)
+    if len(positive) < len(test_pairs) or len(negative) < len(non_edges):
+        logger.warning("Left out %d test pairs and %d non-edges with nodes "
+                       "missing from the model",
+                       len(test_pairs) - len(positive),
+                       len(non_edges) - len(negative))
+    assert len(positive) and len(negative), "No pair to score"
+
+    scores = {'auc': rank_auc(positive, negative)}
+    for k in hits:
+        scores['hits@%d' % k] = hits_at_k(positive, negative, k)
+    scores.update(num_test_pairs=len(positive), num_non_edges=len(negative))
+    return scores
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""Node embeddings by factorizing the DeepWalk matrix (NetMF).
+
+Skip-gram with negative sampling on random walks implicitly factorizes
+
+    log(max(vol(G) / (b * T) * (P + P^2 + ... + P^T) * D^-1, 1))
+
+where ``P`` is the transition matrix, ``T`` the window, ``b`` the number
+of negative samples and ``D`` the node strengths. This module builds that
+matrix with sparse products and takes a randomized truncated SVD of it, so
+no walk or Word2Vec is needed.
+
+An entry of ``M`` is ``(1 / T) * sum_r P^r[i, j] / (b * pi[j])`` where
+``pi[j] = d_j / vol(G)`` is the probability of ``j`` in a fully mixed walk,
+and only entries above 1 survive the log. Powers of ``P`` fill in quickly, so
+after every product the entries of ``P^r`` below ``prune * b * pi[j]`` are
+dropped: they lower an entry of ``M`` by at most ``prune`` and keep the
+powers about as sparse as the structure of the graph (pairs visited more
+often than chance).
+"""
+import time
+import logging
+
+import numpy as np
+import scipy.sparse as sps
+
+from jwalk import corpus
+
+__all__ = ['netmf_matrix', 'randomized_svd', 'factorize_graph']
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_BLOCK_ROWS = 4096
+
+
+def _prune(matrix, thresholds):
+    """Drop entries below the threshold of their column (in place)."""
+    matrix.data[matrix.data < thresholds[matrix.indices]] = 0
+    matrix.eliminate_zeros()
+    return matrix
+
+
+def _pruned_product(left, right, thresholds):
+    """``left.dot(right)`` pruned block of rows by block, so that the
+    unpruned product is never held in full."""
+    blocks = [_prune(left[start:start + PRODUCT_BLOCK_ROWS].dot(right),
+                     thresholds)
+              for start in range(0, left.shape[0], PRODUCT_BLOCK_ROWS)]
+    return sps.vstack(blocks, format='csr')
+
+
+def _hops(csr_matrix, triangular=False, bipartite=False):
+    """Transition matrices of the hops of one walk step, each with the
+    strengths of the nodes it reaches.
+
+    A bipartite step (item -> user -> item) is kept as its two sparse hops:
+    their product is much denser than either. An upper triangle is expanded
+    to the full symmetric matrix, giving up the halved storage here: the
+    products of the transitions need both directions, and they are much
+    denser than the graph anyway.
+
+    Returns:
+        list of (scipy.sparse.csr_matrix float32 transitions, np.ndarray)
+    """
+    if bipartite:
+        item_user = corpus.transpose_csr_matrix(csr_matrix)
+        return [(corpus.normalize_csr_matrix(item_user.astype(np.float32)),
+                 np.asarray(csr_matrix.sum(axis=1)).ravel()),
+                (corpus.normalize_csr_matrix(csr_matrix.astype(np.float32)),
+                 np.asarray(csr_matrix.sum(axis=0)).ravel())]
+    if triangular:
+        diagonal = sps.diags(csr_matrix.diagonal())
+        csr_matrix = (csr_matrix + csr_matrix.T - diagonal).tocsr()
+    # column sums: how often a node is reached, i.e. its context frequency
+    return [(corpus.normalize_csr_matrix(csr_matrix.astype(np.float32)),
+             np.asarray(csr_matrix.sum(axis=0)).ravel())]
+
+
+def netmf_matrix(csr_matrix, window=10, negative=1, triangular=False,
+                 bipartite=False, prune=1.0):
+    """Sparse NetMF matrix ``log(max(M, 1))`` of a graph.
+
+    Args:
+        csr_matrix: adjacency matrix, as passed to
+            :func:`~jwalk.corpus.walk_graph_indices`
+        window (int): window size ``T`` (default=10)
+        negative (int): number of negative samples ``b`` (default=1)
+        triangular (bool): ``csr_matrix`` is the upper triangle of an
+            undirected graph (expanded to the full matrix here)
+        bipartite (bool): ``csr_matrix`` is a user->item biadjacency matrix;
+            the matrix is of items
+        prune (float): drop entries of ``P^r`` below ``prune`` times their
+            fully mixed value ``b * pi[j]`` (default=1)
+
+    Returns:
+        scipy.sparse.csr_matrix: float32, one row and column per node
+    """
+    assert window >= 1, "window must be at least 1"
+    hops = []
+    for transitions, strengths in _hops(csr_matrix, triangular, bipartite):
+        chance = negative * strengths / strengths.sum()  # b * pi
+        hops.append((transitions, (prune * chance).astype(np.float32),
+                     chance))
+    # P^r ends with the last hop: M is relative to the nodes it reaches
+    # (the items of a bipartite graph)
+    chance = hops[-1][2]
+
+    power = total = None
+    for r in range(1, window + 1):
+        for transitions, thresholds, _ in hops:
+            power = transitions if power is None else \
+                _pruned_product(power, transitions, thresholds)
+        total = power if total is None else total + power
+        logger.debug("P^%d: %d entries", r, power.nnz)
+
+    # M = total / (T * b * pi)
+    inverse = np.zeros(chance.shape[0], dtype=np.float32)
+    np.divide(1.0, window * chance, out=inverse, where=chance > 0)
+    total = total.tocsr()
+    total.data *= inverse[total.indices]  # then log(max(M, 1))
+    total.data = np.log(np.maximum(total.data, 1))
+    total.eliminate_zeros()
+    return total
+
+
+def randomized_svd(matrix, rank, oversample=10, power_iterations=2,
+                   seed=None):
+    """Truncated SVD by random projection (Halko, Martinsson and Tropp).
+
+    Args:
+        matrix: sparse or dense matrix
+        rank (int): number of singular values kept
+        oversample (int): extra random directions (default=10)
+        power_iterations (int): subspace iterations, sharpen the spectrum
+            (default=2)
+        seed (int): random seed
+
+    Returns:
+        np.ndarray u, np.ndarray s, np.ndarray vt
+    """
+    random_state = np.random.RandomState(seed)
+    columns = min(rank + oversample, min(matrix.shape))
+    probe = random_state.randn(matrix.shape[1], columns).astype(np.float32)
+    basis, _ = np.linalg.qr(matrix.dot(probe))
+    for _ in range(power_iterations):
+        basis, _ = np.linalg.qr(matrix.T.dot(basis))
+        basis, _ = np.linalg.qr(matrix.dot(basis))
+
+    # small dense problem in the range of the matrix
+    projected = np.asarray(matrix.T.dot(basis)).T
+    u, s, vt = np.linalg.svd(projected, full_matrices=False)
+    return basis.dot(u[:, :rank]), s[:rank], vt[:rank]
+
+
+def factorize_graph(csr_matrix, size=128, window=10, negative=1,
+                    triangular=False, bipartite=False, prune=1.0,
+                    power_iterations=2, seed=None):
+    """Node embeddings from a truncated SVD of the NetMF matrix.
+
+    Args:
+        csr_matrix: adjacency matrix, as passed to
+            :func:`~jwalk.corpus.walk_graph_indices`
+        size (int): embedding dimension (default=128)
+        window (int): window size (default=10)
+        negative (int): number of negative samples (default=1)
+        triangular (bool): ``csr_matrix`` is the upper triangle of an
+            undirected graph (expanded to the full matrix here)
+        bipartite (bool): ``csr_matrix`` is a user->item biadjacency matrix;
+            embeddings are of items
+        prune (float): drop entries of ``P^r`` below ``prune`` times their
+            fully mixed value, see :func:`netmf_matrix` (default=1)
+        power_iterations (int): subspace iterations of the SVD (default=2)
+        seed (int): random seed of the SVD
+
+    Returns:
+        np.ndarray: float32 embeddings, ``u * sqrt(s)``, one row per node
+    """
+    start = time.time()
+    matrix = netmf_matrix(csr_matrix, window, negative, triangular,
+                          bipartite, prune)
+    logger.info("NetMF matrix of %d entries built in %.1f s", matrix.nnz,
+                time.time() - start)
+
+    start = time.time()
+    u, s, _ = randomized_svd(matrix, size,
+                             power_iterations=power_iterations, seed=seed)
+    logger.info("Randomized SVD of rank %d in %.1f s", s.shape[0],
+                time.time() - start)
+
+    vectors = np.zeros((u.shape[0], size), dtype=np.float32)
+    vectors[:, :s.shape[0]] = u * np.sqrt(s)  # rank <= number of nodes
+    return vectors
@@ -5,10 +5,118 @@ import logging
 import numpy as np
 import scipy.sparse as sps
 
-__all__ = ['build_adjacency_matrix', 'encode_edges']
+from jwalk.labels import LabelStore, _encode_utf8
+
+__all__ = ['build_adjacency_matrix', 'build_biadjacency_matrix',
+           'encode_edges', 'symmetrize_edges', 'astype_graph']
 
 logger = logging.getLogger(__name__)
 
+# sorted labels compared at a time when finding the distinct ones
+UNIQUE_BLOCK_SIZE = 1 << 16
+
+# how the weights of parallel/reciprocal edges combine in undirected mode
+COMBINE_UFUNCS = {
+    'max': np.maximum,
+    'min': np.minimum,
+    'sum': np.add,
+    'mean': np.add,
+}
+
+
+def smallest_index_dtype(num_nodes, nnz):
+    """Smallest csr index dtype able to address ``num_nodes`` and ``nnz``.
+
+    Examples:
+        >>> print(smallest_index_dtype(10, 2 ** 31))
+        int64
+    """
+    if max(num_nodes, nnz) <= np.iinfo(np.int32).max:
+        return np.dtype(np.int32)
+    return np.dtype(np.int64)
+
+
+def smallest_weight_dtype(weights):
+    """float32 unless some weight overflows it or is an integer it cannot
+    represent exactly (above 2 ** 24), then float64.
+
+    Examples:
+        >>> print(smallest_weight_dtype(np.array([1.5, 2 ** 24])))
+        float32
+        >>> print(smallest_weight_dtype(np.array([1.5, 2 ** 24 + 1])))
+        float64
+    """
+    if not weights.size:
+        return np.dtype(np.float32)
+    if np.abs(weights).max() > np.finfo(np.float32).max:
+        return np.dtype(np.float64)
+    integral = np.mod(weights, 1) == 0
+    if np.any(integral & (weights.astype(np.float32) != weights)):
+        return np.dtype(np.float64)
+    return np.dtype(np.float32)
+
+
+def astype_graph(csr_matrix, index_dtype=None, weight_dtype=None):
+    """Cast the index arrays and weights of a csr matrix in place.
+
+    Args:
+        csr_matrix (scipy.sparse.csr_matrix): adjacency matrix
+        index_dtype: int32 or int64 (default=smallest that fits)
+        weight_dtype: float32 or float64 (default=smallest that fits)
+
+    Returns:
+        scipy.sparse.csr_matrix
+    """
+    num_nodes, nnz = csr_matrix.shape[0], csr_matrix.nnz
+    if index_dtype is None:
+        index_dtype = smallest_index_dtype(num_nodes, nnz)
+    if weight_dtype is None:
+        weight_dtype = smallest_weight_dtype(csr_matrix.data)
+    index_dtype, weight_dtype = np.dtype(index_dtype), np.dtype(weight_dtype)
+
+    assert index_dtype in (np.int32, np.int64), "Index must be int32/int64"
+    assert weight_dtype in (np.float32, np.float64), \
+        "Weights must be float32/float64"
+    assert max(num_nodes, nnz) <= np.iinfo(index_dtype).max, \
+        "Graph too large for %s indices" % index_dtype
+
+    csr_matrix.indices = csr_matrix.indices.astype(index_dtype, copy=False)
+    csr_matrix.indptr = csr_matrix.indptr.astype(index_dtype, copy=False)
+    csr_matrix.data = csr_matrix.data.astype(weight_dtype, copy=False)
+    return csr_matrix
+
+
+def unique_labels(labels):
+    """Sorted distinct labels and the index of each label among them.
+
+    Same as ``np.unique(labels, return_inverse=True)``, except that no sorted
+    copy of the (fixed-width) labels is made: neighbors in sorted order are
+    compared block by block.
+
+    Args:
+        labels (np.ndarray): labels of any shape
+
+    Returns:
+        np.ndarray: distinct labels, np.ndarray: indices shaped like
+        ``labels``
+
+    Examples:
+        >>> nodes, encoded = unique_labels(np.array([['b', 'a'], ['a', 'c']]))
+        >>> print(encoded)
+        [[1 0]
+         [0 2]]
+    """
+    flat = labels.ravel()
+    order = np.argsort(flat, kind='mergesort')
+    distinct = np.ones(flat.shape[0], dtype=bool)
+    for start in range(1, flat.shape[0], UNIQUE_BLOCK_SIZE):
+        stop = min(start + UNIQUE_BLOCK_SIZE, flat.shape[0])
+        distinct[start:stop] = (flat[order[start:stop]] !=
+                                flat[order[start - 1:stop - 1]])
+    inverse = np.empty(flat.shape[0], dtype=np.intp)
+    inverse[order] = np.cumsum(distinct) - 1
+    return flat[order[distinct]], inverse.reshape(labels.shape)
+
 
 def encode_edges(edges, nodes):
     """Encode data with dictionary
@@ -33,17 +141,81 @@ def encode_edges(edges, nodes):
     return relabeled_edges
 
 
-def build_adjacency_matrix(edges, undirected=False):
+def symmetrize_edges(encoded, weights, num_nodes, combine='max'):
+    """Dedupe undirected edges in one pass.
+
+    Every edge is keyed by its unordered node pair, so ``A B`` and ``B A``
+    (and repeats of either) collapse into one edge whose weight is reduced
+    with ``combine``.
+
+    Args:
+        encoded (np.ndarray): encoded edges of the form [node1, node2]
+        weights (np.ndarray): edge weights
+        num_nodes (int): number of nodes
+        combine (str): one of 'max', 'min', 'sum' or 'mean' (default='max')
+
+    Returns:
+        np.ndarray rows, np.ndarray cols, np.ndarray weights with rows <= cols
+
+    Examples:
+        >>> import numpy as np
+        >>> encoded = np.array([[0, 1], [1, 0], [2, 1]])
+        >>> weights = np.array([1., 3., 2.])
+        >>> rows, cols, combined = symmetrize_edges(encoded, weights, 3)
+        >>> print(rows.tolist(), cols.tolist(), combined.tolist())
+        [0, 1] [1, 2] [3.0, 2.0]
+    """
+    assert combine in COMBINE_UFUNCS, \
+        "combine must be one of %s" % sorted(COMBINE_UFUNCS)
+
+    lo = encoded.min(axis=1).astype(np.int64)
+    hi = encoded.max(axis=1).astype(np.int64)
+    keys = lo * num_nodes + hi
+
+    order = np.argsort(keys, kind='mergesort')
+    keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+
+    combined = COMBINE_UFUNCS[combine].reduceat(weights[order], starts)
+    if combine == 'mean':
+        combined = combined / np.diff(np.r_[starts, keys.shape[0]])
+
+    keys = keys[starts]
+    return keys // num_nodes, keys % num_nodes, combined
+
+
+def build_adjacency_matrix(edges, undirected=False, combine='max',
+                           triangular=False, index_dtype=None,
+                           weight_dtype=None):
     """Build adjacency matrix.
 
+    In undirected mode edges are deduped and symmetrized in one pass (see
+    :func:`symmetrize_edges`): reciprocal and repeated edges between two nodes
+    become a single edge weighted by ``combine`` of their weights, stored in
+    both directions. With ``triangular`` only the upper triangle
+    (row <= col) is stored, halving the matrix; walk such graphs with
+    ``walk_graph(..., triangular=True)``.
+
+    Indices default to int32 and weights to float32 unless the graph needs
+    64 bits (see :func:`astype_graph`). Labels are returned packed in a
+    :class:`~jwalk.labels.LabelStore`.
+
     Args:
         edges (np.ndarray): a 2 or 3 dim array of the form [src, tgt, [weight]]
-        undirected (bool): if True, add matrix with its transpose
+        undirected (bool): if True, build a symmetric matrix
+        combine (str): how reciprocal/repeated undirected edges combine, one
+            of 'max', 'min', 'sum' or 'mean' (default='max')
+        triangular (bool): if True, store only the upper triangle of the
+            undirected matrix
+        index_dtype: int32 or int64 (default=smallest that fits)
+        weight_dtype: float32 or float64 (default=smallest that fits)
 
     Returns:
-        scipy.sparse.csr_matrix: adjacency matrix, np.ndarray: labels
+        scipy.sparse.csr_matrix: adjacency matrix, LabelStore: labels
     """
     assert edges.shape[1] in [2, 3], "Input must contain 2 or 3 columns"
+    assert undirected or not triangular, \
+        "Triangular storage requires an undirected graph"
 
     if edges.shape[1] == 2:  # if no weights
         logger.info("Weight column not found. Defaulting to value 1.")
@@ -51,19 +223,76 @@ def build_adjacency_matrix(edges, undirected=False):
     else:
         weights = edges[:, 2].astype('float')
 
-    edges = edges[:, :2]
-    nodes = np.unique(edges)  # returns sorted
+    # UTF-8 bytes sort like the labels and are 4x smaller than unicode
+    nodes, encoded = unique_labels(_encode_utf8(edges[:, :2]))
     num_nodes = nodes.shape[0]
 
-    encoded = encode_edges(edges, nodes)
+    if undirected:
+        rows, cols, weights = symmetrize_edges(encoded, weights, num_nodes,
+                                               combine)
+        if not triangular:  # mirror everything but self loops
+            off_diagonal = rows != cols
+            rows, cols = (np.concatenate((rows, cols[off_diagonal])),
+                          np.concatenate((cols, rows[off_diagonal])))
+            weights = np.concatenate((weights, weights[off_diagonal]))
+        encoded = (rows, cols)
+    else:
+        encoded = encoded.T
 
-    sp = sps.csr_matrix((weights, encoded.T), shape=(num_nodes, num_nodes))
+    if weight_dtype is None:
+        weight_dtype = smallest_weight_dtype(weights)
+    sp = sps.csr_matrix((weights.astype(weight_dtype), encoded),
+                        shape=(num_nodes, num_nodes))
+    return astype_graph(sp, index_dtype, weight_dtype), \
+        LabelStore.from_labels(nodes)
 
-    if undirected:
-        sp = make_undirected(sp)
-    return sp, nodes
+
+def build_biadjacency_matrix(interactions, index_dtype=None,
+                             weight_dtype=None):
+    """Build user->item biadjacency matrix from raw interactions.
+
+    Users and items are encoded separately, so an ID may appear on both sides.
+    Repeated interactions are summed. The item-item projection is never
+    built; ``walk_graph(..., bipartite=True)`` walks this matrix directly.
+
+    Args:
+        interactions (np.ndarray): a 2 or 3 dim array of the form
+            [user, item, [weight]]
+        index_dtype: int32 or int64 (default=smallest that fits)
+        weight_dtype: float32 or float64 (default=smallest that fits)
+
+    Returns:
+        scipy.sparse.csr_matrix: users x items matrix, LabelStore: item labels
+    """
+    assert interactions.shape[1] in [2, 3], "Input must contain 2 or 3 columns"
+
+    if interactions.shape[1] == 2:  # if no weights
+        logger.info("Weight column not found. Defaulting to value 1.")
+        weights = np.ones(interactions.shape[0], dtype='float')
+    else:
+        weights = interactions[:, 2].astype('float')
+
+    users, user_indices = unique_labels(_encode_utf8(interactions[:, 0]))
+    items, item_indices = unique_labels(_encode_utf8(interactions[:, 1]))
+    encoded = (user_indices, item_indices)
+
+    if weight_dtype is None:
+        weight_dtype = smallest_weight_dtype(weights)
+    if index_dtype is None:
+        index_dtype = smallest_index_dtype(
+            max(users.shape[0], items.shape[0]), interactions.shape[0])
+
+    sp = sps.csr_matrix((weights.astype(weight_dtype), encoded),
+                        shape=(users.shape[0], items.shape[0]))
+    return astype_graph(sp, index_dtype, weight_dtype), \
+        LabelStore.from_labels(items)
 
 
 def make_undirected(csr_matrix):
-    """Make CSR matrix undirected."""
+    """Make CSR matrix undirected.
+
+    Reciprocal edges are summed, so a pair present in both directions ends up
+    with double weight. ``build_adjacency_matrix(edges, undirected=True)``
+    dedupes instead.
+    """
     return csr_matrix + csr_matrix.T
@@ -1,16 +1,17 @@
 # -*- coding: utf-8 -*-
 """Load and save data."""
+import os
 import logging
 
 import numpy as np
-import scipy.sparse as sps
 
 try:
-    import pandas as pd
-except ImportError:
-    PANDAS_INSTALLED = False
-else:
-    PANDAS_INSTALLED = True
+    from importlib.util import find_spec
+except ImportError:  # Python 2
+    from pkgutil import find_loader as find_spec
+
+# pandas is only imported once edges are actually loaded
+PANDAS_INSTALLED = find_spec('pandas') is not None
 
 __all__ = ['load_edges', 'load_graph', 'save_graph']
 
@@ -29,6 +30,7 @@ def load_edges(fpath, delimiter=None, has_header=False):
         np.ndarray: array of edges
     """
     if PANDAS_INSTALLED:
+        import pandas as pd
         header = 'infer' if has_header else None
         df = pd.read_csv(fpath, delimiter=delimiter, header=header)
         edges = df.values
@@ -41,18 +43,73 @@ def load_edges(fpath, delimiter=None, has_header=False):
     return edges.astype('str')
 
 
+def _labels_path(filename):
+    """Directory of the labels saved next to the graph npz ``filename``.
+
+    Examples:
+        >>> print(_labels_path('graph.npz'))
+        graph.labels
+    """
+    root = filename[:-len('.npz')] if filename.endswith('.npz') else filename
+    return root + '.labels'
+
+
 def save_graph(filename, csr_matrix, labels=None):
+    """Save adjacency matrix as npz, keeping its dtypes, and labels next to
+    it.
+
+    Labels are saved packed (see :meth:`~jwalk.labels.LabelStore.save`) in
+    the directory :func:`_labels_path`, so they load memory-mapped.
+
+    Args:
+        filename (str): npz file path
+        csr_matrix (scipy.sparse.csr_matrix): adjacency matrix
+        labels (LabelStore or np.ndarray): node labels
+
+    Returns:
+        str: file path
+    """
+    from jwalk.labels import LabelStore
+
     np.savez(filename,
              data=csr_matrix.data,
              indices=csr_matrix.indices,
              indptr=csr_matrix.indptr,
-             shape=csr_matrix.shape,
-             labels=labels)
+             shape=csr_matrix.shape)
+    if labels is not None:
+        LabelStore.from_labels(labels).save(_labels_path(filename))
     return filename
 
 
-def load_graph(filename):
+def load_graph(filename, index_dtype=None, weight_dtype=None):
+    """Load adjacency matrix and labels saved by :func:`save_graph`.
+
+    Labels are memory-mapped. Graphs with labels inside the npz, packed
+    (``label_data`` and ``label_offsets``) or as a plain ``labels`` array,
+    are read as well.
+
+    Args:
+        filename (str): npz file path
+        index_dtype: int32 or int64 (default=smallest that fits)
+        weight_dtype: float32 or float64 (default=smallest that fits)
+
+    Returns:
+        scipy.sparse.csr_matrix: adjacency matrix, LabelStore: labels (None
+        if saved without labels)
+    """
+    import scipy.sparse as sps
+    from jwalk.graph import astype_graph
+    from jwalk.labels import LabelStore
+
     loader = np.load(filename)
     sp = sps.csr_matrix((loader['data'], loader['indices'], loader['indptr']),
                         shape=loader['shape'])
-    return sp, loader['labels']
+    if os.path.isdir(_labels_path(filename)):
+        labels = LabelStore.load(_labels_path(filename))
+    elif 'label_offsets' in loader.files:
+        labels = LabelStore(loader['label_data'], loader['label_offsets'])
+    elif 'labels' in loader.files:
+        labels = LabelStore.from_labels(loader['labels'])
+    else:
+        labels = None
+    return astype_graph(sp, index_dtype, weight_dtype), labels
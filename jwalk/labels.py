@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+"""Compact storage of node labels.
+
+Labels are packed as UTF-8 bytes back to back with an offsets array, instead
+of a fixed-width unicode array sized to the longest label. Label -> index
+lookups go through a hash index laid out like a csr matrix: buckets of
+positions sorted by hash value.
+"""
+import os
+import numbers
+
+import numpy as np
+
+__all__ = ['LabelStore']
+
+FNV_OFFSET = 0xcbf29ce484222325
+FNV_PRIME = 0x100000001b3
+UINT64_MASK = 0xffffffffffffffff
+
+# format walks from padded rows while max length <= ratio * mean length
+PADDED_WIDTH_RATIO = 4
+# labels packed at a time, bounding the temporary padding mask
+PACK_BLOCK_ROWS = 1 << 16
+
+
+def _encode_utf8(labels):
+    """Labels as a fixed-width bytes array of their UTF-8 encoding, a
+    quarter of the size of the unicode array for ASCII labels.
+
+    Examples:
+        >>> print(_encode_utf8(np.array([['a', 'bc']])).dtype)
+        |S2
+    """
+    labels = np.asarray(labels)
+    if labels.dtype.kind not in 'SU':
+        labels = labels.astype(str)
+    if labels.dtype.kind == 'S':
+        return labels
+    codes = np.ascontiguousarray(labels).view(np.uint32)
+    if not codes.size:
+        return labels.astype('S1')
+    if codes.max() < 128:  # ASCII: one byte per code point, no encoding
+        width = labels.dtype.itemsize // 4
+        return codes.astype(np.uint8).view('S%d' % width)
+    return np.char.encode(labels, 'utf-8')
+
+
+def _hash_bytes(value):
+    """64-bit FNV-1a hash of a bytes object.
+
+    Examples:
+        >>> hex(_hash_bytes(b'a'))
+        '0xaf63dc4c8601ec8c'
+    """
+    value = bytearray(value)
+    h = FNV_OFFSET
+    for byte in value:
+        h = ((h ^ byte) * FNV_PRIME) & UINT64_MASK
+    return h
+
+
+def _longest_first(lengths):
+    """Stable order of ``lengths`` from longest to shortest.
+
+    Returns:
+        np.ndarray order, np.ndarray lengths in that order
+    """
+    keys = -lengths
+    if lengths.size and lengths.max() < np.iinfo(np.int16).max:
+        keys = keys.astype(np.int16)  # radix sort
+    order = np.argsort(keys, kind='mergesort')
+    return order, lengths[order]
+
+
+def _hash_packed(data, offsets):
+    """64-bit FNV-1a hash of every packed label, byte position by position.
+
+    Labels are processed longest first so that the labels still being hashed
+    at a position are always a prefix of that order.
+    """
+    order, sorted_lengths = _longest_first(np.diff(offsets))
+    starts = offsets[:-1][order]
+    hashes = np.full(order.shape[0], FNV_OFFSET, dtype=np.uint64)
+    prime = np.uint64(FNV_PRIME)
+
+    with np.errstate(over='ignore'):
+        for position in range(int(sorted_lengths[0]) if order.size else 0):
+            active = np.searchsorted(-sorted_lengths, -position, side='left')
+            values = data[starts[:active] + position].astype(np.uint64)
+            hashes[:active] = (hashes[:active] ^ values) * prime
+
+    unsorted = np.empty_like(hashes)
+    unsorted[order] = hashes
+    return unsorted
+
+
+def _equal_packed(data, offsets, rows, other_data, other_offsets,
+                  other_rows):
+    """Whether label ``rows[i]`` equals label ``other_rows[i]`` of another
+    packed store, for every ``i``."""
+    starts = offsets[rows]
+    lengths = offsets[rows + 1] - starts
+    other_starts = other_offsets[other_rows]
+    equal = lengths == other_offsets[other_rows + 1] - other_starts
+
+    same_length = np.flatnonzero(equal)
+    order, sorted_lengths = _longest_first(lengths[same_length])
+    pairs = same_length[order]
+    for position in range(int(sorted_lengths[0]) if pairs.size else 0):
+        active = pairs[:np.searchsorted(-sorted_lengths, -position,
+                                        side='left')]
+        equal[active] &= (data[starts[active] + position] ==
+                          other_data[other_starts[active] + position])
+    return equal
+
+
+class LabelStore(object):
+    """Node labels packed as UTF-8 bytes with an offsets array.
+
+    Supports ``len``, iteration, O(1) ``store[i]`` and hashed
+    ``store.index(label)``. Indexing with an array of positions returns an
+    object array of ``str`` of the same shape; ``np.asarray(store)`` gives a
+    unicode array. Both arrays may be memory-mapped (see :meth:`load`).
+
+    Args:
+        data (np.ndarray): uint8 concatenated UTF-8 bytes of the labels
+        offsets (np.ndarray): int64 start of each label in ``data``, followed
+            by ``len(data)``
+    """
+
+    def __init__(self, data, offsets):
+        self.data = np.asanyarray(data, dtype=np.uint8)
+        self.offsets = np.asanyarray(offsets, dtype=np.int64)
+        assert self.offsets.ndim == 1 and self.offsets.shape[0] >= 1, \
+            "Offsets must have one entry per label plus one"
+        self._hash_index = None
+        self._padded = None
+
+    @classmethod
+    def from_labels(cls, labels):
+        """Pack a sequence of labels (e.g. a numpy unicode array).
+
+        Labels are packed from their UTF-8 bytes (an ``S`` array is used as
+        is) block by block, so the only full-size temporary is the bytes
+        array.
+
+        Args:
+            labels: array or sequence of ``str`` or UTF-8 ``bytes``
+
+        Returns:
+            LabelStore
+        """
+        if isinstance(labels, LabelStore):
+            return labels
+        labels = np.ascontiguousarray(_encode_utf8(labels)).ravel()
+        if not labels.size:
+            return cls(np.zeros(0, dtype=np.uint8), np.zeros(1, np.int64))
+
+        width = labels.dtype.itemsize
+        rows = labels.view(np.uint8).reshape(-1, width)
+        lengths = np.empty(rows.shape[0], dtype=np.int64)
+        blocks = []
+        for start in range(0, rows.shape[0], PACK_BLOCK_ROWS):
+            block = rows[start:start + PACK_BLOCK_ROWS]
+            nonzero = block != 0  # bytes labels end at their last non-null
+            block_lengths = width - np.argmax(nonzero[:, ::-1], axis=1)
+            block_lengths[~nonzero.any(axis=1)] = 0
+            lengths[start:start + block.shape[0]] = block_lengths
+            blocks.append(block[np.arange(width) < block_lengths[:, None]])
+        offsets = np.zeros(rows.shape[0] + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return cls(np.concatenate(blocks), offsets)
+
+    @classmethod
+    def load(cls, dirname, mmap_mode='r'):
+        """Load a store saved by :meth:`save`, memory-mapped by default.
+
+        Args:
+            dirname (str): directory written by :meth:`save`
+            mmap_mode (str): passed to ``np.load`` (default='r')
+
+        Returns:
+            LabelStore
+        """
+        return cls(np.load(os.path.join(dirname, 'data.npy'),
+                           mmap_mode=mmap_mode),
+                   np.load(os.path.join(dirname, 'offsets.npy'),
+                           mmap_mode=mmap_mode))
+
+    def save(self, dirname):
+        """Save the packed bytes and offsets as ``.npy`` files in a directory.
+
+        Args:
+            dirname (str): directory, created if missing
+
+        Returns:
+            str: directory path
+        """
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        np.save(os.path.join(dirname, 'data.npy'), self.data)
+        np.save(os.path.join(dirname, 'offsets.npy'), self.offsets)
+        return dirname
+
+    @property
+    def nbytes(self):
+        """Memory used by the packed bytes and offsets."""
+        return self.data.nbytes + self.offsets.nbytes
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    def __repr__(self):
+        return 'LabelStore(%d labels, %d bytes)' % (len(self), self.nbytes)
+
+    def __iter__(self):
+        raw = self.data.tobytes()
+        offsets = self.offsets.tolist()
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield raw[start:end].decode('utf-8')
+
+    def __array__(self, dtype=None, copy=None):
+        if copy is False:
+            raise ValueError("LabelStore decodes labels into a new array")
+        labels = np.array(list(self), dtype=str)
+        return labels if dtype is None else labels.astype(dtype)
+
+    def __getitem__(self, index):
+        if isinstance(index, numbers.Integral):
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError('label index out of range')
+            start, end = self.offsets[index], self.offsets[index + 1]
+            return self.data[start:end].tobytes().decode('utf-8')
+        if isinstance(index, slice):
+            index = np.arange(len(self))[index]
+
+        # decode every distinct label once
+        index = np.asarray(index)
+        unique, inverse = np.unique(index, return_inverse=True)
+        decoded = np.empty(unique.shape[0], dtype=object)
+        for position, label in enumerate(unique.tolist()):
+            decoded[position] = self[label]
+        return decoded[inverse].reshape(index.shape)
+
+    def __contains__(self, label):
+        return self._find(label) >= 0
+
+    def tolist(self):
+        """Labels as a list of ``str``."""
+        return list(self)
+
+    def index(self, label):
+        """Position of ``label``.
+
+        Raises:
+            KeyError: if ``label`` is not in the store
+        """
+        position = self._find(label)
+        if position < 0:
+            raise KeyError(label)
+        return position
+
+    def lookup(self, labels):
+        """Positions of many labels at once.
+
+        Args:
+            labels (LabelStore or np.ndarray): labels to look up
+
+        Returns:
+            np.ndarray: int64 positions, -1 where a label is missing
+        """
+        queries = LabelStore.from_labels(labels)
+        if self._hash_index is None:
+            self._hash_index = self._build_hash_index()
+        indptr, positions = self._hash_index
+
+        mask = np.uint64(indptr.shape[0] - 2)
+        buckets = (_hash_packed(queries.data, queries.offsets) & mask) \
+            .astype(np.int64)
+        found = np.full(len(queries), -1, dtype=np.int64)
+        pending = np.arange(len(queries))
+        probe = 0
+        while pending.size:  # try the next entry of every pending bucket
+            slots = indptr[buckets[pending]] + probe
+            inside = slots < indptr[buckets[pending] + 1]
+            pending, slots = pending[inside], slots[inside]
+            candidates = positions[slots]
+            equal = _equal_packed(self.data, self.offsets, candidates,
+                                  queries.data, queries.offsets, pending)
+            found[pending[equal]] = candidates[equal]
+            pending = pending[~equal]
+            probe += 1
+        return found
+
+    def concatenate(self, labels):
+        """New store with ``labels`` appended.
+
+        Args:
+            labels (LabelStore or np.ndarray): labels to append
+
+        Returns:
+            LabelStore
+        """
+        other = LabelStore.from_labels(labels)
+        return LabelStore(np.concatenate([self.data, other.data]),
+                          np.concatenate([self.offsets, other.offsets[1:] +
+                                          self.offsets[-1]]))
+
+    def _find(self, label):
+        if self._hash_index is None:
+            self._hash_index = self._build_hash_index()
+        indptr, positions = self._hash_index
+
+        encoded = label.encode('utf-8')
+        bucket = _hash_bytes(encoded) & (indptr.shape[0] - 2)
+        for position in positions[indptr[bucket]:indptr[bucket + 1]]:
+            start, end = self.offsets[position], self.offsets[position + 1]
+            if self.data[start:end].tobytes() == encoded:
+                return int(position)
+        return -1
+
+    def _build_hash_index(self):
+        """Positions grouped by hash bucket (power-of-two number of buckets).
+
+        Returns:
+            np.ndarray indptr, np.ndarray positions
+        """
+        num_buckets = 1
+        while num_buckets < len(self):
+            num_buckets *= 2
+        hashes = _hash_packed(self.data, self.offsets)
+        buckets = (hashes & np.uint64(num_buckets - 1)).astype(np.int64)
+        positions = np.argsort(buckets, kind='mergesort')
+        indptr = np.zeros(num_buckets + 1, dtype=np.int64)
+        np.cumsum(np.bincount(buckets, minlength=num_buckets),
+                  out=indptr[1:])
+        return indptr, positions
+
+    def _padded_rows(self):
+        """Labels followed by a space in rows of ``max length + 1`` bytes,
+        or None if the longest label is much longer than the mean (the rows
+        would mostly be padding).
+
+        Returns:
+            np.ndarray uint8 rows, np.ndarray lengths
+        """
+        if self._padded is None:
+            lengths = np.diff(self.offsets)
+            width = int(lengths.max()) + 1 if lengths.size else 1
+            if width > PADDED_WIDTH_RATIO * (lengths.mean() + 1):
+                self._padded = False
+            else:
+                rows = np.full((len(self), width), ord(' '), dtype=np.uint8)
+                rows[np.arange(width) < lengths[:, None]] = self.data
+                self._padded = rows, lengths
+        return self._padded or None
+
+    def format_walks(self, walks):
+        """Text of walks, one per line with labels separated by spaces.
+
+        Works on the packed bytes directly, without creating label strings:
+        labels of similar lengths are gathered as whole padded rows and the
+        padding is masked out, others are copied byte position by position.
+
+        Args:
+            walks (np.ndarray): walks of node indices padded with -1; rows
+                without any node are skipped
+
+        Returns:
+            bytes: UTF-8 text
+        """
+        mask = walks >= 0
+        tokens = walks[mask].astype(np.int64)
+        if not tokens.size:
+            return b''
+        padded = self._padded_rows()
+        if padded is not None:
+            rows, lengths = padded
+            lengths = lengths[tokens]
+            text = rows[tokens][np.arange(rows.shape[1]) <= lengths[:, None]]
+            ends = np.cumsum(lengths + 1)  # label + separator
+        else:
+            starts = self.offsets[tokens]
+            lengths = self.offsets[tokens + 1] - starts
+            ends = np.cumsum(lengths + 1)
+            text = np.full(int(ends[-1]), ord(' '), dtype=np.uint8)
+
+            # copy byte position by position, longest labels first
+            order, sorted_lengths = _longest_first(lengths)
+            sources, targets = starts[order], (ends - lengths - 1)[order]
+            for position in range(int(sorted_lengths[0])):
+                active = np.searchsorted(-sorted_lengths, -position,
+                                         side='left')
+                text[targets[:active] + position] = \
+                    self.data[sources[:active] + position]
+
+        last = np.cumsum(mask.sum(axis=1))[mask.any(axis=1)] - 1
+        text[ends[last] - 1] = ord('\n')
+        return text.tobytes()
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""Overlap random walks with Word2Vec training.
+
+A first pass of the walk kernels only counts node visits, for the
+vocabulary. Walker threads then run the kernels (which release the GIL)
+again over node ranges, with the same seeds, and push batches of walks into
+a bounded queue; the calling thread trains a gensim model on each batch as
+it arrives. A full queue blocks the walkers, so
+at most ``queue_size`` batches are held in memory at any time. If training
+stops early, the walkers are told to stop and the queue is drained.
+"""
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+try:  # Python 3
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+import numpy as np
+
+from jwalk import corpus
+from jwalk import walks
+
+__all__ = ['walk_and_train']
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+# how often a walker blocked on a full queue checks whether to stop
+QUEUE_POLL_SECONDS = 0.1
+
+
+def _put(batches, item, stop):
+    """Put ``item`` in ``batches``, giving up once ``stop`` is set."""
+    while not stop.is_set():
+        try:
+            batches.put(item, timeout=QUEUE_POLL_SECONDS)
+            return
+        except queue.Full:  # the trainer is behind
+            pass
+
+
+def _drain(batches):
+    try:
+        while True:
+            batches.get_nowait()
+    except queue.Empty:
+        pass
+
+
+def _count_walks(kernel, args, tasks, num_nodes, walk_length):
+    """Counting thread: visits per node and histograms of the walks of the
+    node ranges from ``tasks``; the walks themselves are dropped."""
+    counts = np.zeros(num_nodes, dtype=np.int64)
+    lengths = np.zeros(walk_length + 1, dtype=np.int64)
+    distinct = np.zeros(walk_length + 1, dtype=np.int64)
+    while True:
+        try:
+            first, last, seed = tasks.get_nowait()
+        except queue.Empty:
+            return counts, lengths, distinct
+        _, visits, walk_lengths, walk_distinct = getattr(walks, kernel)(
+            *(args + (first, last, seed)))
+        counts += visits
+        lengths += walk_lengths
+        distinct += walk_distinct
+
+
+def _walk_batches(kernel, args, tasks, labels, batches, stop):
+    """Walker thread: walk node ranges from ``tasks`` into ``batches``."""
+    try:
+        while not stop.is_set():
+            try:
+                first, last, seed = tasks.get_nowait()
+            except queue.Empty:
+                return
+            walk_indices = getattr(walks, kernel)(
+                *(args + (first, last, seed)))[0]
+            tokens = walks.indices_to_labels(walk_indices, labels)
+            sentences = [walk[:length].tolist() for walk, length in
+                         zip(tokens, (walk_indices >= 0).sum(axis=1))]
+            _put(batches, sentences, stop)
+    except Exception as error:  # re-raised by the trainer
+        _put(batches, error, stop)
+    finally:
+        _put(batches, _DONE, stop)
+
+
+def _build_model(word_freq, corpus_count, size, window, workers):
+    """Untrained skip-gram model with a vocabulary from ``word_freq``."""
+    from jwalk.skipgram import Skipgram
+
+    model = Skipgram(raw_vocab=word_freq, corpus_count=corpus_count,
+                     size=size, window=window, min_count=1, workers=workers)
+    if hasattr(model, 'build_vocab_from_freq'):
+        model.build_vocab_from_freq(word_freq, corpus_count=corpus_count)
+    else:  # Skipgram.scan_vocab keeps the supplied raw_vocab
+        model.build_vocab([])
+    return model
+
+
+def walk_and_train(csr_matrix, labels, walk_length=40, num_walks=1,
+                   size=200, window=5, workers=3, walk_workers=None,
+                   triangular=False, bipartite=False, seed=None,
+                   batch_walks=10000, queue_size=4):
+    """Train a skip-gram model on random walks while they are generated.
+
+    The vocabulary is built upfront from the visit counts of a first pass
+    of the same walks, which are counted but neither kept nor trained on, so
+    it matches the one :func:`~jwalk.skipgram.train_model` builds from a
+    corpus of these walks. Each batch is trained in one pass and the walks
+    are generated again for each of the model's epochs, with the same seeds,
+    so every epoch is a pass over the same corpus; the learning rate decays
+    linearly over all passes.
+
+    Args:
+        csr_matrix: adjacency matrix, as passed to ``walk_graph_indices``
+        labels (np.ndarray): node labels aligned with ``csr_matrix``
+        walk_length (int): maximum length of random walk (default=40)
+        num_walks (int): number of walks to do for each node (default=1)
+        size (int): embedding size (default=200)
+        window (int): window size (default=5)
+        workers (int): gensim training threads (default=3)
+        walk_workers (int): walker threads (default=``workers``)
+        triangular (bool): ``csr_matrix`` is the upper triangle of an
+            undirected graph
+        bipartite (bool): ``csr_matrix`` is a user->item biadjacency matrix
+            and ``labels`` are the item labels
+        seed (int): random seed of the walks (default=None, unpredictable)
+        batch_walks (int): approximate number of walks per batch
+            (default=10000)
+        queue_size (int): maximum number of batches waiting to be trained
+            (default=4)
+
+    Returns:
+        Word2Vec model, :class:`~jwalk.stats.WalkStats` of the walks
+    """
+    from jwalk.stats import WalkStats
+
+    walk_workers = walk_workers or workers
+    kernel, args, degrees = corpus._walker(csr_matrix, walk_length,
+                                           triangular, bipartite)
+    num_nodes = degrees.shape[0]
+    total_walks = num_nodes * num_walks
+
+    num_chunks = max(walk_workers * 4, -(-num_nodes // batch_walks))
+    chunks = corpus.balanced_chunks(
+        corpus.estimate_walk_cost(degrees, walk_length), num_chunks)
+    repeat_seeds = np.random.RandomState(seed).randint(
+        0, 2 ** 63 - 1, size=num_walks, dtype=np.int64)
+    schedule = [(first, last, int(repeat_seed))
+                for repeat_seed in repeat_seeds for first, last in chunks]
+
+    tasks = queue.Queue()
+    for task in schedule:
+        tasks.put(task)
+    pool = ThreadPool(walk_workers)
+    try:
+        counted = pool.map(lambda _: _count_walks(kernel, args, tasks,
+                                                  num_nodes, walk_length),
+                           range(walk_workers))
+    finally:
+        pool.close()
+    counts, lengths, distinct = [np.sum(totals, axis=0)
+                                 for totals in zip(*counted)]
+    word_freq = dict(zip(labels, counts.tolist()))
+    model = _build_model(word_freq, total_walks, size, window, workers)
+
+    epochs = model.epochs if hasattr(model, 'epochs') else model.iter
+    for _ in range(epochs):
+        for task in schedule:
+            tasks.put(task)
+    batches = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    threads = [threading.Thread(target=_walk_batches,
+                                name='jwalk-walker-%d' % k,
+                                args=(kernel, args, tasks, labels, batches,
+                                      stop))
+               for k in range(walk_workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    alpha, min_alpha = model.alpha, model.min_alpha
+    total = float(total_walks * epochs)
+    trained, running = 0, len(threads)
+    try:
+        while running:
+            batch = batches.get()
+            if batch is _DONE:
+                running -= 1
+                continue
+            if isinstance(batch, Exception):
+                raise batch
+            start_alpha = alpha - (alpha - min_alpha) * trained / total
+            trained += len(batch)
+            end_alpha = alpha - (alpha - min_alpha) * trained / total
+            model.train(batch, total_examples=len(batch), epochs=1,
+                        start_alpha=start_alpha, end_alpha=end_alpha)
+            logger.debug("Trained %d/%d walks", trained, total)
+    finally:
+        stop.set()
+        _drain(batches)
+        for thread in threads:
+            thread.join()
+    # single passes set the model's epochs to 1
+    if hasattr(model, 'epochs'):
+        model.epochs = epochs
+    else:  # gensim < 3.3
+        model.iter = epochs
+
+    walk_stats = WalkStats(lengths, distinct, counts,
+                           np.full(num_nodes, num_walks))
+    return model, walk_stats
@@ -0,0 +1,425 @@
+# -*- coding: utf-8 -*-
+"""Quantized embeddings for memory-efficient similarity search.
+
+Vectors are normalized to unit length before quantization, so inner products
+on the codes approximate cosine similarity (as in ``most_similar``). Search
+scans the codes block by block without decoding the whole matrix:
+
+* ``float16``: half-precision vectors (2 bytes per dimension)
+* ``int8``: per-dimension scalar quantization to 256 levels (1 byte per
+  dimension)
+* ``pq``: product quantization; each of ``num_subspaces`` slices of a vector
+  is replaced by the index of its nearest centroid (1 byte per subspace),
+  scored with per-query lookup tables
+"""
+import abc
+import logging
+
+import numpy as np
+
+from jwalk.labels import LabelStore
+
+__all__ = ['quantize_model', 'load_quantized']
+
+logger = logging.getLogger(__name__)
+
+# rows scored at a time during search
+SEARCH_BLOCK_ROWS = 65536
+
+# abstract base usable on Python 2 and 3 (no metaclass syntax in common)
+_ABC = abc.ABCMeta('_ABC', (object,), {})
+
+
+def _unit_rows(vectors):
+    """Rows scaled to unit length (zero rows stay zero), as float32."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1)
+    return vectors / np.maximum(norms, 1e-12)[:, None]
+
+
+def _merge_top_k(best_scores, best_rows, scores, offset, k):
+    """Merge the top ``k`` of a block of scores into the running top ``k``."""
+    picked = np.arange(scores.shape[0])[:, None]
+    if scores.shape[1] > k:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = scores[picked, top]
+    else:
+        top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    scores = np.hstack([best_scores, scores])
+    rows = np.hstack([best_rows, top + offset])
+    keep = np.argsort(-scores, axis=1, kind='mergesort')[:, :k]
+    return scores[picked, keep], rows[picked, keep]
+
+
+def _kmeans(points, num_centroids, iterations=20, random_state=None):
+    """Lloyd's k-means with centroids initialized from random points.
+
+    Args:
+        points (np.ndarray): float32 points, one per row
+        num_centroids (int): number of clusters
+        iterations (int): number of assignment/update rounds (default=20)
+        random_state (np.random.RandomState): random state (default=None)
+
+    Returns:
+        np.ndarray: float32 centroids
+    """
+    random_state = random_state or np.random.RandomState()
+    centroids = points[random_state.choice(points.shape[0], num_centroids,
+                                           replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _nearest(points, centroids)
+        sizes = np.bincount(assignment, minlength=num_centroids)
+        sums = np.column_stack([
+            np.bincount(assignment, points[:, d], minlength=num_centroids)
+            for d in range(points.shape[1])])
+        empty = sizes == 0
+        centroids[~empty] = sums[~empty] / sizes[~empty, None]
+        if empty.any():  # restart empty clusters from random points
+            centroids[empty] = points[random_state.choice(
+                points.shape[0], empty.sum(), replace=False)]
+    return centroids
+
+
+def _nearest(points, centroids):
+    """Index of the nearest centroid of each point (squared L2)."""
+    distances = (np.einsum('ij,ij->i', centroids, centroids)[None, :] -
+                 2 * points.dot(centroids.T))
+    return np.argmin(distances, axis=1)
+
+
+class QuantizedVectors(_ABC):
+    """Unit-normalized vectors in a compact encoding, searchable in place.
+
+    Subclasses implement :meth:`encode` (classmethod building the encoded
+    arrays), :meth:`_encode_rows`, :meth:`_scores` and :meth:`reconstruct`;
+    ``row_array`` names the array holding one entry per vector.
+
+    Args:
+        labels (LabelStore or np.ndarray): labels aligned with the rows
+        arrays (dict): encoded arrays of the subclass
+    """
+
+    method = None
+    row_array = 'codes'
+
+    def __init__(self, labels, **arrays):
+        self.labels = LabelStore.from_labels(labels)
+        self.arrays = arrays
+
+    @classmethod
+    def fit(cls, vectors, labels, **kwargs):
+        """Quantize float vectors.
+
+        Args:
+            vectors (np.ndarray): one row per label
+            labels (LabelStore or np.ndarray): labels aligned with the rows
+            kwargs: options of the encoding
+
+        Returns:
+            QuantizedVectors
+        """
+        assert vectors.shape[0] == len(labels), \
+            "Vectors and labels must be aligned"
+        return cls(labels, **cls.encode(_unit_rows(vectors), **kwargs))
+
+    @classmethod
+    @abc.abstractmethod
+    def encode(cls, unit_vectors, **kwargs):
+        """Encoded arrays of unit vectors, as keyword arguments of the
+        constructor."""
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __repr__(self):
+        return '%s(%d vectors, %d bytes)' % (type(self).__name__, len(self),
+                                             self.nbytes)
+
+    @property
+    def nbytes(self):
+        """Memory of the encoded vectors (codes and codebooks)."""
+        return sum(array.nbytes for array in self.arrays.values())
+
+    @abc.abstractmethod
+    def _encode_rows(self, unit_vectors):
+        """Encode more vectors with the fitted parameters."""
+
+    @abc.abstractmethod
+    def _scores(self, queries, start, end):
+        """Inner products of unit ``queries`` with rows ``start:end``."""
+
+    def add(self, vectors, labels):
+        """Append vectors, encoded with the existing parameters (codebooks
+        and ranges are not retrained).
+
+        Args:
+            vectors (np.ndarray): one row per label
+            labels (LabelStore or np.ndarray): new labels
+
+        Returns:
+            QuantizedVectors: self
+        """
+        assert vectors.shape[0] == len(labels), \
+            "Vectors and labels must be aligned"
+        self.arrays[self.row_array] = np.concatenate([
+            self.arrays[self.row_array],
+            self._encode_rows(_unit_rows(vectors))])
+        self.labels = self.labels.concatenate(labels)
+        return self
+
+    @abc.abstractmethod
+    def reconstruct(self, rows=None):
+        """Decoded float32 (approximately unit) vectors of ``rows``."""
+
+    def search(self, queries, k=10):
+        """Rows most similar to each query by cosine similarity.
+
+        Args:
+            queries (np.ndarray): float vectors, one per row (or a single
+                vector)
+            k (int): number of results per query (default=10)
+
+        Returns:
+            np.ndarray rows, np.ndarray scores; both of shape
+            (num_queries, k), best first
+        """
+        queries = _unit_rows(np.atleast_2d(queries))
+        k = min(k, len(self))
+        best_scores = np.empty((queries.shape[0], 0), dtype=np.float32)
+        best_rows = np.empty((queries.shape[0], 0), dtype=np.int64)
+        for start in range(0, len(self), SEARCH_BLOCK_ROWS):
+            end = min(start + SEARCH_BLOCK_ROWS, len(self))
+            best_scores, best_rows = _merge_top_k(
+                best_scores, best_rows, self._scores(queries, start, end),
+                start, k)
+        return best_rows, best_scores
+
+    def most_similar(self, label, topn=10):
+        """Labels most similar to ``label``, like gensim's ``most_similar``.
+
+        Returns:
+            list: (label, cosine similarity) pairs, best first
+        """
+        row = self.labels.index(label)
+        rows, scores = self.search(self.reconstruct([row]), topn + 1)
+        return [(self.labels[int(r)], float(s))
+                for r, s in zip(rows[0], scores[0]) if r != row][:topn]
+
+    def save(self, filename):
+        """Save as npz with the labels packed.
+
+        Returns:
+            str: file path
+        """
+        np.savez(filename, method=self.method, label_data=self.labels.data,
+                 label_offsets=self.labels.offsets, **self.arrays)
+        return filename
+
+
+class Float32Vectors(QuantizedVectors):
+    """Unquantized unit vectors, the baseline of the other encodings."""
+
+    method = 'float32'
+    row_array = 'vectors'
+
+    @classmethod
+    def encode(cls, unit_vectors):
+        return {'vectors': unit_vectors}
+
+    def _encode_rows(self, unit_vectors):
+        return unit_vectors.astype(self.arrays['vectors'].dtype)
+
+    def _scores(self, queries, start, end):
+        return queries.dot(self.arrays['vectors'][start:end].T)
+
+    def reconstruct(self, rows=None):
+        vectors = self.arrays['vectors']
+        return vectors if rows is None else vectors[rows]
+
+
+class Float16Vectors(Float32Vectors):
+    """Unit vectors stored as float16."""
+
+    method = 'float16'
+
+    @classmethod
+    def encode(cls, unit_vectors):
+        return {'vectors': unit_vectors.astype(np.float16)}
+
+    def _scores(self, queries, start, end):
+        block = self.arrays['vectors'][start:end].astype(np.float32)
+        return queries.dot(block.T)
+
+    def reconstruct(self, rows=None):
+        return super(Float16Vectors, self).reconstruct(rows).astype(
+            np.float32)
+
+
+class Int8Vectors(QuantizedVectors):
+    """Per-dimension scalar quantization of unit vectors to uint8 codes.
+
+    Dimension ``j`` is decoded as ``low[j] + code * scale[j]``, so a query's
+    score is ``q . low + codes . (q * scale)``.
+    """
+
+    method = 'int8'
+
+    @classmethod
+    def encode(cls, unit_vectors):
+        low = unit_vectors.min(axis=0)
+        scale = (unit_vectors.max(axis=0) - low) / 255.0
+        scale[scale == 0] = 1.0
+        quantized = cls(np.zeros(0, dtype=str), low=low.astype(np.float32),
+                        scale=scale.astype(np.float32))
+        return {'codes': quantized._encode_rows(unit_vectors),
+                'low': quantized.arrays['low'],
+                'scale': quantized.arrays['scale']}
+
+    def _encode_rows(self, unit_vectors):
+        low, scale = self.arrays['low'], self.arrays['scale']
+        codes = np.empty(unit_vectors.shape, dtype=np.uint8)
+        for start in range(0, unit_vectors.shape[0], SEARCH_BLOCK_ROWS):
+            block = unit_vectors[start:start + SEARCH_BLOCK_ROWS]
+            codes[start:start + SEARCH_BLOCK_ROWS] = np.clip(
+                np.round((block - low) / scale), 0, 255)
+        return codes
+
+    def _scores(self, queries, start, end):
+        codes = self.arrays['codes'][start:end].astype(np.float32)
+        offset = queries.dot(self.arrays['low'])
+        return codes.dot((queries * self.arrays['scale']).T).T + \
+            offset[:, None]
+
+    def reconstruct(self, rows=None):
+        codes = self.arrays['codes']
+        codes = codes if rows is None else codes[rows]
+        return self.arrays['low'] + codes * self.arrays['scale']
+
+
+class PQVectors(QuantizedVectors):
+    """Product quantization of unit vectors.
+
+    Vectors are split into ``num_subspaces`` slices and every slice is
+    replaced by its nearest of up to 256 centroids trained with k-means.
+    """
+
+    method = 'pq'
+
+    @classmethod
+    def encode(cls, unit_vectors, num_subspaces=None, num_centroids=256,
+               iterations=20, sample_size=65536, seed=0):
+        """Train the codebooks and encode.
+
+        Args:
+            unit_vectors (np.ndarray): unit vectors to encode
+            num_subspaces (int): bytes per vector, must divide the vector
+                size (default=largest divisor up to a quarter of the size)
+            num_centroids (int): centroids per subspace, at most 256
+                (default=256)
+            iterations (int): k-means iterations (default=20)
+            sample_size (int): vectors the codebooks are trained on
+                (default=65536)
+            seed (int): random seed (default=0)
+        """
+        num_vectors, size = unit_vectors.shape
+        if num_subspaces is None:
+            num_subspaces = next(m for m in range(max(size // 4, 1), 0, -1)
+                                 if size % m == 0)
+        assert size % num_subspaces == 0, \
+            "Vector size must be divisible by num_subspaces"
+        assert num_centroids <= 256, "Codes are one byte per subspace"
+
+        random_state = np.random.RandomState(seed)
+        num_centroids = min(num_centroids, num_vectors)
+        sample = unit_vectors[random_state.choice(
+            num_vectors, min(sample_size, num_vectors), replace=False)]
+        width = size // num_subspaces
+
+        centroids = np.empty((num_subspaces, num_centroids, width),
+                             dtype=np.float32)
+        for j in range(num_subspaces):
+            centroids[j] = _kmeans(sample[:, j * width:(j + 1) * width],
+                                   num_centroids, iterations, random_state)
+            logger.debug("Trained codebook %d/%d", j + 1, num_subspaces)
+        quantized = cls(np.zeros(0, dtype=str), centroids=centroids)
+        return {'codes': quantized._encode_rows(unit_vectors),
+                'centroids': centroids}
+
+    def _encode_rows(self, unit_vectors):
+        centroids = self.arrays['centroids']
+        num_subspaces, _, width = centroids.shape
+        codes = np.empty((unit_vectors.shape[0], num_subspaces),
+                         dtype=np.uint8)
+        for j in range(num_subspaces):
+            for start in range(0, unit_vectors.shape[0], SEARCH_BLOCK_ROWS):
+                block = unit_vectors[start:start + SEARCH_BLOCK_ROWS,
+                                     j * width:(j + 1) * width]
+                codes[start:start + SEARCH_BLOCK_ROWS, j] = _nearest(
+                    block, centroids[j])
+        return codes
+
+    def _scores(self, queries, start, end):
+        centroids = self.arrays['centroids']
+        num_subspaces, _, width = centroids.shape
+        # tables[q, j, c]: score of centroid c of subspace j for query q
+        tables = np.einsum('qjd,jcd->qjc',
+                           queries.reshape(queries.shape[0], num_subspaces,
+                                           width), centroids)
+        codes = self.arrays['codes'][start:end]
+        scores = np.zeros((queries.shape[0], end - start), dtype=np.float32)
+        for j in range(num_subspaces):
+            scores += tables[:, j, codes[:, j]]
+        return scores
+
+    def reconstruct(self, rows=None):
+        codes = self.arrays['codes']
+        codes = codes if rows is None else codes[rows]
+        centroids = self.arrays['centroids']
+        return np.hstack([centroids[j][codes[:, j]]
+                          for j in range(centroids.shape[0])])
+
+
+QUANTIZERS = {cls.method: cls for cls in
+              (Float32Vectors, Float16Vectors, Int8Vectors, PQVectors)}
+
+
+def quantize_model(model, method='int8', **kwargs):
+    """Quantize the vectors of a trained model.
+
+    Args:
+        model: ``Word2Vec`` (e.g. from ``train_model``) or ``KeyedVectors``
+            (e.g. from ``to_keyed_vectors``)
+        method (str): 'float32', 'float16', 'int8' or 'pq' (default='int8')
+        kwargs: options of the encoding, see :meth:`PQVectors.encode`
+
+    Returns:
+        QuantizedVectors
+    """
+    assert method in QUANTIZERS, \
+        "method must be one of %s" % sorted(QUANTIZERS)
+
+    # Word2Vec keeps its KeyedVectors in ``wv``; KeyedVectors' own ``wv`` is
+    # a deprecated alias of itself
+    keyed_vectors = vars(model).get('wv', model)
+    if hasattr(keyed_vectors, 'vectors'):
+        vectors = keyed_vectors.vectors
+    else:  # gensim < 3.4
+        vectors = keyed_vectors.syn0
+    labels = LabelStore.from_labels(keyed_vectors.index2word)
+    return QUANTIZERS[method].fit(vectors, labels, **kwargs)
+
+
+def load_quantized(filename):
+    """Load vectors saved by :meth:`QuantizedVectors.save`.
+
+    Args:
+        filename (str): npz file path
+
+    Returns:
+        QuantizedVectors
+    """
+    loader = np.load(filename)
+    arrays = {key: loader[key] for key in loader.files
+              if key not in ('method', 'label_data', 'label_offsets')}
+    labels = LabelStore(loader['label_data'], loader['label_offsets'])
+    return QUANTIZERS[str(loader['method'])](labels, **arrays)
@@ -1,12 +1,16 @@
 # -*- coding: utf-8 -*-
 """Build word2vec model."""
 import os
+import time
 import logging
+import threading
 
+import numpy as np
 from gensim.models import Word2Vec
-from gensim.models.word2vec import LineSentence
+from gensim.models.keyedvectors import KeyedVectors
+from gensim.models.word2vec import LineSentence, Vocab
 
-__all__ = ['train_model']
+__all__ = ['train_model', 'train_native', 'to_keyed_vectors']
 
 logger = logging.getLogger(__name__)
 
@@ -16,7 +20,8 @@ def train_model(corpus, size=200, window=5, workers=3, model_path=None,
     """Train using Skipgram model.
 
     Args:
-        corpus (str):       file path of corpus
+        corpus (str):       file path of corpus, or list of paths of its
+                            shards
         size (int):         embedding size (default=200)
         window (int):       window size (default=5)
         workers (int):      number of workers (default=3)
@@ -27,7 +32,10 @@ def train_model(corpus, size=200, window=5, workers=3, model_path=None,
     Returns:
         Word2Vec: word2vec model
     """
-    sentences = LineSentence(corpus)
+    if isinstance(corpus, (list, tuple)):
+        sentences = ShardedLineSentence(corpus)
+    else:
+        sentences = LineSentence(corpus)
     if model_path is not None:
         logger.info("Updating pre-existing model: %s", model_path)
         assert os.path.isfile(model_path), "File does not exist"
@@ -42,6 +50,19 @@ def train_model(corpus, size=200, window=5, workers=3, model_path=None,
     return model
 
 
+class ShardedLineSentence(object):
+    """Sentences of several corpus files, one after the other (restartable,
+    as gensim iterates the corpus once per epoch)."""
+
+    def __init__(self, paths):
+        self.shards = [LineSentence(path) for path in paths]
+
+    def __iter__(self):
+        for shard in self.shards:
+            for sentence in shard:
+                yield sentence
+
+
 class Skipgram(Word2Vec):
     """A subclass to allow more customization of the Word2Vec internals."""
 
@@ -54,3 +75,114 @@ class Skipgram(Word2Vec):
         """Override to supply own word frequencies."""
         if self.corpus_count is None or self.raw_vocab is None:
             super(Skipgram, self).scan_vocab(sentences, progress_per, trim_rule)  # NOQA: E501
+
+
+def keep_probabilities(counts, sample=1e-3):
+    """Probability of keeping each node token when subsampling frequent nodes.
+
+    Uses the same formula as word2vec/gensim.
+
+    Args:
+        counts (np.ndarray): node frequencies
+        sample (float): subsampling threshold, 0 to disable (default=1e-3)
+
+    Returns:
+        np.ndarray: float32 probabilities
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    if not sample:
+        return np.ones(counts.shape[0], dtype=np.float32)
+    threshold = sample * counts.sum()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        probs = (np.sqrt(counts / threshold) + 1) * (threshold / counts)
+    probs[counts == 0] = 1.0
+    return np.minimum(probs, 1.0).astype(np.float32)
+
+
+def train_native(walks, counts, size=200, window=5, workers=3, negative=5,
+                 epochs=5, alpha=0.025, min_alpha=0.0001, sample=1e-3,
+                 seed=1):
+    """Train skip-gram with negative sampling straight from node-index walks.
+
+    Skips gensim's text pipeline: the negative-sampling table comes from the
+    exact ``counts`` of the walks and ``workers`` threads update the shared
+    vectors without locks. ``walks`` is shuffled in place.
+
+    Args:
+        walks (np.ndarray): walks of node indices padded with -1, e.g. from
+            ``walk_graph_indices``
+        counts (np.ndarray): node frequencies in ``walks``
+        size (int):         embedding size (default=200)
+        window (int):       window size (default=5)
+        workers (int):      number of threads (default=3)
+        negative (int):     negative samples per pair (default=5)
+        epochs (int):       passes over the walks (default=5)
+        alpha (float):      initial learning rate (default=0.025)
+        min_alpha (float):  final learning rate (default=0.0001)
+        sample (float):     frequent-node subsampling threshold (default=1e-3)
+        seed (int):         random seed (default=1)
+
+    Returns:
+        np.ndarray: float32 vectors, one row per node
+    """
+    from jwalk import sgns
+
+    num_nodes = counts.shape[0]
+    random_state = np.random.RandomState(seed)
+    syn0 = ((random_state.rand(num_nodes, size) - 0.5) / size)
+    syn0 = syn0.astype(np.float32)
+    syn1neg = np.zeros((num_nodes, size), dtype=np.float32)
+    cum_table = sgns.unigram_table(counts)
+    keep_probs = keep_probabilities(counts, sample)
+
+    random_state.shuffle(walks)
+    bounds = np.linspace(0, walks.shape[0], workers + 1).astype(int)
+
+    for epoch in range(epochs):
+        start_alpha = alpha - (alpha - min_alpha) * epoch / epochs
+        end_alpha = alpha - (alpha - min_alpha) * (epoch + 1) / epochs
+        seeds = random_state.randint(2 ** 31, size=workers)
+        words = [0] * workers
+
+        def work(worker):
+            words[worker] = sgns.train_walks(
+                syn0, syn1neg, walks[bounds[worker]:bounds[worker+1]],
+                cum_table, keep_probs, window, negative, start_alpha,
+                end_alpha, seeds[worker])
+
+        start = time.time()
+        threads = [threading.Thread(target=work, args=(worker,))
+                   for worker in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = max(time.time() - start, 1e-9)
+        logger.info("Epoch %d: %d words, %.0f words/s", epoch + 1,
+                    sum(words), sum(words) / elapsed)
+
+    return syn0
+
+
+def to_keyed_vectors(vectors, labels, counts=None):
+    """Wrap a vector matrix as gensim ``KeyedVectors``.
+
+    Args:
+        vectors (np.ndarray): one row per node
+        labels (np.ndarray): node labels aligned with ``vectors``
+        counts (np.ndarray): node frequencies (default=None)
+
+    Returns:
+        KeyedVectors
+    """
+    try:
+        keyed_vectors = KeyedVectors(vectors.shape[1])
+    except TypeError:  # gensim < 3.3 takes no vector size
+        keyed_vectors = KeyedVectors()
+    keyed_vectors.syn0 = vectors
+    keyed_vectors.index2word = [str(label) for label in labels]
+    keyed_vectors.vocab = {
+        word: Vocab(index=index,
+                    count=int(counts[index]) if counts is not None else 1)
+        for index, word in enumerate(keyed_vectors.index2word)}
+    return keyed_vectors
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""Skip-gram with negative sampling trained directly on node-index walks.
+
+Threads share the embedding matrices without locks (Hogwild) and every call
+releases the GIL for its whole batch of walks.
+"""
+import cython
+cimport numpy as np
+import numpy as np
+from libc.math cimport exp
+from libc.string cimport memset
+from scipy.linalg.cython_blas cimport sdot, saxpy
+
+ctypedef fused index_t:
+    np.int32_t
+    np.int64_t
+
+cdef int ONE = 1
+cdef float ONEF = 1.0
+cdef double MAX_EXP = 6.0
+# cumulative negative-sampling distribution is scaled to [0, DOMAIN]
+DOMAIN = 2 ** 31 - 1
+
+
+cdef inline unsigned long long _random(unsigned long long *state) nogil:
+    """48-bit linear congruential generator (same as word2vec/gensim)."""
+    state[0] = (state[0] * 25214903917ULL + 11ULL) & 281474976710655ULL
+    return state[0]
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef inline Py_ssize_t _sample_negative(np.uint32_t *cum_table,
+                                        Py_ssize_t table_size,
+                                        unsigned long long *state) nogil:
+    """Draw a node from the cumulative unigram table (binary search)."""
+    cdef:
+        unsigned long long target
+        Py_ssize_t lo = 0, hi = table_size - 1, mid
+
+    target = (_random(state) >> 16) % cum_table[table_size - 1]
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if cum_table[mid] > target:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+@cython.cdivision(True)
+cdef void _train_pair(float *syn0, float *syn1neg, float *work, int size,
+                      Py_ssize_t word_in, Py_ssize_t word_out, int negative,
+                      np.uint32_t *cum_table, Py_ssize_t table_size,
+                      float alpha, unsigned long long *state) nogil:
+    """One SGNS update: ``word_in``'s vector predicts ``word_out``."""
+    cdef:
+        float *l1 = syn0 + word_in * size
+        float *l2
+        float f, g, label
+        Py_ssize_t target
+        int d
+
+    memset(work, 0, size * sizeof(float))
+    for d in range(negative + 1):
+        if d == 0:
+            target = word_out
+            label = 1.0
+        else:
+            target = _sample_negative(cum_table, table_size, state)
+            if target == word_out:
+                continue
+            label = 0.0
+
+        l2 = syn1neg + target * size
+        f = sdot(&size, l1, &ONE, l2, &ONE)
+        if f > MAX_EXP:
+            g = (label - 1.0) * alpha
+        elif f < -MAX_EXP:
+            g = label * alpha
+        else:
+            g = (label - 1.0 / (1.0 + exp(-f))) * alpha
+        saxpy(&size, &g, l2, &ONE, work, &ONE)
+        saxpy(&size, &g, l1, &ONE, l2, &ONE)
+
+    saxpy(&size, &ONEF, work, &ONE, l1, &ONE)
+
+
+def unigram_table(counts, double power=0.75):
+    """Cumulative negative-sampling distribution over nodes.
+
+    Args:
+        counts (np.ndarray): node frequencies, e.g. from ``walk_graph``
+        power (float): smoothing exponent (default=0.75)
+
+    Returns:
+        np.ndarray: uint32 cumulative table ending at ``DOMAIN``
+    """
+    weights = np.power(np.asarray(counts, dtype=np.float64), power)
+    cumulative = np.cumsum(weights)
+    return np.round(cumulative / cumulative[-1] * DOMAIN).astype(np.uint32)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def train_walks(float [:, ::1] syn0, float [:, ::1] syn1neg,
+                index_t [:, :] walks, np.uint32_t [::1] cum_table,
+                float [::1] keep_probs, int window, int negative,
+                double start_alpha, double end_alpha,
+                unsigned long long seed):
+    """Train skip-gram with negative sampling on a batch of walks.
+
+    The learning rate decays linearly from ``start_alpha`` to ``end_alpha``
+    over the batch. Safe to call concurrently on shared ``syn0``/``syn1neg``.
+
+    Args:
+        syn0 (float[:, ::1]): input vectors, one row per node
+        syn1neg (float[:, ::1]): output vectors, one row per node
+        walks (index_t[:, :]): walks of node indices padded with -1
+        cum_table (np.uint32_t[::1]): output of :func:`unigram_table`
+        keep_probs (float[::1]): per node probability of keeping a token
+            (frequent-node subsampling)
+        window (int): maximum distance between center and context node
+        negative (int): number of negative samples per pair
+        start_alpha (float): learning rate at the first walk
+        end_alpha (float): learning rate at the last walk
+        seed (int): random seed of this batch
+
+    Returns:
+        int: number of tokens trained on
+    """
+    cdef:
+        int size = syn0.shape[1]
+        Py_ssize_t table_size = cum_table.shape[0]
+        Py_ssize_t num_walks = walks.shape[0]
+        Py_ssize_t walk_length = walks.shape[1]
+        Py_ssize_t i, j, pos, ctx, length, reduced
+        long long node, words = 0
+        unsigned long long state = seed
+        float alpha
+
+    work_buffer = np.zeros(size, dtype=np.float32)
+    sentence_buffer = np.zeros(max(walk_length, 1), dtype=np.int64)
+
+    cdef:
+        float [::1] work = work_buffer
+        np.int64_t [::1] sentence = sentence_buffer
+
+    if num_walks == 0 or window < 1:
+        return 0
+
+    with nogil:
+        for i in range(num_walks):
+            alpha = start_alpha + (end_alpha - start_alpha) * i / num_walks
+
+            length = 0
+            for j in range(walk_length):
+                node = walks[i, j]
+                if node < 0:  # end of walk
+                    break
+                if (keep_probs[node] < 1.0 and
+                        keep_probs[node] < (_random(&state) & 0xFFFF) /
+                        65536.0):
+                    continue
+                sentence[length] = node
+                length += 1
+
+            for pos in range(length):
+                reduced = _random(&state) % window
+                for ctx in range(max(0, pos - window + reduced),
+                                 min(length, pos + window + 1 - reduced)):
+                    if ctx == pos:
+                        continue
+                    _train_pair(&syn0[0, 0], &syn1neg[0, 0], &work[0], size,
+                                sentence[ctx], sentence[pos], negative,
+                                &cum_table[0], table_size, alpha, &state)
+            words += length
+
+    return words
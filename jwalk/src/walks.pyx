@@ -1,40 +1,400 @@
 # -*- coding: utf-8 -*-
-"""Perform random walks on sparse csr matrix."""
-from libc.stdlib cimport rand, RAND_MAX
+"""Perform random walks on sparse csr matrix.
 
+The kernels are fused over int32/int64 csr indices and float32/float64
+weights and write node indices into an integer walk buffer (padded with -1
+where a walk stops early); the Python wrappers map them to labels.
+
+Each kernel walks from a range of start nodes. Every walk draws from its own
+generator seeded by ``seed`` and its start node, so the walks do not depend
+on how start nodes are split into ranges or across processes.
+"""
 import cython
 cimport numpy as np
 import numpy as np
 
+ctypedef fused index_t:
+    np.int32_t
+    np.int64_t
+
+ctypedef fused weight_t:
+    np.float32_t
+    np.float64_t
+
+
+cdef inline unsigned long long _seed_state(unsigned long long seed,
+                                          Py_ssize_t node) nogil:
+    """Initial xorshift state of a walk (splitmix64, never zero)."""
+    cdef unsigned long long z = seed + (<unsigned long long> node + 1) * \
+        0x9E3779B97F4A7C15ULL
+    z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9ULL
+    z = (z ^ (z >> 27)) * 0x94D049BB133111EBULL
+    z = z ^ (z >> 31)
+    return z if z != 0 else 1
+
+
+@cython.cdivision(True)
+cdef inline double _uniform(unsigned long long *state) nogil:
+    """Uniform double in [0, 1) from an xorshift64* generator."""
+    cdef unsigned long long x = state[0]
+    x ^= x >> 12
+    x ^= x << 25
+    x ^= x >> 27
+    state[0] = x
+    return ((x * 2685821657736338717ULL) >> 11) / 9007199254740992.0
+
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
 @cython.cdivision(True)
-cdef Py_ssize_t _choose_one(double [:] pmf) nogil:
+cdef inline Py_ssize_t _choose_one(weight_t [:] pmf, Py_ssize_t start,
+                                   Py_ssize_t end,
+                                   unsigned long long *state) nogil:
     """Random choice with discrete probabilities.
 
     Args:
-        pmf (double[:]): probability mass function
+        pmf (weight_t[:]): probability mass function
+        start (Py_ssize_t): first position of the distribution in ``pmf``
+        end (Py_ssize_t): position after the last one (must be > start)
+        state: random number generator state
+
+    Returns:
+        position in [start, end)
     """
     cdef:
-        Py_ssize_t i, length
-        double random, total
+        Py_ssize_t i = start
+        double random, total = pmf[start]
 
-    random = rand() / (RAND_MAX + 1.0)
-    length = pmf.shape[0]
-    i = 0
-    total = 0.0
+    random = _uniform(state)
 
-    while total < random and i < length:
-        total += pmf[i]
+    while total <= random and i < end - 1:
         i += 1
-    return i - 1
+        total += pmf[i]
+    return i
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef inline Py_ssize_t _edge_row(index_t [:] indptr,
+                                 Py_ssize_t edge) nogil:
+    """Row of the csr entry stored at position ``edge`` (binary search)."""
+    cdef Py_ssize_t lo = 0, hi = indptr.shape[0] - 1, mid
+
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if indptr[mid] <= edge:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.nonecheck(False)
+@cython.cdivision(True)
+cdef Py_ssize_t _choose_neighbor_triangular(
+        index_t [:] indptr, index_t [:] indices,
+        weight_t [:] data, index_t [:] reverse_indptr,
+        index_t [:] reverse_edges, double strength,
+        Py_ssize_t node, unsigned long long *state) nogil:
+    """Weighted neighbor choice on an upper-triangular adjacency matrix.
+
+    Neighbors above the diagonal are read from the node's row, neighbors
+    below it through the reverse index of edge positions in its column.
+
+    Returns:
+        index of the chosen neighbor or -1 if the node has none
+    """
+    cdef:
+        Py_ssize_t k, edge, last = -1, last_edge = -1
+        double threshold, total = 0.0
+
+    threshold = _uniform(state) * strength
+
+    for k in range(indptr[node], indptr[node+1]):
+        total += data[k]
+        last = indices[k]
+        if total > threshold:
+            return last
+
+    for k in range(reverse_indptr[node], reverse_indptr[node+1]):
+        edge = reverse_edges[k]
+        total += data[edge]
+        if total > threshold:
+            return _edge_row(indptr, edge)
+        last_edge = edge
+
+    # rounding left the threshold unreached: fall back to the last neighbor
+    if last_edge >= 0:
+        return _edge_row(indptr, last_edge)
+    return last
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline void _record_walk(index_t [:, :] walks, Py_ssize_t row,
+                              Py_ssize_t length, np.int64_t [:] scratch,
+                              np.int64_t [:] lengths,
+                              np.int64_t [:] distinct) nogil:
+    """Accumulate realized length and distinct node count of a finished walk.
+
+    Distinct nodes are counted with ``scratch``, a small open-addressing set
+    (power of two size, at least twice the walk length) that is emptied again
+    before returning.
+    """
+    cdef:
+        Py_ssize_t j, slot, num_distinct = 0, mask = scratch.shape[0] - 1
+        np.int64_t node
+
+    for j in range(length):
+        node = walks[row, j]
+        slot = (<unsigned long long> node * 2654435761ULL) & mask
+        while scratch[slot] != -1 and scratch[slot] != node:
+            slot = (slot + 1) & mask
+        if scratch[slot] == -1:
+            scratch[slot] = node
+            num_distinct += 1
+
+    for j in range(mask + 1):
+        scratch[j] = -1
+
+    lengths[length] += 1
+    distinct[num_distinct] += 1
+
+
+def _stat_buffers(int walk_length):
+    """Histograms of walk lengths and distinct nodes, and the scratch set."""
+    size = 1
+    while size < 2 * walk_length:
+        size *= 2
+    return (np.zeros(walk_length + 1, dtype=np.int64),
+            np.zeros(walk_length + 1, dtype=np.int64),
+            np.full(size, -1, dtype=np.int64))
 
 
-@cython.profile(False)
 @cython.boundscheck(False)
 @cython.wraparound(False)
+def walk_indices(index_t [:] indptr, index_t [:] indices,
+                 weight_t [:] data, int walk_length, Py_ssize_t first=0,
+                 Py_ssize_t last=-1, unsigned long long seed=0):
+    """Random walk from every node of a normalized csr matrix.
+
+    Args:
+        indptr, indices, data: arrays of the normalized csr matrix
+        walk_length (int): length of walk
+        first (int): first start node (default=0)
+        last (int): start node after the last one (default=all nodes)
+        seed (int): random seed, mixed with each start node (default=0)
+
+    Returns:
+        np.ndarray walks of node indices (-1 padded), np.ndarray visit counts,
+        np.ndarray histogram of walk lengths, np.ndarray histogram of
+        distinct nodes per walk
+    """
+    cdef:
+        Py_ssize_t num_nodes = indptr.shape[0] - 1
+        Py_ssize_t i, j, node, start, end, length
+        unsigned long long state
+
+    if last < 0:
+        last = num_nodes
+    walks = np.full((last - first, walk_length), -1,
+                    dtype=np.asarray(indices).dtype)
+    counts = np.zeros(num_nodes, dtype=np.int64)
+    lengths, distinct, scratch = _stat_buffers(walk_length)
+
+    cdef:
+        index_t [:, :] walks_view = walks
+        np.int64_t [:] counts_view = counts
+        np.int64_t [:] lengths_view = lengths
+        np.int64_t [:] distinct_view = distinct
+        np.int64_t [:] scratch_view = scratch
+
+    with nogil:
+        for i in range(last - first):
+            node = first + i
+            state = _seed_state(seed, node)
+            walks_view[i, 0] = node
+            counts_view[node] += 1
+            length = 1
+            for j in range(1, walk_length):
+                start = indptr[node]
+                end = indptr[node+1]
+                if start == end:  # stop walk
+                    break
+                node = indices[_choose_one(data, start, end, &state)]
+                walks_view[i, j] = node
+                counts_view[node] += 1
+                length += 1
+            _record_walk(walks_view, i, length, scratch_view, lengths_view,
+                         distinct_view)
+
+    return walks, counts, lengths, distinct
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def walk_indices_triangular(index_t [:] indptr,
+                            index_t [:] indices,
+                            weight_t [:] data,
+                            index_t [:] reverse_indptr,
+                            index_t [:] reverse_edges,
+                            double [:] strengths, int walk_length,
+                            Py_ssize_t first=0, Py_ssize_t last=-1,
+                            unsigned long long seed=0):
+    """Random walk from every node of an upper-triangular csr matrix.
+
+    Args:
+        indptr, indices, data: arrays of the upper triangle (raw weights)
+        reverse_indptr, reverse_edges: reverse index of the strictly upper
+            entries grouped by column
+        strengths (double[:]): total edge weight incident to each node
+        walk_length (int): length of walk
+        first (int): first start node (default=0)
+        last (int): start node after the last one (default=all nodes)
+        seed (int): random seed, mixed with each start node (default=0)
+
+    Returns:
+        np.ndarray walks of node indices (-1 padded), np.ndarray visit counts,
+        np.ndarray histogram of walk lengths, np.ndarray histogram of
+        distinct nodes per walk
+    """
+    cdef:
+        Py_ssize_t num_nodes = indptr.shape[0] - 1
+        Py_ssize_t i, j, node, length
+        unsigned long long state
+
+    if last < 0:
+        last = num_nodes
+    walks = np.full((last - first, walk_length), -1,
+                    dtype=np.asarray(indices).dtype)
+    counts = np.zeros(num_nodes, dtype=np.int64)
+    lengths, distinct, scratch = _stat_buffers(walk_length)
+
+    cdef:
+        index_t [:, :] walks_view = walks
+        np.int64_t [:] counts_view = counts
+        np.int64_t [:] lengths_view = lengths
+        np.int64_t [:] distinct_view = distinct
+        np.int64_t [:] scratch_view = scratch
+
+    with nogil:
+        for i in range(last - first):
+            node = first + i
+            state = _seed_state(seed, node)
+            walks_view[i, 0] = node
+            counts_view[node] += 1
+            length = 1
+            for j in range(1, walk_length):
+                if strengths[node] <= 0:  # stop walk
+                    break
+                node = _choose_neighbor_triangular(
+                    indptr, indices, data, reverse_indptr, reverse_edges,
+                    strengths[node], node, &state)
+                if node < 0:
+                    break
+                walks_view[i, j] = node
+                counts_view[node] += 1
+                length += 1
+            _record_walk(walks_view, i, length, scratch_view, lengths_view,
+                         distinct_view)
+
+    return walks, counts, lengths, distinct
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def walk_indices_bipartite(index_t [:] item_indptr,
+                           index_t [:] item_indices,
+                           weight_t [:] item_data,
+                           index_t [:] user_indptr,
+                           index_t [:] user_indices,
+                           weight_t [:] user_data, int walk_length,
+                           Py_ssize_t first=0, Py_ssize_t last=-1,
+                           unsigned long long seed=0):
+    """Random walk from every item of a bipartite user-item graph.
+
+    Each step hops item -> user -> item; only items are written to the walk.
+
+    Args:
+        item_indptr, item_indices, item_data: normalized item->user csr
+        user_indptr, user_indices, user_data: normalized user->item csr
+        walk_length (int): number of items per walk
+        first (int): first start item (default=0)
+        last (int): start item after the last one (default=all items)
+        seed (int): random seed, mixed with each start node (default=0)
+
+    Returns:
+        np.ndarray walks of item indices (-1 padded), np.ndarray visit counts,
+        np.ndarray histogram of walk lengths, np.ndarray histogram of
+        distinct items per walk
+    """
+    cdef:
+        Py_ssize_t num_items = item_indptr.shape[0] - 1
+        Py_ssize_t i, j, node, user, start, end, length
+        unsigned long long state
+
+    if last < 0:
+        last = num_items
+    walks = np.full((last - first, walk_length), -1,
+                    dtype=np.asarray(item_indices).dtype)
+    counts = np.zeros(num_items, dtype=np.int64)
+    lengths, distinct, scratch = _stat_buffers(walk_length)
+
+    cdef:
+        index_t [:, :] walks_view = walks
+        np.int64_t [:] counts_view = counts
+        np.int64_t [:] lengths_view = lengths
+        np.int64_t [:] distinct_view = distinct
+        np.int64_t [:] scratch_view = scratch
+
+    with nogil:
+        for i in range(last - first):
+            node = first + i
+            state = _seed_state(seed, node)
+            walks_view[i, 0] = node
+            counts_view[node] += 1
+            length = 1
+            for j in range(1, walk_length):
+                start = item_indptr[node]
+                end = item_indptr[node+1]
+                if start == end:  # stop walk
+                    break
+                user = item_indices[_choose_one(item_data, start, end, &state)]
+                start = user_indptr[user]
+                end = user_indptr[user+1]
+                if start == end:
+                    break
+                node = user_indices[_choose_one(user_data, start, end, &state)]
+                walks_view[i, j] = node
+                counts_view[node] += 1
+                length += 1
+            _record_walk(walks_view, i, length, scratch_view, lengths_view,
+                         distinct_view)
+
+    return walks, counts, lengths, distinct
+
+
+def indices_to_labels(walks, labels):
+    """Map a walk buffer of node indices to an object array of labels.
+
+    Args:
+        walks (np.ndarray): walks of node indices padded with -1
+        labels (np.ndarray): array of node labels
+
+    Returns:
+        np.ndarray: walks of labels padded with ''
+    """
+    labeled = np.empty(walks.shape, dtype=object)
+    labeled.fill('')
+    mask = walks >= 0
+    labeled[mask] = labels[walks[mask]]
+    return labeled
+
+
 def walk_random(normalized_csr, np.ndarray labels, int walk_length):
     """Generate random walks for each node in a normalized sparse csr matrix.
 
@@ -46,32 +406,57 @@ def walk_random(normalized_csr, np.ndarray labels, int walk_length):
     Returns:
         np.array walks, np.array word frequencies
     """
-    cdef:
-        int [:] indices = normalized_csr.indices
-        int [:] indptr = normalized_csr.indptr
-        double [:] data = normalized_csr.data
-        int num_nodes = normalized_csr.shape[0]
-        long [:] vocab_cnt = np.ones(num_nodes, dtype=int)
-
-        int [:] neighbors
-        double [:] weights
-        int i, j, node_index, weight_index, next_index
-
-    walks = np.empty([num_nodes, walk_length], dtype=object)
-    walks.fill('')
-    walks.T[0] = labels
-
-    for i in range(num_nodes):
-        node_index = i
-        for j in range(walk_length-1):
-            neighbors = indices[indptr[node_index]:indptr[node_index+1]]
-            if neighbors.shape[0] == 0:  # stop walk
-                break
-            weights = data[indptr[node_index]:indptr[node_index+1]]
-            weight_index = _choose_one(weights)
-            next_index = neighbors[weight_index]
-            walks[i][j+1] = labels[next_index]
-            vocab_cnt[next_index] += 1
-            node_index = next_index
-
-    return walks, np.asarray(vocab_cnt)
+    walks, counts = walk_indices(normalized_csr.indptr,
+                                 normalized_csr.indices,
+                                 normalized_csr.data, walk_length)[:2]
+    return indices_to_labels(walks, labels), counts
+
+
+def walk_random_triangular(upper_csr, np.ndarray labels, int walk_length,
+                           reverse_indptr, reverse_edges, strengths):
+    """Generate random walks on an upper-triangular undirected csr matrix.
+
+    Args:
+        upper_csr (scipy.sparse.csr_matrix): upper triangle of the adjacency
+            matrix (raw weights, not normalized)
+        labels (np.ndarray): array of node labels
+        walk_length (int): length of walk
+        reverse_indptr (np.ndarray): per node offsets into ``reverse_edges``
+        reverse_edges (np.ndarray): positions of the strictly upper entries
+            grouped by column
+        strengths (np.ndarray): total edge weight incident to each node
+
+    Returns:
+        np.array walks, np.array word frequencies
+    """
+    walks, counts = walk_indices_triangular(upper_csr.indptr,
+                                            upper_csr.indices,
+                                            upper_csr.data, reverse_indptr,
+                                            reverse_edges, strengths,
+                                            walk_length)[:2]
+    return indices_to_labels(walks, labels), counts
+
+
+def walk_random_bipartite(normalized_item_user, normalized_user_item,
+                          np.ndarray labels, int walk_length):
+    """Generate item-only random walks on a bipartite user-item graph.
+
+    Args:
+        normalized_item_user (scipy.sparse.csr_matrix): normalized
+            item->user biadjacency matrix
+        normalized_user_item (scipy.sparse.csr_matrix): normalized
+            user->item biadjacency matrix
+        labels (np.ndarray): array of item labels
+        walk_length (int): length of walk
+
+    Returns:
+        np.array walks, np.array word frequencies
+    """
+    walks, counts = walk_indices_bipartite(normalized_item_user.indptr,
+                                           normalized_item_user.indices,
+                                           normalized_item_user.data,
+                                           normalized_user_item.indptr,
+                                           normalized_user_item.indices,
+                                           normalized_user_item.data,
+                                           walk_length)[:2]
+    return indices_to_labels(walks, labels), counts
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""Random walk statistics accumulated by the walk kernels."""
+import json
+
+import numpy as np
+
+__all__ = ['WalkStats']
+
+
+def _describe(histogram):
+    """Summary statistics of values given as a histogram (value -> count).
+
+    Examples:
+        >>> import numpy as np
+        >>> summary = _describe(np.array([0, 1, 0, 3]))
+        >>> summary['count'], summary['mean'], summary['min'], summary['max']
+        (4, 2.5, 1, 3)
+    """
+    count = int(histogram.sum())
+    if not count:
+        return {'count': 0}
+
+    values = np.arange(histogram.shape[0])
+    mean = float((values * histogram).sum()) / count
+    variance = float((histogram * (values - mean) ** 2).sum()) / count
+    cumulative = np.cumsum(histogram)
+
+    def percentile(q):
+        return int(np.searchsorted(cumulative, q * count))
+
+    present = np.flatnonzero(histogram)
+    return {
+        'count': count,
+        'mean': mean,
+        'std': variance ** 0.5,
+        'min': int(present[0]),
+        '25%': percentile(0.25),
+        '50%': percentile(0.5),
+        '75%': percentile(0.75),
+        'max': int(present[-1]),
+    }
+
+
+class WalkStats(object):
+    """Statistics of a set of random walks.
+
+    Built from what the walk kernels accumulate while walking, so no pass over
+    the walks themselves is needed. Stats of separately walked batches can be
+    combined with ``+``.
+
+    Args:
+        lengths (np.ndarray): histogram of realized walk lengths
+        distinct (np.ndarray): histogram of distinct nodes per walk
+        counts (np.ndarray): visits per node, start of walk included
+        starts (np.ndarray): walks started from each node
+    """
+
+    def __init__(self, lengths, distinct, counts, starts):
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.distinct = np.asarray(distinct, dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.starts = np.asarray(starts, dtype=np.int64)
+
+    def __add__(self, other):
+        return WalkStats(self.lengths + other.lengths,
+                         self.distinct + other.distinct,
+                         self.counts + other.counts,
+                         self.starts + other.starts)
+
+    def __repr__(self):
+        return ('WalkStats(num_walks=%d, dead_end_rate=%.4f, coverage=%.4f)'
+                % (self.num_walks, self.dead_end_rate, self.coverage))
+
+    @property
+    def num_walks(self):
+        """Number of walks."""
+        return int(self.lengths.sum())
+
+    @property
+    def walk_length(self):
+        """Maximum walk length."""
+        return self.lengths.shape[0] - 1
+
+    @property
+    def dead_end_rate(self):
+        """Fraction of walks stopped early at a node without neighbors."""
+        if not self.num_walks:
+            return 0.0
+        return float(self.lengths[:-1].sum()) / self.num_walks
+
+    @property
+    def coverage(self):
+        """Fraction of nodes reached by a step from another node."""
+        if not self.counts.shape[0]:
+            return 0.0
+        return float(np.mean(self.counts > self.starts))
+
+    def to_dict(self, include_counts=False):
+        """Summary as a JSON-serializable dict.
+
+        Args:
+            include_counts (bool): include per node visit counts
+
+        Returns:
+            dict
+        """
+        visits = self.counts
+        summary = {
+            'num_walks': self.num_walks,
+            'walk_length': self.walk_length,
+            'dead_end_rate': self.dead_end_rate,
+            'coverage': self.coverage,
+            'length': _describe(self.lengths),
+            'length_histogram': self.lengths.tolist(),
+            'distinct_nodes': _describe(self.distinct),
+            'distinct_nodes_histogram': self.distinct.tolist(),
+            'visits': {
+                'nodes': int(visits.shape[0]),
+                'total': int(visits.sum()),
+                'min': int(visits.min()) if visits.shape[0] else 0,
+                'mean': float(visits.mean()) if visits.shape[0] else 0.0,
+                'max': int(visits.max()) if visits.shape[0] else 0,
+            },
+        }
+        if include_counts:
+            summary['visit_counts'] = visits.tolist()
+        return summary
+
+    def to_json(self, include_counts=False, **kwargs):
+        """Summary as JSON; ``kwargs`` are passed to ``json.dumps``."""
+        return json.dumps(self.to_dict(include_counts), sort_keys=True,
+                          **kwargs)
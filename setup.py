@@ -34,8 +34,10 @@ def ext_modules():
 
     walks_ext = Extension('jwalk.walks', ['jwalk/src/walks.pyx'],
                           include_dirs=[numpy.get_include()])
+    sgns_ext = Extension('jwalk.sgns', ['jwalk/src/sgns.pyx'],
+                         include_dirs=[numpy.get_include()])
 
-    return [walks_ext]
+    return [walks_ext, sgns_ext]
 
 
 setup(
@@ -60,6 +62,7 @@ setup(
         'setuptools>=18.0',
         'Cython>=0.20',
         'numpy',
+        'scipy>=0.16',  # cython_blas for jwalk.sgns
         'pytest-runner',
         'setuptools_scm>=1.15.0',
         'sphinx_rtd_theme',
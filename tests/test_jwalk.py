@@ -1,7 +1,13 @@
 # -*- coding: utf-8 -*-
 """py.test unittests"""
 import os
+import sys
+import gzip
+import json
+import shutil
 import tempfile
+import threading
+import subprocess
 
 try:
     from unittest import mock
@@ -9,14 +15,25 @@ except ImportError:
     import mock
 
 import gensim
+import pytest
 import numpy as np
 import scipy.sparse as sps
 
+import jwalk
+from jwalk import cache
+from jwalk import checkpoint
+from jwalk import coldstart
 from jwalk import corpus
+from jwalk import evaluate
+from jwalk import factorize
 from jwalk import graph
 from jwalk import io
+from jwalk import pipeline
+from jwalk import quantize
 from jwalk import skipgram
+from jwalk import stats
 from jwalk import __main__
+from jwalk.labels import LabelStore
 
 DIR_PATH = os.path.dirname(os.path.realpath(__file__))
 KARATE_EDGELIST = os.path.join(DIR_PATH, 'data/karate.edgelist')
@@ -24,6 +41,10 @@ KARATE_EMBEDDINGS = os.path.join(DIR_PATH, 'data/karate.embeddings')
 KARATE_GRAPH = os.path.join(DIR_PATH, 'data/karate.npz')
 TEST_CORPUS = os.path.join(DIR_PATH, 'data/corpus.txt.gzip')
 
+# seconds allowed for a cold `import jwalk` / CLI parser construction
+IMPORT_TIME_BUDGET = 0.5
+HEAVY_MODULES = ('gensim', 'joblib', 'pandas', 'scipy.sparse')
+
 TEST_LABELS = np.array(['A', 'B', 'C'])
 TEST_CSR = sps.csr_matrix([[0.0, 1.0, 0.0],
                            [0.0, 0.0, 0.0],
@@ -64,6 +85,66 @@ def test_walk_graph():
     assert word_freq == {'A': 4, 'B': 6, 'C': 2}
 
 
+def test_walk_graph_chunked():
+    csr_matrix, labels = io.load_graph(KARATE_GRAPH)
+    costs = corpus.estimate_walk_cost(np.diff(csr_matrix.indptr), 10)
+    chunks = corpus.balanced_chunks(costs, 4)
+    assert chunks[0][0] == 0 and chunks[-1][1] == csr_matrix.shape[0]
+    assert all(last == first for (_, last), (first, _) in
+               zip(chunks, chunks[1:]))
+
+    single = corpus.walk_graph_indices(csr_matrix, walk_length=10,
+                                       num_walks=2, seed=1)
+    chunked = corpus.walk_graph_indices(csr_matrix, walk_length=10,
+                                        num_walks=2, n_jobs=2, seed=1)
+    assert np.array_equal(single[0], chunked[0])
+    assert np.array_equal(single[1], chunked[1])
+
+
+def test_expected_visit_counts():
+    expected = corpus.expected_visit_counts(TEST_CSR, walk_length=3,
+                                            num_walks=2)
+    assert np.allclose(expected, [4, 6, 2])
+
+    csr_matrix, labels = io.load_graph(KARATE_GRAPH)
+    walk_indices, counts = corpus.walk_graph_indices(
+        csr_matrix, walk_length=10, num_walks=200, seed=0)
+    expected = corpus.expected_visit_counts(csr_matrix, walk_length=10,
+                                            num_walks=200)
+    assert np.isclose(expected.sum(), counts.sum(), rtol=0.01)
+    assert np.allclose(expected, counts, rtol=0.1)
+
+
+def test_walk_stats():
+    walk_indices, counts, walk_stats = corpus.walk_graph_indices(
+        TEST_CSR, walk_length=3, num_walks=2, return_stats=True)
+    assert isinstance(walk_stats, stats.WalkStats)
+    assert walk_stats.num_walks == 6
+    assert np.array_equal(walk_stats.lengths, [0, 2, 2, 2])
+    assert np.array_equal(walk_stats.distinct, [0, 2, 2, 2])
+    assert np.array_equal(walk_stats.counts, [4, 6, 2])
+    assert walk_stats.dead_end_rate == 4 / 6.
+    assert walk_stats.coverage == 2 / 3.
+
+    summary = json.loads(walk_stats.to_json(include_counts=True))
+    assert summary['distinct_nodes']['max'] == 3
+    assert summary['visit_counts'] == [4, 6, 2]
+
+    merged = walk_stats + walk_stats
+    assert merged.num_walks == 12
+
+
+def test_walk_stats_repeated_nodes():
+    edges = np.array([['A', 'B'], ['C', 'C']])
+    upper, labels = graph.build_adjacency_matrix(edges, undirected=True,
+                                                 triangular=True)
+    walk_indices, counts, walk_stats = corpus.walk_graph_indices(
+        upper, walk_length=3, triangular=True, return_stats=True)
+    assert np.array_equal(walk_stats.lengths, [0, 0, 0, 3])
+    assert np.array_equal(walk_stats.distinct, [0, 1, 2, 0])
+    assert walk_stats.dead_end_rate == 0
+
+
 def test_encode_edges():
     edges = np.array([['A', 'B'],
                       ['A', 'C'],
@@ -90,6 +171,140 @@ def test_build_adjacency_matrix():
                                                  [0., 0., 0., 0.]])
 
 
+def test_build_adjacency_matrix_undirected():
+    edges = np.array([['A', 'B', '1'],
+                      ['B', 'A', '3'],
+                      ['B', 'C', '2'],
+                      ['C', 'C', '1']])
+    csr_matrix, labels = graph.build_adjacency_matrix(edges, undirected=True)
+    assert np.array_equal(csr_matrix.todense(), [[0., 3., 0.],
+                                                 [3., 0., 2.],
+                                                 [0., 2., 1.]])
+
+    csr_matrix, labels = graph.build_adjacency_matrix(edges, undirected=True,
+                                                      combine='mean',
+                                                      triangular=True)
+    assert np.array_equal(csr_matrix.todense(), [[0., 2., 0.],
+                                                 [0., 0., 2.],
+                                                 [0., 0., 1.]])
+
+
+def test_random_walks_triangular():
+    edges = np.array([['A', 'B'],
+                      ['B', 'A'],
+                      ['C', 'C']])
+    upper, labels = graph.build_adjacency_matrix(edges, undirected=True,
+                                                 triangular=True)
+    assert upper.nnz == 2
+    random_walks, word_freq = corpus.walk_graph(upper, labels, walk_length=3,
+                                                triangular=True)
+    assert np.array_equal(random_walks, [['A', 'B', 'A'],
+                                         ['B', 'A', 'B'],
+                                         ['C', 'C', 'C']])
+    assert word_freq == {'A': 3, 'B': 3, 'C': 3}
+
+
+def test_build_adjacency_matrix_dtypes():
+    edges = np.array([['A', 'B'], ['B', 'C']])
+    csr_matrix, labels = graph.build_adjacency_matrix(edges)
+    assert csr_matrix.indices.dtype == np.int32
+    assert csr_matrix.indptr.dtype == np.int32
+    assert csr_matrix.data.dtype == np.float32
+
+    csr_matrix, labels = graph.build_adjacency_matrix(
+        edges, index_dtype='int64', weight_dtype='float64')
+    assert csr_matrix.indices.dtype == np.int64
+    assert csr_matrix.indptr.dtype == np.int64
+    assert csr_matrix.data.dtype == np.float64
+    assert corpus.normalize_csr_matrix(csr_matrix).indices.dtype == np.int64
+
+    weighted = np.array([['A', 'B', 2 ** 24 + 1], ['B', 'C', 1]])
+    csr_matrix, _ = graph.build_adjacency_matrix(weighted)
+    assert csr_matrix.data.dtype == np.float64
+    assert csr_matrix[0, 1] == 2 ** 24 + 1
+
+
+def test_random_walks_dtypes():
+    for index_dtype in ['int32', 'int64']:
+        for weight_dtype in ['float32', 'float64']:
+            csr_matrix = graph.astype_graph(TEST_CSR.copy(), index_dtype,
+                                            weight_dtype)
+            random_walks, word_freq = corpus.walk_graph(csr_matrix,
+                                                        TEST_LABELS,
+                                                        walk_length=3)
+            assert np.array_equal(random_walks, [['A', 'B', ''],
+                                                 ['B', '', ''],
+                                                 ['C', 'A', 'B']])
+
+
+def test_label_store():
+    store = LabelStore.from_labels(np.array(['A', u'\xe9t\xe9', 'CC']))
+    assert len(store) == 3
+    assert store[1] == u'\xe9t\xe9' and store[-1] == 'CC'
+    assert store.index('CC') == 2 and 'D' not in store
+    assert store[np.array([2, 0])].tolist() == ['CC', 'A']
+    assert np.array_equal(store, [u'A', u'\xe9t\xe9', u'CC'])
+    assert store.__array__(copy=None).tolist() == store.tolist()  # numpy 2
+    for labels in ([b'A', u'\xe9t\xe9'.encode('utf-8'), b'CC'],
+                   [u'A', u'\xe9t\xe9', u'CC']):
+        packed = LabelStore.from_labels(labels)
+        assert packed.tolist() == store.tolist()
+    with mock.patch('jwalk.labels.PACK_BLOCK_ROWS', 2):
+        assert LabelStore.from_labels([10, 2, 33, '']).tolist() == \
+            ['10', '2', '33', '']
+    text = store.format_walks(np.array([[0, 2, -1], [1, 1, 0]]))
+    assert text.decode('utf-8') == u'A CC\n\xe9t\xe9 \xe9t\xe9 A\n'
+
+    dirname = tempfile.mkdtemp()
+    try:
+        loaded = LabelStore.load(store.save(dirname))
+        assert isinstance(loaded.data, np.memmap)
+        assert loaded.tolist() == store.tolist()
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_save_load_graph_dtypes():
+    csr_matrix = graph.astype_graph(TEST_CSR.copy(), 'int64', 'float32')
+    folder = tempfile.mkdtemp()
+    try:
+        path = io.save_graph(os.path.join(folder, 'graph.npz'), csr_matrix,
+                             TEST_LABELS)
+        loaded, labels = io.load_graph(path, index_dtype='int64')
+        assert loaded.indices.dtype == np.int64
+        assert loaded.data.dtype == np.float32
+        assert np.array_equal(loaded.todense(), TEST_CSR.todense())
+        assert np.array_equal(labels, TEST_LABELS)
+        assert isinstance(labels.data, np.memmap)
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_build_biadjacency_matrix():
+    interactions = np.array([['u1', 'A'],
+                             ['u1', 'B'],
+                             ['u2', 'B'],
+                             ['u2', 'B']])
+    csr_matrix, items = graph.build_biadjacency_matrix(interactions)
+    assert np.array_equal(items, ['A', 'B'])
+    assert np.array_equal(csr_matrix.todense(), [[1., 1.],
+                                                 [0., 2.]])
+
+
+def test_random_walks_bipartite():
+    interactions = np.array([['u1', 'A'],
+                             ['u2', 'B'],
+                             ['u2', 'C'],
+                             ['u3', 'C']])
+    csr_matrix, items = graph.build_biadjacency_matrix(interactions)
+    random_walks, word_freq = corpus.walk_graph(csr_matrix, items,
+                                                walk_length=3, bipartite=True)
+    assert random_walks.shape == (3, 3)
+    assert np.array_equal(random_walks[0], ['A', 'A', 'A'])
+    assert set(random_walks[1:].ravel()) <= {'B', 'C'}
+    assert sum(word_freq.values()) == 9
+
+
 def test_load_edges():
     edges = io.load_edges(KARATE_EDGELIST, delimiter=' ', has_header=False)
     assert np.array_equal(edges[0], ['1', '32'])
@@ -108,6 +323,151 @@ def test_build_corpus():
         random_walks, word_freqs = corpus.walk_graph(TEST_CSR, TEST_LABELS)
         corpus_path = corpus.build_corpus(random_walks, outpath=f.name)
         assert corpus_path == f.name
+        with open(corpus_path) as f_text:
+            assert sorted(f_text.read().splitlines()) == ['A B', 'B', 'C A B']
+
+
+def test_build_corpus_labels():
+    expected = ['1 2', '2', '3 1 2']
+    for labels in (np.array([1, 2, 3]), np.array([b'1', b'2', b'3'])):
+        random_walks, _ = corpus.walk_graph(TEST_CSR, labels)
+        with tempfile.NamedTemporaryFile() as f:
+            corpus.build_corpus(random_walks, outpath=f.name)
+            with open(f.name) as f_text:
+                assert sorted(f_text.read().splitlines()) == expected
+
+    random_walks, _ = corpus.walk_graph(
+        TEST_CSR, np.array([u'\xe9'.encode('utf-8'), b'b', b'c'],
+                           dtype=object))
+    with tempfile.NamedTemporaryFile() as f:
+        corpus.build_corpus(random_walks, outpath=f.name)
+        with open(f.name, 'rb') as f_text:
+            assert sorted(f_text.read().splitlines()) == [
+                b'b', b'c \xc3\xa9 b', b'\xc3\xa9 b']
+
+
+def test_write_corpus():
+    walk_indices = np.array([[0, 1, -1], [1, -1, -1], [2, 0, 1]] * 5)
+    expected = ['A B', 'B', 'C A B'] * 5
+    folder = tempfile.mkdtemp()
+    try:
+        with mock.patch.object(corpus, 'CORPUS_BLOCK_WALKS', 2):
+            paths = corpus.write_corpus(
+                walk_indices, os.path.join(folder, 'corpus.txt.gz'),
+                TEST_LABELS, num_shards=4, n_jobs=3)
+        assert [os.path.basename(path) for path in paths] == [
+            'corpus.txt-%05d-of-00004.gz' % shard for shard in range(4)]
+        lines = []
+        for path in paths:
+            with gzip.open(path, 'rb') as f:
+                lines.extend(f.read().decode('utf-8').splitlines())
+        assert lines == expected
+
+        model = skipgram.train_model(paths, size=10, window=2)
+        assert len(model.wv.vocab) == 3
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_load_graph_cached():
+    folder = tempfile.mkdtemp()
+    try:
+        edgelist = os.path.join(folder, 'karate.edgelist')
+        shutil.copy(KARATE_EDGELIST, edgelist)
+        cache_dir = os.path.join(folder, 'cache')
+        options = {'delimiter': ' ', 'undirected': True}
+        csr_matrix, labels = cache.load_graph_cached(edgelist, cache_dir,
+                                                     **options)
+        with mock.patch.object(cache, '_build_graph') as build_graph:
+            cached, cached_labels = cache.load_graph_cached(
+                edgelist, cache_dir, **options)
+            assert not build_graph.called
+        assert not cached.indices.flags.owndata  # views of the memory maps
+        assert (cached != csr_matrix).nnz == 0
+        assert cached.indices.dtype == csr_matrix.indices.dtype
+        assert cached.data.dtype == csr_matrix.data.dtype
+        assert np.array_equal(
+            corpus.walk_graph_indices(cached, 10, seed=1)[1],
+            corpus.walk_graph_indices(csr_matrix, 10, seed=1)[1])
+        assert np.array_equal(cached_labels, labels)
+        assert os.listdir(cache_dir) == [
+            cache.graph_cache_key(edgelist, **options)]
+        entry = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+        assert os.stat(entry).st_mode & 0o777 == 0o777 & ~cache._umask()
+
+        cache._makedirs(cache_dir)  # created by a concurrent job
+
+        # hits return the dtypes a build would
+        options = dict(options, index_dtype='int64', weight_dtype='float64')
+        for _ in range(2):
+            cached, _ = cache.load_graph_cached(edgelist, cache_dir,
+                                               **options)
+            assert cached.indices.dtype == cached.indptr.dtype == np.int64
+            assert cached.data.dtype == np.float64
+
+        key = cache.graph_cache_key(edgelist, **options)
+        assert cache.graph_cache_key(edgelist, triangular=True,
+                                     **options) != key
+        with mock.patch.object(cache, 'CACHE_FORMAT', cache.CACHE_FORMAT + 1):
+            assert cache.graph_cache_key(edgelist, **options) != key
+        with open(edgelist, 'a') as f:
+            f.write('1 35\n')
+        assert cache.graph_cache_key(edgelist, **options) != key
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_walk_graph_checkpointed():
+    csr_matrix, labels = io.load_graph(KARATE_GRAPH)
+    walk_indices, counts = corpus.walk_graph_indices(
+        csr_matrix, walk_length=10, num_walks=2, seed=1)
+    folder = tempfile.mkdtemp()
+    try:
+        paths, walk_stats = checkpoint.walk_graph_checkpointed(
+            csr_matrix, labels, os.path.join(folder, 'full'), 10, 2, seed=1)
+        assert np.array_equal(walk_stats.counts, counts)
+        lines = []
+        for path in paths:
+            with open(path) as f:
+                lines.extend(f.read().splitlines())
+        assert len(lines) == walk_indices.shape[0]
+
+        # interrupted after 3 segments, resumed with other workers
+        commit, committed = checkpoint._commit, []
+
+        def interrupt(*args):
+            if len(committed) == 3:
+                raise KeyboardInterrupt
+            committed.append(args[3])
+            return commit(*args)
+
+        resumed_dir = os.path.join(folder, 'resumed')
+        with mock.patch.object(checkpoint, '_commit', interrupt):
+            try:
+                checkpoint.walk_graph_checkpointed(
+                    csr_matrix, labels, resumed_dir, 10, 2, seed=1)
+            except KeyboardInterrupt:
+                pass
+        with open(os.path.join(resumed_dir, 'manifest.json')) as f:
+            assert len(json.load(f)['completed']) == 3
+        resumed, resumed_stats = checkpoint.walk_graph_checkpointed(
+            csr_matrix, labels, resumed_dir, 10, 2, n_jobs=2)
+        for path, resumed_path in zip(paths, resumed):
+            with open(path) as f, open(resumed_path) as f_resumed:
+                assert f.read() == f_resumed.read()
+        for name in ('lengths', 'distinct', 'counts', 'starts'):
+            assert np.array_equal(getattr(resumed_stats, name),
+                                  getattr(walk_stats, name))
+        assert np.array_equal(walk_stats.starts, np.full(34, 2))
+
+        # same shape and number of edges, other weights
+        reweighted = csr_matrix.copy()
+        reweighted.data = reweighted.data * 2
+        with pytest.raises(AssertionError):
+            checkpoint.walk_graph_checkpointed(
+                reweighted, labels, resumed_dir, 10, 2)
+    finally:
+        shutil.rmtree(folder)
 
 
 def test_train_model():
@@ -134,6 +494,185 @@ def test_train_skipgram():
         assert model.vector_size == 50
 
 
+def test_walk_and_train():
+    csr_matrix, labels = io.load_graph(KARATE_GRAPH)
+    train, passes = skipgram.Skipgram.train, []
+
+    def train_once(model, batch, **kwargs):
+        passes.append((len(batch), kwargs['epochs']))
+        return train(model, batch, **kwargs)
+
+    with mock.patch.object(skipgram.Skipgram, 'train', train_once):
+        model, walk_stats = pipeline.walk_and_train(
+            csr_matrix, labels, 10, 2, size=16, workers=1, seed=1)
+    epochs = model.epochs if hasattr(model, 'epochs') else model.iter
+    assert sum(walks for walks, _ in passes) == epochs * 2 * 34
+    assert set(epochs for _, epochs in passes) == {1}
+    assert walk_stats.num_walks == 2 * 34
+
+    # same vocabulary as training on a corpus of the same walks
+    walk_indices, counts = corpus.walk_graph_indices(csr_matrix, 10, 2,
+                                                     seed=1)
+    assert np.array_equal(walk_stats.counts, counts)
+    with tempfile.NamedTemporaryFile() as f:
+        corpus.build_corpus(walk_indices, f.name, labels)
+        batch_model = skipgram.train_model(
+            f.name, size=16, word_freq=dict(zip(labels, counts.tolist())),
+            corpus_count=2 * 34)
+    assert {word: vocab.count for word, vocab in model.wv.vocab.items()} == \
+        {word: vocab.count for word, vocab in batch_model.wv.vocab.items()}
+
+    # walkers blocked on the full queue stop when training fails
+    with mock.patch.object(skipgram.Skipgram, 'train',
+                           side_effect=RuntimeError):
+        with pytest.raises(RuntimeError):
+            pipeline.walk_and_train(csr_matrix, labels, 10, 50, size=16,
+                                    workers=2, batch_walks=1, queue_size=1)
+    assert not [thread for thread in threading.enumerate()
+                if thread.name.startswith('jwalk-walker')]
+
+
+def test_train_native():
+    walk_indices, counts = corpus.walk_graph_indices(TEST_CSR, walk_length=3,
+                                                     num_walks=2)
+    vectors = skipgram.train_native(walk_indices, counts, size=10, window=2,
+                                    workers=2, epochs=2)
+    assert vectors.shape == (3, 10)
+    assert vectors.dtype == np.float32
+    assert np.isfinite(vectors).all()
+
+    keyed_vectors = skipgram.to_keyed_vectors(vectors, TEST_LABELS, counts)
+    assert np.array_equal(keyed_vectors['B'], vectors[1])
+    assert keyed_vectors.vocab['B'].count == 6
+
+
+def test_quantize():
+    random_state = np.random.RandomState(0)
+    centers = random_state.randn(10, 16)
+    vectors = centers[np.arange(500) % 10] + 0.1 * random_state.randn(500, 16)
+    keyed_vectors = skipgram.to_keyed_vectors(vectors.astype(np.float32),
+                                              np.arange(500).astype(str))
+    for method in ['float16', 'int8', 'pq']:
+        quantized = quantize.quantize_model(keyed_vectors, method)
+        rows, scores = quantized.search(vectors[:20], 5)
+        assert np.all(np.diff(scores, axis=1) <= 0)
+        assert np.all(rows % 10 == np.arange(20)[:, None] % 10)
+        with tempfile.NamedTemporaryFile(suffix='.npz') as f:
+            loaded = quantize.load_quantized(quantized.save(f.name))
+            assert np.array_equal(loaded.search(vectors[:20], 5)[0], rows)
+        similar = [int(label) for label, _ in quantized.most_similar('0')]
+        assert len(similar) == 10 and 0 not in similar
+        assert all(label % 10 == 0 for label in similar)
+    with pytest.raises(TypeError):  # abstract
+        quantize.QuantizedVectors(['0'], codes=np.zeros((1, 16)))
+
+
+def test_coldstart():
+    vectors = np.eye(4, dtype=np.float32)
+    keyed_vectors = skipgram.to_keyed_vectors(vectors, ['0', '1', '2', '3'])
+    csr_matrix, labels = graph.build_adjacency_matrix(
+        np.array([['0', '1'], ['1', '2'], ['2', '3']]), undirected=True)
+    new_edges = np.array([['a', '0', 1], ['a', '1', 3], ['b', 'a', 1]])
+
+    new_labels, new_vectors = jwalk.ColdStart(keyed_vectors, window=1) \
+        .infer(new_edges)
+    assert new_labels.tolist() == ['a', 'b']
+    assert np.allclose(new_vectors[0], [0.25, 0.75, 0, 0])
+    assert np.allclose(new_vectors[1], new_vectors[0])  # only linked to a
+
+    cold_start = jwalk.ColdStart(keyed_vectors, csr_matrix, labels, window=2)
+    _, walk_vectors = cold_start.infer(new_edges)
+    # step 2 goes from 0 to 1 and from 1 to 0 or 2, at half weight
+    expected = (np.array([0.25, 0.75, 0, 0]) +
+                0.5 * np.array([0.375, 0.25, 0.375, 0])) / 1.5
+    assert np.allclose(walk_vectors[0], expected)
+    folder = tempfile.mkdtemp()
+    try:
+        loaded = jwalk.ColdStart.load(cold_start.save(folder))
+        assert isinstance(loaded.smoothed, np.memmap)
+        assert np.allclose(loaded.infer(new_edges)[1], walk_vectors)
+    finally:
+        shutil.rmtree(folder)
+
+    # only the rows of known neighbors are decoded
+    int8 = quantize.quantize_model(keyed_vectors, 'int8')
+    with mock.patch.object(int8, 'reconstruct',
+                           wraps=int8.reconstruct) as reconstruct:
+        jwalk.ColdStart(int8, window=1).infer(new_edges)
+        assert reconstruct.call_args[0][0].tolist() == [0, 1]
+
+    model = gensim.models.Word2Vec([['0', '1'], ['1', '2']], min_count=1)
+    vectors, _ = coldstart._vector_table(model)  # gensim < 3.4 has syn0
+    assert jwalk.add_vectors(model, ['a'], vectors[:1]) is model.wv
+
+    jwalk.add_vectors(keyed_vectors, new_labels, new_vectors)
+    assert np.allclose(keyed_vectors['a'], new_vectors[0])
+    quantized = quantize.quantize_model(keyed_vectors, 'int8')
+    quantized.add(walk_vectors, ['c', 'd'])
+    assert quantized.labels.lookup(['a', 'd', 'e']).tolist() == [4, 7, -1]
+    assert quantized.search(walk_vectors[:1], 1)[0][0, 0] in (6, 7)
+
+
+def test_factorize():
+    edges = io.load_edges(KARATE_EDGELIST, delimiter=' ')
+    csr_matrix, _ = graph.build_adjacency_matrix(edges, undirected=True)
+    adjacency = csr_matrix.toarray()
+    degrees = adjacency.sum(axis=1)
+    transitions = adjacency / degrees[:, None]
+    total = sum(np.linalg.matrix_power(transitions, r) for r in range(1, 4))
+    expected = np.log(np.maximum(
+        degrees.sum() / 3.0 * total / degrees[None, :], 1))
+
+    matrix = factorize.netmf_matrix(csr_matrix, window=3, prune=0)
+    assert np.allclose(matrix.toarray(), expected, atol=1e-5)
+    pruned = factorize.netmf_matrix(csr_matrix, window=3)
+    assert pruned.nnz <= matrix.nnz
+    assert np.all(pruned.toarray() <= expected + 1e-5)
+
+    u, s, _ = factorize.randomized_svd(matrix, 4, seed=0)
+    assert np.allclose(s, np.linalg.svd(expected)[1][:4], rtol=1e-3)
+    vectors = factorize.factorize_graph(csr_matrix, 50, window=3, seed=0)
+    assert vectors.shape == (34, 50) and not vectors[:, 34:].any()
+
+
+def test_evaluate():
+    edges = np.array([['a', 'b'], ['b', 'a'], ['b', 'c'], ['c', 'd'],
+                      ['d', 'a'], ['a', 'a'], ['a', 'c']])
+    train_edges, test_pairs = evaluate.split_edges(edges, 0.5, seed=0)
+    assert 0 < len(test_pairs) <= 3  # half of the 6 pairs at most
+    held = set(map(frozenset, test_pairs))
+    assert not held & set(map(frozenset, train_edges))  # both directions
+    assert set(train_edges.ravel()) == set('abcd')
+    assert ['a', 'a'] in train_edges.tolist()
+
+    non_edges = evaluate.sample_non_edges(edges, 5, seed=0)
+    assert set(map(frozenset, non_edges)) == {frozenset('bd')}
+
+    # a pair linked in one direction only is linked: never a non-edge, and
+    # held out without its reverse left behind for training
+    directed = np.array([['a', 'b'], ['b', 'c'], ['c', 'a'], ['a', 'c'],
+                         ['c', 'd'], ['d', 'b']])
+    for seed in range(10):
+        train_edges, test_pairs = evaluate.split_edges(directed, 0.5,
+                                                       seed=seed)
+        assert not (set(map(frozenset, test_pairs)) &
+                    set(map(frozenset, train_edges)))
+    non_edges = evaluate.sample_non_edges(directed, 5, seed=0)
+    assert set(map(frozenset, non_edges)) == {frozenset('ad')}
+
+    assert evaluate.rank_auc([2, 3], [1, 2]) == 0.875
+    assert evaluate.hits_at_k(np.array([2, 3]), np.array([1, 2]), 1) == 0.5
+    assert evaluate.hits_at_k(np.array([2, 3]), np.array([1, 2]), 2) == 1.0
+    keyed_vectors = skipgram.to_keyed_vectors(
+        np.array([[1, 0], [1, 0.1], [0, 1]], dtype=np.float32),
+        ['a', 'b', 'c'])
+    scores = evaluate.link_prediction_scores(
+        keyed_vectors, np.array([['a', 'b'], ['a', 'x']]),
+        np.array([['a', 'c'], ['b', 'c']]), hits=(1,))
+    assert scores == {'auc': 1.0, 'hits@1': 1.0, 'num_test_pairs': 1,
+                      'num_non_edges': 2}
+
+
 def test_jwalk():
     with tempfile.NamedTemporaryFile() as f:
         res = __main__.jwalk(KARATE_EDGELIST, outfile=f.name, delimiter=' ')
@@ -154,6 +693,91 @@ def test_gensim_load():
         assert '1' in model.wv.vocab
 
 
+def test_jwalk_bipartite():
+    with tempfile.NamedTemporaryFile() as f:
+        res = __main__.jwalk(KARATE_EDGELIST, outfile=f.name, delimiter=' ',
+                             bipartite=True)
+        assert res == f.name
+        with pytest.raises(AssertionError):
+            __main__.jwalk(KARATE_EDGELIST, outfile=f.name, delimiter=' ',
+                           bipartite=True, undirected=True)
+
+
+def test_jwalk_native():
+    with tempfile.NamedTemporaryFile() as f:
+        __main__.jwalk(KARATE_EDGELIST, outfile=f.name, delimiter=' ',
+                       trainer='native')
+        keyed_vectors = gensim.models.KeyedVectors.load(f.name)
+        assert '1' in keyed_vectors.vocab
+
+
+def test_jwalk_netmf():
+    with tempfile.NamedTemporaryFile() as f:
+        __main__.jwalk(KARATE_EDGELIST, outfile=f.name, delimiter=' ',
+                       trainer='netmf', undirected=True)
+        keyed_vectors = gensim.models.KeyedVectors.load(f.name)
+        assert '1' in keyed_vectors.vocab
+
+
+def test_jwalk_evaluate():
+    with tempfile.NamedTemporaryFile() as f:
+        with tempfile.NamedTemporaryFile(suffix='.jsonl') as f_eval:
+            for trainer in ('native', 'netmf'):
+                __main__.evaluate_embedding(
+                    KARATE_EDGELIST, outfile=f.name, evaluate=0.2,
+                    eval_path=f_eval.name, delimiter=' ', undirected=True,
+                    trainer=trainer, embedding_size=16, seed=0)
+            with open(f_eval.name) as f_json:
+                reports = [json.loads(line) for line in f_json]
+    assert [report['params']['trainer'] for report in reports] == \
+        ['native', 'netmf']
+    assert reports[0]['scores']['num_test_pairs'] > 0
+    assert 0 <= reports[0]['scores']['auc'] <= 1
+    assert set(reports[0]['timings']) == {'split', 'graph', 'walks',
+                                          'train', 'score'}
+    assert 'walks' not in reports[1]['timings']
+
+    # the training graph is built from the split, whatever the delimiter
+    folder = tempfile.mkdtemp()
+    try:
+        graph_path = os.path.join(folder, 'train.npz')
+        __main__.evaluate_embedding(
+            KARATE_EDGELIST, os.path.join(folder, 'model'), evaluate=0.2,
+            delimiter=r'\s+', undirected=True, trainer='native',
+            embedding_size=16, seed=0, graph_path=graph_path)
+        edges = io.load_edges(KARATE_EDGELIST, ' ')
+        train_edges, _ = evaluate.split_edges(edges, 0.2, seed=0)
+        csr_matrix, labels = io.load_graph(graph_path)
+        assert len(labels) == 34
+        assert csr_matrix.nnz == graph.build_adjacency_matrix(
+            train_edges, undirected=True)[0].nnz
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_jwalk_pipeline():
+    with tempfile.NamedTemporaryFile() as f:
+        with tempfile.NamedTemporaryFile(suffix='.json') as f_stats:
+            __main__.jwalk(KARATE_EDGELIST, outfile=f.name, delimiter=' ',
+                           pipeline=True, stats_path=f_stats.name)
+            with open(f_stats.name) as f_json:
+                summary = json.load(f_json)
+        model = gensim.models.Word2Vec.load(f.name)
+        assert len(model.wv.vocab) == 34
+        assert summary['num_walks'] == 2 * 34
+
+
+def test_jwalk_stats():
+    with tempfile.NamedTemporaryFile() as f:
+        with tempfile.NamedTemporaryFile(suffix='.json') as f_stats:
+            __main__.jwalk(KARATE_EDGELIST, outfile=f.name, delimiter=' ',
+                           stats=True, stats_path=f_stats.name)
+            with open(f_stats.name) as f_json:
+                summary = json.load(f_json)
+            assert summary['num_walks'] == 2 * 34
+            assert len(summary['visit_counts']) == 34
+
+
 def test_adjacency():
     with tempfile.NamedTemporaryFile() as f:
         res = __main__.jwalk(KARATE_GRAPH, outfile=f.name, delimiter=' ')
@@ -165,3 +789,30 @@ def test_parser():
     args = parser.parse_args(['--input', 'infile', '--output', 'outfile'])
     assert args.infile == 'infile'
     assert args.outfile == 'outfile'
+
+
+def _profile_import(statement):
+    code = ("import sys, time; t = time.time(); {}; print(time.time() - t); "
+            "print(' '.join(m for m in {!r} if m in sys.modules))"
+            .format(statement, HEAVY_MODULES))
+    out = subprocess.check_output([sys.executable, '-c', code]).decode()
+    elapsed, _, loaded = out.partition('\n')
+    return float(elapsed), loaded.split()
+
+
+def test_import_time_budget():
+    for statement in ['import jwalk',
+                      'import jwalk.__main__; jwalk.__main__.create_parser()']:
+        elapsed, loaded = _profile_import(statement)
+        assert loaded == []
+        assert elapsed < IMPORT_TIME_BUDGET
+
+
+def test_lazy_public_api():
+    for name in jwalk.__all__:
+        module = getattr(jwalk, jwalk._LAZY_ATTRS[name])
+        assert name in module.__all__
+        assert getattr(jwalk, name) is getattr(module, name)
+    for name in jwalk._SUBMODULES:
+        module = getattr(jwalk, name)
+        assert set(module.__all__) <= set(jwalk.__all__), name